@@ -3,48 +3,161 @@ from ninja.security import HttpBearer
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from django.contrib.auth import get_user_model
 from django.shortcuts import get_object_or_404
-from restaurants.models import Card, MenuItem, CardItem, CardPayment, Restaurant, RestaurantUser
-from .schemas import CardSchema, MenuItemSchema, CardItemCreateSchema, CardPaymentCreateSchema, UserProfileSchema
+from django.db import transaction
+from django.db.models import Prefetch
+from restaurants.models import Card, CardVersion, DeletedCard, MenuItem, MenuVersion, CardItem, CardPayment, Restaurant, RestaurantUser, baixar_estoque_em_lote, marcar_comanda_alterada
+from .schemas import CardSchema, CardSyncSchema, MenuItemSchema, CardItemCreateSchema, CardItemCreatedSchema, CardPaymentCreateSchema, UserProfileSchema
 from ninja.errors import ValidationError
 from decimal import Decimal
-from django.http import HttpResponse
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from io import BytesIO
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from restaurants import cupons, escpos, events
+import hashlib
+from typing import List, Optional
 from django.utils import timezone
 from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class AuthCache:
+    """Cache LRU com TTL de (user, restaurant, role) por `jti` do token."""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, jti):
+        with self._lock:
+            entry = self._entries.get(jti)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[jti]
+                return None
+            self._entries.move_to_end(jti)
+            return entry[1]
+
+    def set(self, jti, value, ttl):
+        with self._lock:
+            self._entries[jti] = (time.monotonic() + min(ttl, self.ttl), value)
+            self._entries.move_to_end(jti)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, predicate=None):
+        """Remove as entradas cujo (user, restaurant, role) satisfaz `predicate` (ou todas)"""
+        with self._lock:
+            for jti in [jti for jti, (_, value) in self._entries.items() if predicate is None or predicate(value)]:
+                del self._entries[jti]
+
+auth_cache = AuthCache()
+jwt_authentication = JWTAuthentication()
+
+def load_user_restaurant_and_role(validated_token):
+    """Resolve usuário, restaurante e papel numa única query (select_related)"""
+    user_id = validated_token[jwt_settings.USER_ID_CLAIM]
+    try:
+        restaurant_user = RestaurantUser.objects.select_related('user', 'restaurant').get(
+            **{f"user__{jwt_settings.USER_ID_FIELD}": user_id}
+        )
+        user, restaurant, role = restaurant_user.user, restaurant_user.restaurant, restaurant_user.role
+    except (RestaurantUser.DoesNotExist, RestaurantUser.MultipleObjectsReturned):
+        user, restaurant, role = jwt_authentication.get_user(validated_token), None, None
+    if not user.is_active:
+        raise AuthenticationFailed("Usuário inativo")
+    return user, restaurant, role
 
 class JWTAuth(HttpBearer):
     def authenticate(self, request, token):
         print(f"Validando token para {request.path}: {token[:20]}...")
         try:
-            jwt_auth = JWTAuthentication()
-            validated_token = jwt_auth.get_validated_token(token)
-            user = jwt_auth.get_user(validated_token)
+            validated_token = jwt_authentication.get_validated_token(token)
+            jti = validated_token.get(jwt_settings.JTI_CLAIM)
+            cached = auth_cache.get(jti) if jti else None
+            if cached is None:
+                cached = load_user_restaurant_and_role(validated_token)
+                if jti:
+                    auth_cache.set(jti, cached, validated_token['exp'] - time.time())
+            user, restaurant, role = cached
             print(f"Usuário autenticado: {user.username}, ID: {user.id}")
             request.user = user
+            request.restaurant = restaurant
+            request.restaurant_role = role
             return user
         except (InvalidToken, AuthenticationFailed) as e:
             print(f"Erro na autenticação JWT para {request.path}: {str(e)}")
             return None
 
+@receiver([post_save, post_delete], sender=RestaurantUser)
+def invalidar_cache_auth_usuario(sender, instance, **kwargs):
+    auth_cache.invalidate(lambda value: value[0].pk == instance.user_id)
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidar_cache_auth_user(sender, instance, **kwargs):
+    auth_cache.invalidate(lambda value: value[0].pk == instance.pk)
+
+@receiver([post_save, post_delete], sender=Restaurant)
+def invalidar_cache_auth_restaurante(sender, instance, **kwargs):
+    auth_cache.invalidate(lambda value: value[1] is not None and value[1].pk == instance.pk)
+
 api = NinjaAPI(auth=JWTAuth())
 menu_router = Router(auth=JWTAuth())
 
-def get_user_restaurant_and_role(user):
+def get_user_restaurant_and_role(user, request=None):
+    """Usa o restaurante/papel já resolvidos pelo JWTAuth; consulta o banco só como fallback"""
+    if request is not None and getattr(request, 'restaurant', None) is not None:
+        return request.restaurant, request.restaurant_role
     try:
-        restaurant_user = RestaurantUser.objects.get(user=user)
+        restaurant_user = RestaurantUser.objects.select_related('restaurant').get(user=user)
         return restaurant_user.restaurant, restaurant_user.role
     except RestaurantUser.DoesNotExist:
         raise Exception("Usuário não associado a um restaurante")
 
+def restaurant_etag(restaurant, *parts):
+    """ETag das versões de comandas e cardápio do restaurante (CardVersion e MenuVersion).
+
+    As versões saem na ordem do commit: uma alteração confirmada depois sempre muda o ETag,
+    mesmo que o updated_at dela seja anterior ao da última leitura."""
+    version = f"{restaurant.pk}:{CardVersion.current(restaurant.pk)}:{MenuVersion.current(restaurant.pk)}"
+    for part in parts:
+        version += f":{part}"
+    return '"' + hashlib.md5(version.encode()).hexdigest() + '"'
+
+def not_modified(request, etag):
+    if_none_match = request.headers.get('If-None-Match')
+    if not if_none_match:
+        return False
+    return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+
+def not_modified_response(etag):
+    response = HttpResponse(status=304)
+    response['ETag'] = etag
+    return response
+
+def cards_with_items(restaurant):
+    """Comandas do restaurante com itens e menu_item pré-carregados (2 queries no total)"""
+    return Card.objects.filter(restaurant=restaurant).prefetch_related(
+        Prefetch('card_items', queryset=CardItem.objects.select_related('menu_item'))
+    )
+
 @api.get("/restaurants/{restaurant_id}")
 def get_restaurant(request, restaurant_id: int):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant = get_object_or_404(Restaurant, id=restaurant_id)
-    restaurant_user = get_object_or_404(RestaurantUser, user=user, restaurant=restaurant)
+    restaurant = getattr(request, 'restaurant', None)
+    if restaurant is None or restaurant.id != restaurant_id:
+        restaurant = get_object_or_404(Restaurant, id=restaurant_id)
+        restaurant_user = get_object_or_404(RestaurantUser, user=user, restaurant=restaurant)
     return {
         "id": restaurant.id,
         "name": restaurant.name,
@@ -60,7 +173,7 @@ def get_user_profile(request):
         print("Autenticação falhou: usuário não autenticado")
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
     try:
-        restaurant, role = get_user_restaurant_and_role(user)
+        restaurant, role = get_user_restaurant_and_role(user, request)
         print(f"Restaurante: {restaurant}, Papel: {role}")
         return {"restaurant_id": restaurant.id, "role": role}
     except Exception as e:
@@ -68,24 +181,79 @@ def get_user_profile(request):
         return api.create_response(request, {"error": str(e)}, status=400)
 
 @api.get("/cards", response=list[CardSchema])
-def list_cards(request):
+def list_cards(request, response: HttpResponse):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
     
-    restaurant, _ = get_user_restaurant_and_role(user)
-    cards = Card.objects.filter(restaurant=restaurant, is_active=True)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    etag = restaurant_etag(restaurant, 'cards')
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response['ETag'] = etag
+    cards = cards_with_items(restaurant).filter(is_active=True)
     
     return [CardSchema.from_orm(card) for card in cards]
 
+@api.get("/cards/sync", response=CardSyncSchema)
+def sync_cards(request, since: Optional[str] = None):
+    """Sincronização incremental: sem `since` devolve todas as comandas ativas;
+    com `since` devolve só as alteradas depois do cursor e os ids das fechadas ou apagadas.
+
+    O cursor é a CardVersion do restaurante. Como as versões saem na ordem do commit, tudo
+    até o cursor já está visível; um cursor antigo (data ISO) recebe a lista completa."""
+    user = request.user
+    if not user.is_authenticated:
+        return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
+
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    since = int(since) if since and since.isdigit() else None
+    # O cursor é lido antes das comandas: o que mudar depois disso vem (de novo) na próxima chamada
+    cursor = CardVersion.current(restaurant.id)
+    cards = cards_with_items(restaurant).filter(is_active=True)
+    closed = []
+    if since is not None:
+        cards = cards.filter(version__gt=since)
+        closed = list(Card.objects.filter(
+            restaurant=restaurant, is_active=False, version__gt=since
+        ).values_list('id', flat=True))
+        closed += DeletedCard.objects.filter(restaurant=restaurant, version__gt=since).values_list('card_id', flat=True)
+
+    return {
+        "cursor": str(cursor),
+        "cards": [CardSchema.from_orm(card) for card in cards],
+        "closed": closed,
+    }
+
+@api.get("/cards/events")
+def card_events(request):
+    """Stream SSE com um evento `card` a cada alteração de comanda do restaurante."""
+    user = request.user
+    if not user.is_authenticated:
+        return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
+
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    if isinstance(request, ASGIRequest):
+        stream = events.stream_async(restaurant.id)
+    else:
+        stream = events.stream_sync(restaurant.id)
+    response = StreamingHttpResponse(stream, content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
 @menu_router.get("/menu-items", response=list[MenuItemSchema])
-def list_menu_items(request):
+def list_menu_items(request, response: HttpResponse):
     print(f"Requisição para /api/menu-items, usuário: {request.user}, autenticado: {request.user.is_authenticated}")
     user = request.user
     if not user.is_authenticated:
         print("Autenticação falhou: usuário não autenticado")
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    etag = restaurant_etag(restaurant, 'menu-items')
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response['ETag'] = etag
     menu_items = MenuItem.objects.filter(restaurant=restaurant, is_available=True)
     print(f"Itens encontrados: {list(menu_items)}")
     return menu_items
@@ -95,7 +263,7 @@ def add_card_item(request, card_id: int, payload: CardItemCreateSchema):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
     card = get_object_or_404(Card, id=card_id, restaurant=restaurant)
     menu_item = get_object_or_404(MenuItem, id=payload.menu_item_id, restaurant=restaurant)
     try:
@@ -119,12 +287,51 @@ def add_card_item(request, card_id: int, payload: CardItemCreateSchema):
         print(f"Erro ao criar CardItem: {str(e)}")
         return api.create_response(request, {"error": str(e)}, status=400)
 
+@api.post("/cards/{card_id}/items:batch", response=List[CardItemCreatedSchema])
+def add_card_items_batch(request, card_id: int, payload: List[CardItemCreateSchema]):
+    """Adiciona todos os itens de um pedido numa única transação (bulk_create + baixa de estoque em lote)"""
+    user = request.user
+    if not user.is_authenticated:
+        return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
+    if not payload:
+        return api.create_response(request, {"error": "Nenhum item informado"}, status=400)
+    if any(item.quantity <= 0 for item in payload):
+        return api.create_response(request, {"error": "Quantidade deve ser maior que 0"}, status=400)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    card = get_object_or_404(Card, id=card_id, restaurant=restaurant)
+    menu_items = MenuItem.objects.filter(restaurant=restaurant).in_bulk({item.menu_item_id for item in payload})
+    missing = sorted({item.menu_item_id for item in payload} - menu_items.keys())
+    if missing:
+        return api.create_response(request, {"error": f"Itens do cardápio não encontrados: {missing}"}, status=404)
+    try:
+        with transaction.atomic():
+            card_items = CardItem.objects.bulk_create([
+                CardItem(
+                    card=card,
+                    menu_item=menu_items[item.menu_item_id],
+                    quantity=item.quantity,
+                    price=menu_items[item.menu_item_id].price,
+                )
+                for item in payload
+            ])
+            # bulk_create não dispara signals: estoque, versão e evento da comanda são feitos aqui
+            baixar_estoque_em_lote(card_items)
+            marcar_comanda_alterada(restaurant.id, card.id)
+        logger.info("%s itens adicionados em lote à comanda %s", len(card_items), card.number)
+        return [
+            {"id": card_item.id, "menu_item_id": card_item.menu_item_id, "quantity": card_item.quantity}
+            for card_item in card_items
+        ]
+    except Exception as e:
+        logger.exception("Falha ao adicionar itens em lote à comanda %s", card.number)
+        return api.create_response(request, {"error": str(e)}, status=400)
+
 @api.delete("/cards/{card_id}/items/{item_id}")
 def delete_card_item(request, card_id: int, item_id: int):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
     card = get_object_or_404(Card, id=card_id, restaurant=restaurant)
     card_item = get_object_or_404(CardItem, id=item_id, card=card)
     card_item.delete()
@@ -135,7 +342,7 @@ def create_payment(request, payload: CardPaymentCreateSchema):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
     card = get_object_or_404(Card, id=payload.card_id, restaurant=restaurant)
     print(f"Criando pagamento para card_id={payload.card_id}, restaurant_id={restaurant.id}")
     try:
@@ -158,40 +365,36 @@ def create_payment(request, payload: CardPaymentCreateSchema):
         return api.create_response(request, {"error": str(e)}, status=400)
 
 @api.get("/card-payments/{card_id}/receipt")
-def get_receipt(request, card_id: int):
+def get_receipt(request, card_id: int, format: str = "pdf"):
+    """Cupom do último pagamento da comanda: format=pdf (padrão), escpos ou txt"""
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
-    card = get_object_or_404(Card, id=card_id, restaurant=restaurant)
-    payment = get_object_or_404(CardPayment, card=card)
-    buffer = BytesIO()
-    p = canvas.Canvas(buffer, pagesize=letter)
-    p.drawString(100, 750, f"Recibo - Comanda {card.number}")
-    p.drawString(100, 730, f"Restaurante: {restaurant.name}")
-    p.drawString(100, 710, f"Data: {timezone.now().strftime('%d/%m/%Y %H:%M')}")
-    p.drawString(100, 690, f"Método de Pagamento: {payment.payment_method}")
-    p.drawString(100, 670, f"Valor Pago: R$ {payment.paid_amount}")
-    y = 650
-    for item in card.card_items.all():
-        p.drawString(100, y, f"{item.quantity}x {item.menu_item.name} - R$ {item.subtotal()}")
-        y -= 20
-    p.drawString(100, y - 20, f"Total: R$ {card.total()}")
-    p.showPage()
-    p.save()
-    buffer.seek(0)
-    return HttpResponse(buffer, content_type='application/pdf')
+    if format not in ("pdf", "escpos", "txt"):
+        return api.create_response(request, {"error": f"Formato inválido: {format} (use pdf, escpos ou txt)"}, status=400)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    cupom = cupons.carregar_cupom(card_id=card_id, card__restaurant=restaurant)
+    if format == "escpos":
+        # Bytes crus para impressora térmica (o caixa envia direto ao spooler)
+        return HttpResponse(escpos.gerar_cupom_escpos(cupom), content_type=escpos.CONTENT_TYPE)
+    if format == "txt":
+        return HttpResponse(escpos.gerar_cupom_texto(cupom), content_type="text/plain; charset=utf-8")
+    return FileResponse(open(cupons.obter_cupom_pdf(cupom), 'rb'), content_type='application/pdf')
 
 api.add_router("/", menu_router)
 
 @api.get("/cards/{card_id}", response=CardSchema)
-def get_card_details(request, card_id: int):
+def get_card_details(request, card_id: int, response: HttpResponse):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
     
-    restaurant, _ = get_user_restaurant_and_role(user)
-    card = get_object_or_404(Card, id=card_id, restaurant=restaurant)
+    restaurant, _ = get_user_restaurant_and_role(user, request)
+    etag = restaurant_etag(restaurant, 'cards', card_id)
+    if not_modified(request, etag):
+        return not_modified_response(etag)
+    response['ETag'] = etag
+    card = get_object_or_404(cards_with_items(restaurant), id=card_id)
     return CardSchema.from_orm(card)
 
 @api.post("/cards", response=CardSchema)
@@ -199,15 +402,9 @@ def create_card(request):
     user = request.user
     if not user.is_authenticated:
         return api.create_response(request, {"error": "Autenticação necessária"}, status=401)
-    restaurant, _ = get_user_restaurant_and_role(user)
-    last_card = Card.objects.filter(restaurant=restaurant).order_by('-number').first()
-    new_number = last_card.number + 1 if last_card else 1
+    restaurant, _ = get_user_restaurant_and_role(user, request)
     try:
-        card = Card.objects.create(
-            restaurant=restaurant,
-            number=new_number,
-            is_active=True
-        )
+        card = Card.open(restaurant)
         print(f"Comanda criada: id={card.id}, number={card.number}, restaurant_id={card.restaurant.id}")
         return CardSchema.from_orm(card)
     except Exception as e:
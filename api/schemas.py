@@ -35,6 +35,7 @@ class CardSchema(BaseModel):
     @classmethod
     def from_orm(cls, obj):
         # Converter RelatedManager para lista de CardItemSchema
+        # (use cards_with_items() para que os itens venham pré-carregados)
         card_items = []
         for item in obj.card_items.all():
             card_items.append(CardItemSchema(
@@ -44,10 +45,10 @@ class CardSchema(BaseModel):
                 price=item.price,
                 subtotal=item.subtotal()
             ))
-        
-        # Calcular total manualmente
-        total = sum(item.subtotal() for item in obj.card_items.all())
-        
+
+        # Soma os itens já carregados (ou usa o total anotado / agregado no banco)
+        total = obj.total()
+
         return cls(
             id=obj.id,
             number=obj.number,
@@ -60,10 +61,20 @@ class CardSchema(BaseModel):
     class Config:
         from_attributes = True
 
+class CardSyncSchema(BaseModel):
+    cursor: Optional[str]  # versão das comandas (CardVersion); enviar como `since` na próxima sincronização
+    cards: List[CardSchema]  # comandas ativas alteradas desde `since`
+    closed: List[int]  # ids das comandas fechadas desde `since`
+
 class CardItemCreateSchema(BaseModel):
     menu_item_id: int
     quantity: Decimal
 
+class CardItemCreatedSchema(BaseModel):
+    id: int
+    menu_item_id: int
+    quantity: Decimal
+
 class CardPaymentCreateSchema(BaseModel):
     card_id: int
     payment_method: str
@@ -1,3 +1,360 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.api import auth_cache
+from cliente_comandas import ClienteComandas
+from restaurants import escpos, events
+from restaurants.models import (
+    Card, CardItem, CardPayment, CardVersion, MenuItem, Restaurant, RestaurantUser, StockMovement,
+)
+
+
+class ApiTestCase(TestCase):
+    """Restaurante com dono autenticado por JWT e dois itens no cardápio"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user('dono', password='x')
+        cls.restaurant = Restaurant.objects.create(
+            owner=cls.user, name='R', slug='r', address='Rua A', phone='1', email='r@r.com'
+        )
+        RestaurantUser.objects.create(user=cls.user, restaurant=cls.restaurant, role='owner')
+        cls.prato = MenuItem.objects.create(restaurant=cls.restaurant, name='Prato', price=Decimal('10.50'))
+        cls.bebida = MenuItem.objects.create(restaurant=cls.restaurant, name='Bebida', price=Decimal('3.33'))
+
+    def setUp(self):
+        auth_cache.invalidate()
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def abrir_comandas(self, quantidade, itens_por_comanda):
+        inicio = Card.objects.count() + 1
+        for numero in range(inicio, inicio + quantidade):
+            card = Card.objects.create(restaurant=self.restaurant, number=numero)
+            for i in range(itens_por_comanda):
+                menu_item = self.prato if i % 2 else self.bebida
+                CardItem.objects.create(card=card, menu_item=menu_item, price=menu_item.price, quantity=Decimal('1.5'))
+
+
+class ListCardsTests(ApiTestCase):
+    def listar(self):
+        response = self.client.get('/api/cards', **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_numero_de_queries_nao_depende_de_comandas_e_itens(self):
+        self.abrir_comandas(2, 1)
+        self.listar()  # aquece o cache de autenticação
+
+        # ETag (2 agregados) + comandas + itens com menu_item
+        with self.assertNumQueries(4):
+            self.listar()
+
+        self.abrir_comandas(20, 6)
+        with self.assertNumQueries(4):
+            cards = self.listar()
+        self.assertEqual(len(cards), 22)
+
+    def test_total_calculado_dos_itens_carregados(self):
+        self.abrir_comandas(1, 2)
+        card = self.listar()[0]
+        self.assertEqual(len(card['card_items']), 2)
+        self.assertEqual(Decimal(card['total']), Decimal('1.5') * (Decimal('10.50') + Decimal('3.33')))
+
+
+class EtagTests(ApiTestCase):
+    def get(self, url, etag=None):
+        cabecalhos = {'HTTP_IF_NONE_MATCH': etag} if etag else {}
+        return self.client.get(url, **self.auth, **cabecalhos)
+
+    def assertNaoMudou(self, url, etag):
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def assertMudou(self, url, etag):
+        response = self.get(url, etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_lista_de_comandas(self):
+        self.abrir_comandas(2, 1)
+        etag = self.get('/api/cards')['ETag']
+        self.assertNaoMudou('/api/cards', etag)
+        CardItem.objects.create(card=Card.objects.first(), menu_item=self.prato, price=self.prato.price)
+        etag = self.assertMudou('/api/cards', etag)
+        self.bebida.price = Decimal('4.00')  # o cardápio aparece dentro dos itens
+        self.bebida.save()
+        self.assertMudou('/api/cards', etag)
+
+    def test_alteracao_confirmada_depois_com_updated_at_antigo(self):
+        """Uma transação que começou antes e confirma depois ainda muda o ETag"""
+        self.abrir_comandas(2, 0)
+        a, b = Card.objects.order_by('number')
+        Card.objects.filter(pk=b.pk).update(updated_at=timezone.now() + timedelta(seconds=5))
+        etag = self.get('/api/cards')['ETag']
+        item = CardItem.objects.create(card=a, menu_item=self.prato, price=self.prato.price)
+        CardItem.objects.filter(pk=item.pk).update(updated_at=a.updated_at)
+        Card.objects.filter(pk=a.pk).update(updated_at=a.updated_at)
+        self.assertMudou('/api/cards', etag)
+
+    def test_detalhe_da_comanda(self):
+        self.abrir_comandas(1, 1)
+        card = Card.objects.get()
+        url = f'/api/cards/{card.id}'
+        etag = self.get(url)['ETag']
+        self.assertNotEqual(etag, self.get('/api/cards')['ETag'])
+        self.assertNaoMudou(url, etag)
+        CardItem.objects.filter(card=card).first().delete()
+        self.assertMudou(url, etag)
+
+    def test_cardapio(self):
+        etag = self.get('/api/menu-items')['ETag']
+        self.assertNaoMudou('/api/menu-items', etag)
+        self.prato.is_available = False
+        self.prato.save()
+        etag = self.assertMudou('/api/menu-items', etag)
+        self.assertEqual([item['name'] for item in self.get('/api/menu-items').json()], ['Bebida'])
+        MenuItem.objects.create(restaurant=self.restaurant, name='Suco', price=Decimal('6'))
+        etag = self.assertMudou('/api/menu-items', etag)
+        MenuItem.objects.get(name='Suco').delete()
+        self.assertMudou('/api/menu-items', etag)
+
+
+class SyncCardsTests(ApiTestCase):
+    def sincronizar(self, since=None):
+        params = {'since': since} if since is not None else {}
+        response = self.client.get('/api/cards/sync', params, **self.auth)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_devolve_so_o_que_mudou_depois_do_cursor(self):
+        self.abrir_comandas(3, 1)
+        inicial = self.sincronizar()
+        self.assertEqual(len(inicial['cards']), 3)
+        self.assertEqual(self.sincronizar(inicial['cursor'])['cards'], [])
+
+        card = Card.objects.order_by('number').first()
+        CardItem.objects.create(card=card, menu_item=self.prato, price=self.prato.price)
+        delta = self.sincronizar(inicial['cursor'])
+        self.assertEqual([c['id'] for c in delta['cards']], [card.id])
+        self.assertGreater(int(delta['cursor']), int(inicial['cursor']))
+
+    def test_cursor_nao_passa_de_alteracao_com_timestamp_antigo(self):
+        """A versão é dada no commit: uma alteração gravada com updated_at antigo ainda é entregue"""
+        self.abrir_comandas(1, 0)
+        card = Card.objects.get()
+        cursor = self.sincronizar()['cursor']
+        card.save()
+        Card.objects.filter(pk=card.pk).update(updated_at=card.created_at)  # relógio de outro processo
+        self.assertEqual([c['id'] for c in self.sincronizar(cursor)['cards']], [card.id])
+
+    def test_fechadas_e_apagadas_vem_em_closed(self):
+        self.abrir_comandas(3, 1)
+        fechada, apagada, aberta = Card.objects.order_by('number')
+        cursor = self.sincronizar()['cursor']
+        fechada.is_active = False
+        fechada.save()
+        apagada_id = apagada.id
+        apagada.delete()
+        delta = self.sincronizar(cursor)
+        self.assertEqual(sorted(delta['closed']), sorted([fechada.id, apagada_id]))
+        self.assertEqual(delta['cards'], [])
+
+    def test_cursor_antigo_em_data_recebe_lista_completa(self):
+        self.abrir_comandas(2, 0)
+        resposta = self.sincronizar('2024-01-01T10:00:00.000001')
+        self.assertEqual(len(resposta['cards']), 2)
+        self.assertEqual(resposta['closed'], [])
+
+
+class ItemsBatchTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.card = Card.objects.create(restaurant=self.restaurant, number=1)
+
+    def adicionar(self, itens):
+        return self.client.post(
+            f'/api/cards/{self.card.id}/items:batch', itens, content_type='application/json', **self.auth
+        )
+
+    def test_cada_item_gera_um_movimento_de_venda(self):
+        versao = CardVersion.current(self.restaurant.pk)
+        response = self.adicionar([
+            {'menu_item_id': self.prato.id, 'quantity': '2'},
+            {'menu_item_id': self.bebida.id, 'quantity': '1.5'},
+            {'menu_item_id': self.prato.id, 'quantity': '1'},
+        ])
+        self.assertEqual(response.status_code, 200)
+        criados = response.json()
+        self.assertEqual(len(criados), 3)
+        itens = CardItem.objects.filter(card=self.card).order_by('pk')
+        self.assertEqual([item.id for item in itens], [item['id'] for item in criados])
+        self.assertEqual([item.price for item in itens], [self.prato.price, self.bebida.price, self.prato.price])
+        movimentos = StockMovement.objects.filter(reason=StockMovement.Reason.SALE).order_by('card_item_id')
+        self.assertEqual(
+            [(m.card_item_id, m.menu_item_id, m.quantity) for m in movimentos],
+            [(item.id, item.menu_item_id, -item.quantity) for item in itens],
+        )
+        self.assertEqual(CardVersion.current(self.restaurant.pk), versao + 1)
+        self.card.refresh_from_db()
+        self.assertEqual(self.card.version, versao + 1)
+
+    def test_item_de_outro_restaurante_e_404(self):
+        dono = get_user_model().objects.create_user('outro', password='x')
+        outro = Restaurant.objects.create(owner=dono, name='O', slug='o', address='Rua B', phone='1', email='o@o.com')
+        alheio = MenuItem.objects.create(restaurant=outro, name='Alheio', price=Decimal('1'))
+        response = self.adicionar([
+            {'menu_item_id': self.prato.id, 'quantity': '1'},
+            {'menu_item_id': alheio.id, 'quantity': '1'},
+        ])
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(CardItem.objects.exists())
+
+    def test_lote_vazio_ou_quantidade_invalida_e_400(self):
+        self.assertEqual(self.adicionar([]).status_code, 400)
+        for quantidade in ('0', '-1'):
+            response = self.adicionar([
+                {'menu_item_id': self.prato.id, 'quantity': '1'},
+                {'menu_item_id': self.prato.id, 'quantity': quantidade},
+            ])
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardItem.objects.exists())
+
+    def test_falha_no_meio_desfaz_o_lote(self):
+        versao = CardVersion.current(self.restaurant.pk)
+        with mock.patch('api.api.marcar_comanda_alterada', side_effect=RuntimeError('banco caiu')), \
+                self.assertLogs('api.api', 'ERROR'):
+            response = self.adicionar([{'menu_item_id': self.prato.id, 'quantity': '1'}] * 3)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CardItem.objects.exists())
+        self.assertFalse(StockMovement.objects.exists())
+        self.assertEqual(CardVersion.current(self.restaurant.pk), versao)
+
+
+class CardEventsTests(ApiTestCase):
+    def test_sem_autenticacao_e_401(self):
+        self.assertEqual(self.client.get('/api/cards/events').status_code, 401)
+
+    def test_stream_recebe_alteracoes_do_restaurante(self):
+        response = self.client.get('/api/cards/events', **self.auth)
+        self.addCleanup(response.close)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        stream = iter(response.streaming_content)
+        self.assertEqual(next(stream), b'retry: 3000\n\n')
+        events.publish(self.restaurant.pk + 1, 'card', {'card_id': 1})  # outro restaurante
+        events.publish(self.restaurant.pk, 'card', {'card_id': 2})
+        self.assertEqual(next(stream), b'event: card\ndata: {"card_id": 2}\n\n')
+
+
+class AuthCacheTests(ApiTestCase):
+    def perfil(self):
+        return self.client.get('/api/user-profile', **self.auth).status_code
+
+    def test_usuario_apagado_deixa_de_autenticar(self):
+        self.assertEqual(self.perfil(), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.perfil(), 200)
+        get_user_model().objects.get(pk=self.user.pk).delete()
+        self.assertEqual(self.perfil(), 401)
+
+    def test_restaurante_apagado_sai_do_cache(self):
+        self.assertEqual(self.perfil(), 200)
+        Restaurant.objects.get(pk=self.restaurant.pk).delete()
+        self.assertIsNone(auth_cache.get(AccessToken(self.auth['HTTP_AUTHORIZATION'].split()[1])['jti']))
+
+
+class ReceiptTests(ApiTestCase):
+    def setUp(self):
+        super().setUp()
+        self.abrir_comandas(1, 2)
+        self.card = Card.objects.get()
+        CardPayment.objects.create(
+            restaurant=self.restaurant, card=self.card, payment_method=CardPayment.PaymentMethod.CASH,
+            paid_amount=Decimal('50'),
+        )
+
+    def cupom(self, formato, card_id=None):
+        url = f'/api/card-payments/{card_id or self.card.id}/receipt'
+        return self.client.get(url, {'format': formato}, **self.auth)
+
+    def test_escpos(self):
+        response = self.cupom('escpos')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], escpos.CONTENT_TYPE)
+        self.assertTrue(response.content.startswith(escpos.INICIALIZAR + escpos.CODEPAGE_PC860))
+        self.assertTrue(response.content.endswith(escpos.AVANCAR_E_CORTAR))
+
+    def test_texto(self):
+        response = self.cupom('txt')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        texto = response.content.decode('utf-8')
+        self.assertIn(f'Comanda {self.card.number}', texto)
+        self.assertIn('Troco', texto)
+
+    def test_formato_desconhecido_e_400(self):
+        self.assertEqual(self.cupom('xml').status_code, 400)
+
+    def test_comanda_sem_pagamento_e_404(self):
+        outra = Card.objects.create(restaurant=self.restaurant, number=99)
+        self.assertEqual(self.cupom('txt', outra.id).status_code, 404)
+
+
+class ClienteComandasTests(SimpleTestCase):
+    """Canal de eventos dos terminais (cliente_comandas.py) com o requests simulado"""
+
+    def setUp(self):
+        self.cliente = ClienteComandas('http://api/', {}, [])
+        self.addCleanup(self.cliente.parar_eventos)
+        self.expirou = threading.Event()
+
+    def resposta(self, status_code, linhas=()):
+        resposta = mock.MagicMock(status_code=status_code)
+        resposta.__enter__.return_value = resposta
+        resposta.iter_lines.return_value = linhas
+        return resposta
+
+    def iniciar(self, ao_alterar=lambda: None, renovar_sessao=lambda: False):
+        self.cliente.iniciar_eventos(ao_alterar, renovar_sessao, self.expirou.set)
+
+    def test_sessao_expirada_encerra_o_canal(self):
+        renovar = mock.Mock(return_value=True)
+        with mock.patch('cliente_comandas.requests.get', return_value=self.resposta(401)) as get:
+            self.iniciar(renovar_sessao=renovar)
+            self.assertTrue(self.expirou.wait(5))
+            self.cliente._thread.join(5)
+        renovar.assert_called_once_with()  # o token renovado também foi recusado: não tenta de novo
+        self.assertEqual(get.call_count, 2)
+        self.assertFalse(self.cliente.eventos_ativos())
+
+    def test_inicia_uma_vez_e_para_no_logout(self):
+        conectado, liberar = threading.Event(), threading.Event()
+        alteracoes = []
+
+        def linhas():
+            conectado.set()
+            liberar.wait(5)
+            yield ': keepalive'
+
+        with mock.patch('cliente_comandas.requests.get', return_value=self.resposta(200, linhas())) as get:
+            self.iniciar(ao_alterar=lambda: alteracoes.append(1))
+            self.assertTrue(conectado.wait(5))
+            thread = self.cliente._thread
+            self.iniciar()  # nova tela principal (ex.: depois de um novo login) não abre outra conexão
+            self.assertIs(self.cliente._thread, thread)
+            self.cliente.parar_eventos()
+            liberar.set()
+            thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(get.call_count, 1)
+        self.assertEqual(alteracoes, [1])  # só a sincronização inicial
+        self.assertFalse(self.expirou.is_set())
@@ -4,12 +4,14 @@ import requests
 from requests.exceptions import RequestException
 import base64
 import threading
-import qrcode
-from io import BytesIO
 from PIL import Image
+import os
 import time
 import uuid
 import re
+from restaurants import pix
+from restaurants.escpos import Spooler
+from cliente_comandas import ClienteComandas
 
 # Global variables
 #API_BASE_URL = "http://103.199.187.28:8001/api/"
@@ -17,46 +19,13 @@ API_BASE_URL = "http://localhost:8000/api/"
 #API_BASE_URL = "http://103.199.187.28:8001/api/"
 HEADERS = {}
 RESTAURANT_ID = None
+# Impressora térmica ESC/POS (ex.: /dev/usb/lp0 ou um arquivo); vazio = impressão pelo navegador
+ESCPOS_PRINTER = os.environ.get("ESCPOS_PRINTER")
+spooler = Spooler(ESCPOS_PRINTER) if ESCPOS_PRINTER else None
 comandas = []
+cliente = ClienteComandas(API_BASE_URL, HEADERS, comandas)
 page = None
 
-def gerar_payload_pix(chave_pix: str, valor: float, nome_recebedor: str, cidade: str, txid: str) -> str:
-    valor_str = f"{valor:.2f}"  # Ensure 2 decimal places
-    # Ensure txid is alphanumeric and max 25 characters
-    txid = txid[:25]
-    gui = "BR.GOV.BCB.PIX"
-    merchant_info = f"00{len(gui):02d}{gui}" + f"01{len(chave_pix):02d}{chave_pix}"
-    merchant_info_formatado = f"26{len(merchant_info):02d}{merchant_info}"
-    info_adicional = f"05{len(txid):02d}{txid}"
-    info_adicional_formatado = f"62{len(info_adicional):02d}{info_adicional}"
-    payload_sem_crc = (
-        "000201"
-        + merchant_info_formatado
-        + "52040000"
-        + "5303986"
-        + f"54{len(valor_str):02d}{valor_str}"  # Fixed length for amount
-        + "5802BR"
-        + f"59{len(nome_recebedor):02d}{nome_recebedor}"
-        + f"60{len(cidade):02d}{cidade}"
-        + info_adicional_formatado
-        + "6304"
-    )
-    crc16 = calcular_crc16(payload_sem_crc)
-    return payload_sem_crc + crc16
-
-def calcular_crc16(payload):
-    polinomio = 0x1021
-    resultado = 0xFFFF
-    for caractere in payload:
-        resultado ^= ord(caractere) << 8
-        for _ in range(8):
-            if (resultado & 0x8000) != 0:
-                resultado = (resultado << 1) ^ polinomio
-            else:
-                resultado <<= 1
-            resultado &= 0xFFFF
-    return f"{resultado:04X}"
-
 def main(page_param: ft.Page):
     global page
     page = page_param
@@ -115,10 +84,7 @@ def fetch_menu_items():
     print(f"Buscando itens do cardápio... restaurant_id={restaurant_id}")
     page.client_storage.remove("menu_items")
     try:
-        response = requests.get(f"{API_BASE_URL}menu-items", headers=HEADERS)
-        print(f"Resposta do /api/menu-items: {response.status_code}, {response.text}")
-        response.raise_for_status()
-        menu_items = response.json()
+        menu_items = cliente.get_json_condicional(f"{API_BASE_URL}menu-items")
         for item in menu_items:
             if item.get("restaurant_id") != restaurant_id:
                 print(f"Erro: Item {item['name']} tem restaurant_id={item['restaurant_id']}, esperado={restaurant_id}")
@@ -174,6 +140,20 @@ def fetch_comandas():
             show_login_screen(error_message="Sessão expirada. Faça login novamente.")
         return []
 
+def sync_comandas():
+    cliente.sync_comandas(recarregar=fetch_comandas)
+    page.client_storage.set("comandas", comandas)
+    return comandas
+
+def renovar_sessao():
+    access_token = cliente.renovar_token(page.client_storage.get("refresh_token"))
+    if access_token:
+        page.client_storage.set("access_token", access_token)
+    return bool(access_token)
+
+def sessao_expirada():
+    show_login_screen(error_message="Sessão expirada. Faça login novamente.")
+
 def create_comanda():
     restaurant_id = page.client_storage.get("restaurant_id")
     print(f"Criando nova comanda... restaurant_id={restaurant_id}")
@@ -247,24 +227,12 @@ def fetch_restaurant_details(restaurant_id):
 
 def generate_pix_qr_code(pix_key, amount, restaurant_name, city, txid):
     print(f"Gerando QR code para Pix: chave={pix_key}, valor={amount}, restaurante={restaurant_name}, cidade={city}, txid={txid}")
-    pix_payload = gerar_payload_pix(
-        chave_pix=pix_key,
-        valor=amount,
-        nome_recebedor=restaurant_name[:25],
-        cidade=city[:15],  # Pix standard limits city to 15 characters
-        txid=txid
-    )
-    print(f"Payload gerado: {pix_payload}")
-    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-    qr.add_data(pix_payload)
-    qr.make(fit=True)
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    qr_image.save(buffer, format="PNG")
-    return buffer.getvalue()
+    # Payload e PNG ficam em cache (restaurants/pix.py): reabrir o QR da mesma comanda não recodifica
+    return pix.gerar_qrcode_pix(pix_key, amount, restaurant_name, city, txid)
 
 def show_login_screen(error_message=None):
     print("Exibindo tela de login")
+    cliente.parar_eventos()
     username_field = ft.TextField(
         label="Usuário",
         prefix_icon=ft.Icons.PERSON,
@@ -435,6 +403,22 @@ def create_payment(card_id, payment_method, paid_amount=None, notes=""):
         page.update()
         return None, None
 
+def imprimir_recibo(card_id, receipt_data):
+    """Com impressora térmica configurada, imprime em ESC/POS; senão abre o PDF no navegador"""
+    if not spooler:
+        print_receipt(receipt_data)
+        return
+    try:
+        response = requests.get(f"{API_BASE_URL}card-payments/{card_id}/receipt", params={"format": "escpos"}, headers=HEADERS)
+        response.raise_for_status()
+        spooler.imprimir(response.content)
+        print(f"Recibo enviado para a impressora {ESCPOS_PRINTER}")
+    except RequestException as e:
+        print(f"Erro ao buscar recibo ESC/POS: {str(e)}")
+        page.snack_bar = ft.SnackBar(ft.Text("Erro ao imprimir o recibo."))
+        page.snack_bar.open = True
+        page.update()
+
 def print_receipt(receipt_data):
     print(f"Iniciando impressão do recibo, data length: {len(receipt_data)}")
     js_code = f"""
@@ -661,10 +645,7 @@ def show_main_interface():
         if hasattr(page, 'comanda_dropdown') and page.comanda_dropdown and page.comanda_dropdown.value:
             comanda_id = int(page.comanda_dropdown.value.split("ID: ")[1].strip(")"))
             try:
-                response = requests.get(f"{API_BASE_URL}cards/{comanda_id}", headers=HEADERS)
-                print(f"Resposta do /api/cards/{comanda_id}: {response.status_code}, {response.text}")
-                response.raise_for_status()
-                comanda = response.json()
+                comanda = cliente.get_json_condicional(f"{API_BASE_URL}cards/{comanda_id}")
                 print(f"Comanda carregada: {comanda}")
             except RequestException as e:
                 print(f"Erro ao buscar comanda: {str(e)}")
@@ -808,10 +789,7 @@ def show_main_interface():
             print("Condição para exibir QR code Pix atendida")
             comanda_id = int(page.comanda_dropdown.value.split("ID: ")[1].strip(")"))
             try:
-                response = requests.get(f"{API_BASE_URL}cards/{comanda_id}", headers=HEADERS)
-                print(f"Resposta do /api/cards/{comanda_id} (QR code): {response.status_code}, {response.text}")
-                response.raise_for_status()
-                comanda = response.json()
+                comanda = cliente.get_json_condicional(f"{API_BASE_URL}cards/{comanda_id}")
                 total_comanda = sum(float(item['subtotal']) for item in comanda["card_items"])
                 print(f"Total da comanda calculado: R$ {total_comanda:.2f}")
                 if total_comanda <= 0:
@@ -894,10 +872,7 @@ def show_main_interface():
                 try:
                     valor_recebido_decimal = Decimal(page.valor_recebido.value.replace(",", "."))
                     comanda_id = int(page.comanda_dropdown.value.split("ID: ")[1].strip(")"))
-                    response = requests.get(f"{API_BASE_URL}cards/{comanda_id}", headers=HEADERS)
-                    print(f"Resposta do /api/cards/{comanda_id} (calcular_troco): {response.status_code}, {response.text}")
-                    response.raise_for_status()
-                    comanda = response.json()
+                    comanda = cliente.get_json_condicional(f"{API_BASE_URL}cards/{comanda_id}")
                     total_comanda = sum(float(item['subtotal']) for item in comanda["card_items"])
                     troco = Decimal(valor_recebido_decimal) - Decimal(total_comanda)
                     page.troco_text.value = f"Troco: R$ {troco:.2f}" if troco >= 0 else "Valor insuficiente!"
@@ -918,10 +893,7 @@ def show_main_interface():
 
         comanda_id = int(page.comanda_dropdown.value.split("ID: ")[1].strip(")"))
         try:
-            response = requests.get(f"{API_BASE_URL}cards/{comanda_id}", headers=HEADERS)
-            print(f"Resposta do /api/cards/{comanda_id} (confirmar_pagamento): {response.status_code}, {response.text}")
-            response.raise_for_status()
-            comanda = response.json()
+            comanda = cliente.get_json_condicional(f"{API_BASE_URL}cards/{comanda_id}")
             total_comanda = calcular_totais(comanda)
         except RequestException as e:
             print(f"Erro ao buscar comanda para pagamento: {str(e)}")
@@ -981,7 +953,7 @@ def show_main_interface():
                     ),
                     ft.ElevatedButton(
                         "Imprimir Recibo",
-                        on_click=lambda e: print_receipt(receipt_data),
+                        on_click=lambda e: imprimir_recibo(payment['card_id'], receipt_data),
                         bgcolor=ft.Colors.BLUE_400,
                         color=ft.Colors.WHITE,
                         width=page.width * 0.4 if page.width < 600 else 150,
@@ -998,7 +970,7 @@ def show_main_interface():
                 ),
                 ft.ElevatedButton(
                     "Imprimir Recibo",
-                    on_click=lambda e: print_receipt(receipt_data),
+                    on_click=lambda e: imprimir_recibo(payment['card_id'], receipt_data),
                     bgcolor=ft.Colors.BLUE_400,
                     color=ft.Colors.WHITE,
                     width=150,
@@ -1021,8 +993,8 @@ def show_main_interface():
             page.snack_bar.open = True
             page.update()
 
-    def atualizar_comandas_periodicamente():
-        print("Iniciando atualização periódica de comandas")
+    def atualizar_comandas():
+        print("Atualizando comandas (evento do servidor)")
         try:
             restaurant_id = page.client_storage.get("restaurant_id")
         except Exception as e:
@@ -1031,13 +1003,12 @@ def show_main_interface():
             page.snack_bar.open = True
             show_login_screen(error_message="Sessão inválida. Faça login novamente.")
             return
-        print(f"Atualizando comandas periodicamente... restaurant_id={restaurant_id}")
+        print(f"Atualizando comandas... restaurant_id={restaurant_id}")
         try:
-            comandas[:] = fetch_comandas()
+            sync_comandas()
             if hasattr(page, 'comanda_dropdown') and page.comanda_dropdown:
                 page.comanda_dropdown.options = [ft.dropdown.Option(f"Comanda {c['number']} (ID: {c['id']})") for c in comandas if c["is_active"]]
             page.update()
-            threading.Timer(30.0, atualizar_comandas_periodicamente).start()
         except Exception as e:
             print(f"Erro ao atualizar comandas: {str(e)}")
             if "Faça login novamente" in str(e) or "Autenticação necessária" in str(e):
@@ -1048,9 +1019,9 @@ def show_main_interface():
                 page.snack_bar = ft.SnackBar(ft.Text(f"Erro ao atualizar comandas: {str(e)}"))
                 page.snack_bar.open = True
                 page.update()
-            threading.Timer(30.0, atualizar_comandas_periodicamente).start()
 
-    threading.Timer(30.0, atualizar_comandas_periodicamente).start()
+    # Atualizações chegam por push (SSE) em vez de polling
+    cliente.iniciar_eventos(atualizar_comandas, renovar_sessao, sessao_expirada)
 
     main_layout = ft.Column(
         [
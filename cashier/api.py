@@ -16,7 +16,7 @@ def registrar_pagamento(request, payload: CardPaymentIn):
     restaurante = get_object_or_404(Restaurant, owner=request.user)
     card = get_object_or_404(Card, id=payload.card_id, restaurant=restaurante)
 
-    total = sum(item.subtotal() for item in card.card_items.all())
+    total = card.total()
 
     if payload.amount < total:
         raise HttpError(400, f"O valor pago R$ {payload.amount:.2f} é inferior ao total R$ {total:.2f}.")
@@ -0,0 +1,133 @@
+"""Acesso à API de comandas compartilhado pelos terminais Flet (caixa.py, garcom.py, temp.py).
+
+Cada terminal cria um `ClienteComandas` com a URL base, o dicionário de headers (o mesmo
+objeto que o terminal atualiza no login e na renovação do token) e a lista de comandas.
+"""
+import threading
+
+import requests
+from requests.exceptions import RequestException
+
+ESPERA_RECONEXAO_SEGUNDOS = 3
+
+
+class ClienteComandas:
+    def __init__(self, api_base_url, headers, comandas):
+        self.api_base_url = api_base_url
+        self.headers = headers
+        self.comandas = comandas
+        self.cursor = None
+        self.respostas_cache = {}  # url -> (etag, json) das últimas respostas com ETag
+        self._parar = threading.Event()
+        self._parar.set()
+        self._thread = None
+
+    def get_json_condicional(self, url):
+        """GET com If-None-Match: reaproveita o JSON em cache quando o servidor responde 304."""
+        headers = dict(self.headers)
+        em_cache = self.respostas_cache.get(url)
+        if em_cache:
+            headers["If-None-Match"] = em_cache[0]
+        response = requests.get(url, headers=headers, timeout=10)
+        print(f"Resposta do {url}: {response.status_code}")
+        if response.status_code == 304 and em_cache:
+            return em_cache[1]
+        response.raise_for_status()
+        data = response.json()
+        if response.headers.get("ETag"):
+            self.respostas_cache[url] = (response.headers["ETag"], data)
+        return data
+
+    def sync_comandas(self, recarregar):
+        """Sincroniza só as comandas alteradas desde o último cursor (/api/cards/sync).
+
+        Com 401 o cursor é descartado e `recarregar` (que renova o token e busca a lista
+        completa) é chamado no lugar.
+        """
+        params = {"since": self.cursor} if self.cursor else {}
+        try:
+            response = requests.get(f"{self.api_base_url}cards/sync", params=params, headers=self.headers, timeout=10)
+            if response.status_code == 401:
+                self.cursor = None
+                return recarregar()
+            response.raise_for_status()
+            data = response.json()
+            alteradas = {c["id"]: c for c in data["cards"]}
+            fechadas = set(data["closed"])
+            print(f"Sincronização de comandas: {len(alteradas)} alteradas, {len(fechadas)} fechadas")
+            if self.cursor is None:
+                self.comandas[:] = data["cards"]
+            else:
+                self.comandas[:] = [alteradas.pop(c["id"], c) for c in self.comandas if c["id"] not in fechadas] + list(alteradas.values())
+                self.comandas.sort(key=lambda c: c["number"])
+            self.cursor = data["cursor"]
+            return self.comandas
+        except RequestException as e:
+            print(f"Erro ao sincronizar comandas: {str(e)}")
+            return self.comandas
+
+    def renovar_token(self, refresh_token):
+        """Troca o refresh token por um novo access token e atualiza os headers; None se falhar."""
+        if not refresh_token:
+            return None
+        try:
+            response = requests.post(f"{self.api_base_url}token/refresh/", json={"refresh": refresh_token}, timeout=10)
+        except RequestException as e:
+            print(f"Erro ao renovar token: {str(e)}")
+            return None
+        if response.status_code != 200:
+            print(f"Erro ao renovar token: {response.status_code} {response.text}")
+            return None
+        access_token = response.json().get("access")
+        if access_token:
+            self.headers["Authorization"] = f"Bearer {access_token}"
+        return access_token
+
+    def iniciar_eventos(self, ao_alterar, renovar_sessao, ao_expirar):
+        """Abre o canal de eventos numa thread; não faz nada se ele já estiver ativo.
+
+        `renovar_sessao()` é chamado com 401 e deve devolver True se conseguiu um token novo;
+        se não conseguir (ou o servidor recusar o token recém-renovado), o canal é encerrado
+        e `ao_expirar()` é chamado.
+        """
+        if self.eventos_ativos():
+            return
+        self._parar = threading.Event()
+        self._thread = threading.Thread(
+            target=self._escutar_eventos, args=(ao_alterar, renovar_sessao, ao_expirar, self._parar), daemon=True
+        )
+        self._thread.start()
+
+    def parar_eventos(self):
+        """Encerra o canal de eventos (logout); a thread sai na próxima mensagem ou keepalive."""
+        self._parar.set()
+
+    def eventos_ativos(self):
+        return self._thread is not None and self._thread.is_alive() and not self._parar.is_set()
+
+    def _escutar_eventos(self, ao_alterar, renovar_sessao, ao_expirar, parar):
+        """Mantém uma conexão SSE com /api/cards/events e chama `ao_alterar` a cada alteração."""
+        token_renovado = False
+        while not parar.is_set():
+            try:
+                with requests.get(f"{self.api_base_url}cards/events", headers=self.headers, stream=True, timeout=(10, 60)) as response:
+                    if response.status_code == 401:
+                        if token_renovado or not renovar_sessao():
+                            print("Sessão expirada, canal de eventos encerrado")
+                            parar.set()
+                            ao_expirar()
+                            return
+                        print("Token renovado para o canal de eventos")
+                        token_renovado = True
+                        continue
+                    response.raise_for_status()
+                    token_renovado = False
+                    ao_alterar()  # recupera o que mudou enquanto estava desconectado
+                    for linha in response.iter_lines(decode_unicode=True):
+                        if parar.is_set():
+                            return
+                        if linha and linha.startswith("event:"):
+                            ao_alterar()
+            except RequestException as e:
+                print(f"Canal de eventos desconectado: {str(e)}")
+            parar.wait(ESPERA_RECONEXAO_SEGUNDOS)
@@ -116,6 +116,8 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Banco de teste em arquivo: os testes de concorrência abrem uma conexão por thread
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -171,6 +173,22 @@ STATICFILES_DIRS = [BASE_DIR / 'static']
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Cupons em PDF gerados em segundo plano (restaurants/cupons.py)
+CUPOM_PDF_DIR = MEDIA_ROOT / 'cupons'
+CUPOM_PDF_WORKERS = 2
+CUPOM_PDF_ESPERA_SEGUNDOS = 5  # a view espera o PDF que o pool já está gerando antes de renderizar outro
+
+# Fila de emissão de NFC-e (fiscal/utils/emissao.py, manage.py processar_nfce)
+NFCE_TRANSMISSOR = 'fiscal.utils.sefaz_ce.enviar_lote_para_sefaz'  # SEFAZ falsa: 'fiscal.utils.sefaz_fake.enviar_lote_para_sefaz'
+NFCE_WORKERS = 4
+NFCE_MAX_TENTATIVAS = 8
+NFCE_RETRY_BASE_SEGUNDOS = 30
+NFCE_LOTE_JANELA_SEGUNDOS = 2  # espera para juntar as notas de um restaurante no mesmo lote
+NFCE_CONTINGENCIA_FALHAS = 3  # falhas de comunicação seguidas até emitir em contingência (tpEmis=9)
+NFCE_RECIBO_CONSULTAS = 10  # consultas ao recibo do lote antes de deixá-lo para a próxima tentativa
+NFCE_RECIBO_ESPERA_SEGUNDOS = 1  # intervalo entre as consultas ao recibo
+NFCE_WSDL_CACHE = BASE_DIR / 'wsdl_cache.sqlite3'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
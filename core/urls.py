@@ -35,6 +35,7 @@ urlpatterns = [
     path("api/", include('api.urls')),
     path('admin/', admin.site.urls),
     path('cupom/<int:payment_id>/', views.gerar_cupom_pdf, name='gerar_cupom'),
+    path('pix/<int:payment_id>.png', views.pix_qrcode, name='pix_qrcode'),
     path('fiscal/', include('fiscal.urls')),
     
     path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
@@ -1,46 +1,58 @@
 from django.contrib import admin
-from fiscal.models import NotaFiscal
+from fiscal.models import NotaFiscal, NumeroInutilizado, SequenciaNFCe, ServicoSefaz
+from fiscal.utils import exportacao
 from django.utils.html import format_html
+from django.urls import reverse
 
-from django.http import HttpResponse
-import csv
+from django.http import StreamingHttpResponse
+from django.utils import timezone
 from datetime import datetime
 
 def exportar_notas_csv(modeladmin, request, queryset):
-    response = HttpResponse(content_type='text/csv')
+    response = StreamingHttpResponse(exportacao.linhas_csv(queryset), content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="notas_fiscais_{datetime.now():%Y%m%d}.csv"'
+    return response
 
-    writer = csv.writer(response)
-    writer.writerow(['Número', 'Série', 'CNPJ', 'Chave', 'Valor', 'Emitido em', 'Ambiente'])
-
-    for nota in queryset:
-        writer.writerow([
-            nota.numero,
-            nota.serie,
-            nota.restaurant.cnpj,
-            nota.chave,
-            nota.card_payment.amount,
-            nota.emitido_em.strftime('%d/%m/%Y %H:%M'),
-            nota.get_ambiente_display()
-        ])
+exportar_notas_csv.short_description = "Exportar CSV das notas selecionadas"
 
+def exportar_xmls_zip(modeladmin, request, queryset):
+    """ZIP com o XML assinado de cada nota; filtre o mês pela navegação de datas"""
+    response = StreamingHttpResponse(exportacao.partes_zip_xmls(queryset), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="xmls_nfce_{datetime.now():%Y%m%d}.zip"'
     return response
 
-exportar_notas_csv.short_description = "Exportar CSV das notas selecionadas"
+exportar_xmls_zip.short_description = "Baixar ZIP dos XMLs das notas selecionadas"
+
+def reenviar_notas(modeladmin, request, queryset):
+    """Devolve à fila as notas que esgotaram as tentativas automáticas"""
+    atualizadas = queryset.filter(
+        status__in=[NotaFiscal.Status.PENDENTE, NotaFiscal.Status.ASSINADA]
+    ).update(tentativas=0, proxima_tentativa=timezone.now())
+    modeladmin.message_user(request, f"{atualizadas} nota(s) devolvida(s) à fila de emissão.")
+
+reenviar_notas.short_description = "Reenviar para a SEFAZ"
 
 @admin.register(NotaFiscal)
 class NotaFiscalAdmin(admin.ModelAdmin):
     list_display = (
-        'numero', 'restaurant', 'card_payment', 'chave_curta', 
+        'numero', 'restaurant', 'card_payment', 'chave_curta', 'status', 'tentativas',
         'ambiente', 'emitido_em', 'link_danfe', 'link_qrcode'
     )
-    list_filter = ('ambiente', 'restaurant', 'emitido_em')
+    list_filter = ('status', 'ambiente', 'restaurant', 'emitido_em')
     search_fields = ('numero', 'chave', 'restaurant__name', 'card_payment__id')
+    readonly_fields = (
+        'numero', 'status', 'tentativas', 'proxima_tentativa', 'ultimo_erro', 'codigo_status', 'motivo', 'protocolo', 'recibo', 'autorizado_em',
+        'link_xml',
+    )
     ordering = ('-emitido_em',)
+    list_select_related = ('restaurant', 'card_payment__card')
 
-    actions = [exportar_notas_csv]  # ⬅️ ESTA LINHA ativa a exportação em massa
+    date_hierarchy = 'emitido_em'
+    actions = [exportar_notas_csv, exportar_xmls_zip, reenviar_notas]  # ⬅️ ESTA LINHA ativa a exportação em massa
 
     def chave_curta(self, obj):
+        if not obj.chave:
+            return "-"
         return f"{obj.chave[:6]}...{obj.chave[-6:]}"
     chave_curta.short_description = "Chave"
 
@@ -56,3 +68,50 @@ class NotaFiscalAdmin(admin.ModelAdmin):
         return "-"
     link_qrcode.short_description = "QR Code"
 
+    def link_xml(self, obj):
+        # Só o link: o XML (comprimido) é lido apenas no download
+        if obj.pk and obj.chave:
+            return format_html('<a href="{}">Baixar XML</a>', reverse('baixar_xml_nfce', args=[obj.pk]))
+        return "-"
+    link_xml.short_description = "XML"
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('xml_gz')
+
+
+
+@admin.register(ServicoSefaz)
+class ServicoSefazAdmin(admin.ModelAdmin):
+    """Mostra (e permite ligar à mão) a contingência; o worker desliga no primeiro retorno da SEFAZ"""
+    list_display = ('ambiente', 'em_contingencia', 'contingencia_desde', 'falhas_seguidas', 'atualizado_em')
+    fields = ('ambiente', 'contingencia_desde', 'justificativa', 'falhas_seguidas', 'atualizado_em')
+    readonly_fields = ('falhas_seguidas', 'atualizado_em')
+
+    def em_contingencia(self, obj):
+        return obj.contingencia_desde is not None
+    em_contingencia.boolean = True
+    em_contingencia.short_description = "Contingência?"
+
+
+@admin.register(SequenciaNFCe)
+class SequenciaNFCeAdmin(admin.ModelAdmin):
+    """Só leitura: o número avança apenas pela emissão (SequenciaNFCe.reservar)"""
+    list_display = ('restaurant', 'serie', 'proximo')
+    list_filter = ('restaurant',)
+    list_select_related = ('restaurant',)
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(NumeroInutilizado)
+class NumeroInutilizadoAdmin(admin.ModelAdmin):
+    """Números que precisam de inutilização na SEFAZ; preencha o protocolo ao inutilizar"""
+    list_display = ('numero', 'serie', 'restaurant', 'motivo', 'registrado_em', 'protocolo')
+    list_filter = ('restaurant', 'serie')
+    search_fields = ('numero', 'restaurant__name')
+    list_select_related = ('restaurant',)
+    readonly_fields = ('restaurant', 'serie', 'numero', 'motivo', 'registrado_em')
@@ -0,0 +1,38 @@
+from datetime import datetime
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from fiscal.utils import exportacao
+
+
+class Command(BaseCommand):
+    help = "Exporta as NFC-e autorizadas de um mês: notas_AAAA-MM.csv e xmls_AAAA-MM.zip, gravados em blocos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mes', required=True, help="Mês no formato AAAA-MM")
+        parser.add_argument('--restaurante', type=int, help="ID do restaurante (padrão: todos)")
+        parser.add_argument('--saida', default='.', help="Diretório de destino")
+
+    def handle(self, *args, **options):
+        try:
+            mes = datetime.strptime(options['mes'], '%Y-%m')
+        except ValueError:
+            raise CommandError("Use --mes no formato AAAA-MM")
+        notas = exportacao.notas_do_mes(mes.year, mes.month, options['restaurante'])
+        destino = Path(options['saida'])
+        destino.mkdir(parents=True, exist_ok=True)
+
+        caminho_csv = destino / f"notas_{mes:%Y-%m}.csv"
+        with open(caminho_csv, 'w', newline='', encoding='utf-8') as arquivo:
+            linhas = -1  # cabeçalho
+            for linha in exportacao.linhas_csv(notas):
+                arquivo.write(linha)
+                linhas += 1
+        self.stdout.write(f"{caminho_csv}: {linhas} notas")
+
+        caminho_zip = destino / f"xmls_{mes:%Y-%m}.zip"
+        with open(caminho_zip, 'wb') as arquivo:
+            for parte in exportacao.partes_zip_xmls(notas):
+                arquivo.write(parte)
+        self.stdout.write(f"{caminho_zip}: {caminho_zip.stat().st_size} bytes")
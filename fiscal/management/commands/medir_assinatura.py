@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from fiscal.models import NotaFiscal
+from fiscal.utils import certificados
+from fiscal.utils.assinatura import assinar_nfe
+from fiscal.utils.xml_nfce import montar_xml_nfce
+
+
+class Command(BaseCommand):
+    help = "Mede assinaturas/s de uma NFC-e relendo o .pfx a cada nota e usando o cache de certificados"
+
+    def add_arguments(self, parser):
+        parser.add_argument('nota_id', type=int)
+        parser.add_argument('--repeticoes', type=int, default=50)
+
+    def handle(self, *args, **options):
+        repeticoes = options['repeticoes']
+        nota = NotaFiscal.objects.select_related('restaurant', 'card_payment__card').get(pk=options['nota_id'])
+        restaurante = nota.restaurant
+        xml = montar_xml_nfce(nota)  # não salva: a chave gerada fica só em memória
+
+        carregadores = {
+            'sem cache': lambda: certificados.ler_pfx(
+                restaurante.certificate_file.path, restaurante.certificate_password
+            ),
+            'com cache': lambda: certificados.certificado_do_restaurante(restaurante),
+        }
+        for nome, carregar in carregadores.items():
+            assinar_nfe(xml, carregar())  # aquecimento
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                assinar_nfe(xml, carregar())
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"{nome:>9}: {decorrido / repeticoes * 1000:8.2f} ms/nota, {repeticoes / decorrido:8.1f} notas/s"
+            )
@@ -0,0 +1,32 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from fiscal.utils.emissao import agrupar_por_restaurante, processar_lote_por_ids, reservar_notas
+from fiscal.utils.sefaz_ce import LOTE_MAXIMO
+
+
+class Command(BaseCommand):
+    help = "Worker da fila de NFC-e: assina e transmite em lotes as notas pendentes, com novas tentativas em caso de falha"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=getattr(settings, 'NFCE_WORKERS', 4))
+        parser.add_argument('--intervalo', type=float, default=1, help="Segundos entre consultas à fila vazia")
+        parser.add_argument('--uma-vez', action='store_true', help="Processa o que estiver vencido e sai (cron)")
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='nfce') as pool:
+            while True:
+                notas = reservar_notas(workers * LOTE_MAXIMO)
+                for lote in pool.map(processar_lote_por_ids, agrupar_por_restaurante(notas)):
+                    for nota in lote:
+                        self.stdout.write(
+                            f"NFC-e #{nota.numero or '-'}: {nota.get_status_display()} {nota.ultimo_erro}".rstrip()
+                        )
+                if options['uma_vez']:
+                    break
+                if not notas:
+                    time.sleep(options['intervalo'])
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from fiscal.utils import sefaz_local
+
+
+class Command(BaseCommand):
+    help = "Sobe a SEFAZ local (SOAP, respostas de sefaz_fake) para testar o envio de lotes sem rede"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--porta', type=int, default=8765)
+        parser.add_argument('--consultas-em-processamento', type=int, default=1,
+                            help="Quantas consultas do recibo respondem 105 antes do resultado")
+
+    def handle(self, *args, **options):
+        servidor = sefaz_local.SefazLocal(
+            ('127.0.0.1', options['porta']), consultas_em_processamento=options['consultas_em_processamento']
+        )
+        self.stdout.write(
+            f"SEFAZ local em {servidor.url_base}; use NFCE_WSDL_BASE = "
+            f"{{'homologacao': '{servidor.url_base}', 'producao': '{servidor.url_base}'}}"
+        )
+        try:
+            servidor.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            servidor.server_close()
@@ -0,0 +1,69 @@
+# Generated by Django 5.2 on 2026-10-18 20:32
+
+from django.db import migrations, models
+
+def marcar_notas_existentes(apps, schema_editor):
+    """Notas gravadas pelo fluxo síncrono antigo não entram na fila"""
+    NotaFiscal = apps.get_model('fiscal', 'NotaFiscal')
+    NotaFiscal.objects.update(status='AU')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiscal', '0001_initial'),
+        ('restaurants', '0035_dailysalessummary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notafiscal',
+            name='autorizado_em',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Autorizado em'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='codigo_status',
+            field=models.CharField(blank=True, max_length=3, verbose_name='cStat'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='motivo',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Motivo'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='protocolo',
+            field=models.CharField(blank=True, max_length=20, verbose_name='Protocolo'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='proxima_tentativa',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Próxima tentativa'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='status',
+            field=models.CharField(choices=[('PE', 'Pendente'), ('AS', 'Assinada'), ('AU', 'Autorizada'), ('RE', 'Rejeitada'), ('CO', 'Em contingência')], default='PE', max_length=2, verbose_name='Situação'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='tentativas',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Tentativas'),
+        ),
+        migrations.AddField(
+            model_name='notafiscal',
+            name='ultimo_erro',
+            field=models.TextField(blank=True, verbose_name='Último erro'),
+        ),
+        migrations.AlterField(
+            model_name='notafiscal',
+            name='chave',
+            field=models.CharField(blank=True, max_length=44, null=True, unique=True, verbose_name='Chave de Acesso'),
+        ),
+        migrations.AddIndex(
+            model_name='notafiscal',
+            index=models.Index(fields=['status', 'proxima_tentativa'], name='fiscal_nota_status_ceb5dc_idx'),
+        ),
+        migrations.RunPython(marcar_notas_existentes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2 on 2026-10-18 20:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiscal', '0002_notafiscal_fila_emissao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ServicoSefaz',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ambiente', models.CharField(choices=[('1', 'Produção'), ('2', 'Homologação')], max_length=1, unique=True, verbose_name='Ambiente')),
+                ('falhas_seguidas', models.PositiveIntegerField(default=0, verbose_name='Falhas seguidas')),
+                ('contingencia_desde', models.DateTimeField(blank=True, null=True, verbose_name='Em contingência desde')),
+                ('justificativa', models.CharField(blank=True, max_length=256, verbose_name='Justificativa da contingência')),
+                ('atualizado_em', models.DateTimeField(auto_now=True, verbose_name='Atualizado em')),
+            ],
+            options={
+                'verbose_name': 'Serviço da SEFAZ',
+                'verbose_name_plural': 'Serviços da SEFAZ',
+            },
+        ),
+    ]
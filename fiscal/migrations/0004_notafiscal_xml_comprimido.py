@@ -0,0 +1,52 @@
+# Generated by Django 5.2 on 2026-10-18 20:47
+
+import gzip
+import xml.etree.ElementTree as ET
+
+from django.db import migrations, models
+
+
+def _em_lotes(consulta, tamanho=500):
+    """(pk, valor) em lotes por pk, sem cursor aberto enquanto a tabela é atualizada"""
+    ultimo = 0
+    while True:
+        lote = list(consulta.filter(pk__gt=ultimo).order_by('pk')[:tamanho])
+        if not lote:
+            return
+        yield from lote
+        ultimo = lote[-1][0]
+
+
+def comprimir_xmls(apps, schema_editor):
+    """Copia o XML de cada nota para a coluna nova, canônico e em gzip"""
+    NotaFiscal = apps.get_model('fiscal', 'NotaFiscal')
+    for pk, xml in _em_lotes(NotaFiscal.objects.exclude(xml='').values_list('pk', 'xml')):
+        NotaFiscal.objects.filter(pk=pk).update(
+            xml_gz=gzip.compress(ET.canonicalize(xml).encode('utf-8'), compresslevel=9, mtime=0)
+        )
+
+
+def descomprimir_xmls(apps, schema_editor):
+    NotaFiscal = apps.get_model('fiscal', 'NotaFiscal')
+    for pk, xml_gz in _em_lotes(NotaFiscal.objects.exclude(xml_gz=b'').values_list('pk', 'xml_gz')):
+        NotaFiscal.objects.filter(pk=pk).update(xml=gzip.decompress(xml_gz).decode('utf-8'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiscal', '0003_servicosefaz_contingencia'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notafiscal',
+            name='xml_gz',
+            field=models.BinaryField(blank=True, default=b'', verbose_name='XML Assinado (c14n + gzip)'),
+        ),
+        migrations.RunPython(comprimir_xmls, descomprimir_xmls),
+        migrations.RemoveField(
+            model_name='notafiscal',
+            name='xml',
+        ),
+    ]
@@ -0,0 +1,98 @@
+# Generated by Django 5.2 on 2026-10-18 20:52
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def criar_sequencias(apps, schema_editor):
+    """Notas pendentes devolvem o número (max + 1) e recebem outro na assinatura; a sequência
+    de cada restaurante/série começa depois do maior número já usado"""
+    NotaFiscal = apps.get_model('fiscal', 'NotaFiscal')
+    SequenciaNFCe = apps.get_model('fiscal', 'SequenciaNFCe')
+    NotaFiscal.objects.filter(status='PE').update(numero=None)
+    ultimos = NotaFiscal.objects.exclude(numero=None).order_by().values('restaurant_id', 'serie').annotate(
+        ultimo=Max('numero')
+    )
+    SequenciaNFCe.objects.bulk_create([
+        SequenciaNFCe(restaurant_id=linha['restaurant_id'], serie=linha['serie'], proximo=linha['ultimo'] + 1)
+        for linha in ultimos
+    ])
+
+
+def numerar_pendentes(apps, schema_editor):
+    """Volta ao número obrigatório: as notas sem número recebem max + 1, como antes"""
+    NotaFiscal = apps.get_model('fiscal', 'NotaFiscal')
+    for nota in NotaFiscal.objects.filter(numero=None).order_by('pk'):
+        ultimo = NotaFiscal.objects.filter(
+            restaurant_id=nota.restaurant_id, serie=nota.serie
+        ).aggregate(ultimo=Max('numero'))['ultimo']
+        nota.numero = (ultimo or 0) + 1
+        nota.save(update_fields=['numero'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiscal', '0004_notafiscal_xml_comprimido'),
+        ('restaurants', '0035_dailysalessummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumeroInutilizado',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serie', models.PositiveIntegerField(verbose_name='Série')),
+                ('numero', models.PositiveIntegerField(verbose_name='Número')),
+                ('motivo', models.CharField(blank=True, max_length=255, verbose_name='Motivo')),
+                ('registrado_em', models.DateTimeField(auto_now_add=True, verbose_name='Registrado em')),
+                ('protocolo', models.CharField(blank=True, max_length=20, verbose_name='Protocolo de inutilização')),
+            ],
+            options={
+                'verbose_name': 'Número a inutilizar',
+                'verbose_name_plural': 'Números a inutilizar',
+                'ordering': ['restaurant', 'serie', 'numero'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SequenciaNFCe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('serie', models.PositiveIntegerField(default=1, verbose_name='Série')),
+                ('proximo', models.PositiveIntegerField(default=1, verbose_name='Próximo número')),
+            ],
+            options={
+                'verbose_name': 'Sequência de NFC-e',
+                'verbose_name_plural': 'Sequências de NFC-e',
+            },
+        ),
+        migrations.AlterField(
+            model_name='notafiscal',
+            name='numero',
+            field=models.PositiveIntegerField(blank=True, help_text='Número sequencial da NFC-e, dado pela SequenciaNFCe quando a nota é assinada', null=True, verbose_name='Número da Nota'),
+        ),
+        migrations.AddField(
+            model_name='numeroinutilizado',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='numeros_inutilizados', to='restaurants.restaurant'),
+        ),
+        migrations.AddField(
+            model_name='sequencianfce',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sequencias_nfce', to='restaurants.restaurant'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='numeroinutilizado',
+            unique_together={('restaurant', 'serie', 'numero')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='sequencianfce',
+            unique_together={('restaurant', 'serie')},
+        ),
+        migrations.RunPython(criar_sequencias, numerar_pendentes),
+        migrations.AddConstraint(
+            model_name='notafiscal',
+            constraint=models.UniqueConstraint(fields=('restaurant', 'serie', 'numero'), name='nfce_numero_unico_por_serie'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 21:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fiscal', '0005_sequencia_nfce'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notafiscal',
+            name='recibo',
+            field=models.CharField(blank=True, help_text='nRec do lote ainda em processamento na SEFAZ: a próxima tentativa consulta o recibo em vez de reenviar', max_length=15, verbose_name='Recibo do lote'),
+        ),
+    ]
@@ -1,34 +1,219 @@
 # fiscal/models.py
 # fiscal/models.py
 
-from django.db import models
+import gzip
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models import Max
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from restaurants.models import CardPayment, Restaurant
+from lxml import etree
+from restaurants import cupons
+from restaurants.models import Card, CardPayment, Restaurant, origem_da_exclusao
+
+from fiscal.utils import certificados
+
+def comprimir_xml(xml):
+    """XML canônico (C14N 1.0, a mesma da assinatura, que continua válida) em gzip determinístico"""
+    if isinstance(xml, str):
+        xml = xml.encode('utf-8')
+    return gzip.compress(etree.tostring(etree.fromstring(xml), method='c14n'), compresslevel=9, mtime=0)
+
 
 class NotaFiscal(models.Model):
     class AmbienteChoices(models.TextChoices):
         PRODUCAO = '1', _('Produção')
         HOMOLOGACAO = '2', _('Homologação')
 
+    class Status(models.TextChoices):
+        PENDENTE = 'PE', _('Pendente')
+        ASSINADA = 'AS', _('Assinada')
+        AUTORIZADA = 'AU', _('Autorizada')
+        REJEITADA = 'RE', _('Rejeitada')
+        CONTINGENCIA = 'CO', _('Em contingência')
+
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='notas_fiscais')
     card_payment = models.OneToOneField(CardPayment, on_delete=models.CASCADE, related_name='nota_fiscal')
 
-    numero = models.PositiveIntegerField(_('Número da Nota'), help_text='Número sequencial da NFC-e')
+    numero = models.PositiveIntegerField(
+        _('Número da Nota'), null=True, blank=True,
+        help_text='Número sequencial da NFC-e, dado pela SequenciaNFCe quando a nota é assinada',
+    )
     serie = models.PositiveIntegerField(_('Série'), default=1)
-    chave = models.CharField(_('Chave de Acesso'), max_length=44, unique=True)
-    xml = models.TextField(_('XML Assinado'), blank=True)
+    chave = models.CharField(_('Chave de Acesso'), max_length=44, unique=True, null=True, blank=True)
+    xml_gz = models.BinaryField(_('XML Assinado (c14n + gzip)'), blank=True, default=b'')
     danfe_url = models.URLField(_('Link para DANFE'), blank=True)
     qrcode_url = models.URLField(_('Link do QR Code'), blank=True)
     ambiente = models.CharField(_('Ambiente'), max_length=1, choices=AmbienteChoices.choices, default=AmbienteChoices.HOMOLOGACAO)
 
     emitido_em = models.DateTimeField(_('Emitido em'), auto_now_add=True)
 
+    # Fila de emissão (fiscal/utils/emissao.py + manage.py processar_nfce)
+    status = models.CharField(_('Situação'), max_length=2, choices=Status.choices, default=Status.PENDENTE)
+    tentativas = models.PositiveSmallIntegerField(_('Tentativas'), default=0)
+    proxima_tentativa = models.DateTimeField(_('Próxima tentativa'), null=True, blank=True)
+    ultimo_erro = models.TextField(_('Último erro'), blank=True)
+    codigo_status = models.CharField(_('cStat'), max_length=3, blank=True)
+    motivo = models.CharField(_('Motivo'), max_length=255, blank=True)
+    protocolo = models.CharField(_('Protocolo'), max_length=20, blank=True)
+    recibo = models.CharField(
+        _('Recibo do lote'), max_length=15, blank=True,
+        help_text='nRec do lote ainda em processamento na SEFAZ: a próxima tentativa consulta o recibo em vez de reenviar',
+    )
+    autorizado_em = models.DateTimeField(_('Autorizado em'), null=True, blank=True)
+
     class Meta:
         verbose_name = _('Nota Fiscal')
         verbose_name_plural = _('Notas Fiscais')
         ordering = ['-emitido_em']
+        indexes = [
+            models.Index(fields=['status', 'proxima_tentativa']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['restaurant', 'serie', 'numero'], name='nfce_numero_unico_por_serie'),
+        ]
+
+    def __str__(self):
+        return f"NFC-e #{self.numero or '-'} - {self.restaurant.name}"
+
+    @property
+    def xml(self):
+        """XML assinado, descomprimido só quando lido (listagens usam .defer('xml_gz'))"""
+        return gzip.decompress(self.xml_gz).decode('utf-8') if self.xml_gz else ''
+
+    @xml.setter
+    def xml(self, valor):
+        self.xml_gz = comprimir_xml(valor) if valor else b''
+
+    @classmethod
+    def enfileirar(cls, card_payment):
+        """Cria (uma única vez) a nota pendente do pagamento; o número sai na assinatura (SequenciaNFCe)"""
+        with transaction.atomic():
+            nota = cls.objects.filter(card_payment=card_payment).first()
+            if nota:
+                return nota
+            return cls.objects.create(
+                restaurant=card_payment.restaurant,
+                card_payment=card_payment,
+                proxima_tentativa=timezone.now(),
+            )
+
+
+class SequenciaNFCe(models.Model):
+    """Próximo número livre de NFC-e por restaurante e série"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='sequencias_nfce')
+    serie = models.PositiveIntegerField(_('Série'), default=1)
+    proximo = models.PositiveIntegerField(_('Próximo número'), default=1)
+
+    class Meta:
+        verbose_name = _('Sequência de NFC-e')
+        verbose_name_plural = _('Sequências de NFC-e')
+        unique_together = ('restaurant', 'serie')
+
+    def __str__(self):
+        return f"{self.restaurant} série {self.serie}: próximo {self.proximo}"
+
+    @classmethod
+    def reservar(cls, restaurant_id, serie, quantidade):
+        """Bloco contíguo de `quantidade` números para um lote do worker.
+
+        O UPDATE vem antes da leitura: ele trava a linha da sequência (no SQLite, o banco
+        para escrita) até o commit, então emissões paralelas nunca recebem o mesmo número.
+        """
+        sequencia = cls.objects.filter(restaurant_id=restaurant_id, serie=serie)
+        with transaction.atomic():
+            if not sequencia.update(proximo=F('proximo') + quantidade):
+                ultimo = NotaFiscal.objects.filter(
+                    restaurant_id=restaurant_id, serie=serie
+                ).aggregate(ultimo=Max('numero'))['ultimo'] or 0
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(restaurant_id=restaurant_id, serie=serie, proximo=ultimo + 1 + quantidade)
+                except IntegrityError:  # outro processo criou a sequência ao mesmo tempo
+                    sequencia.update(proximo=F('proximo') + quantidade)
+            fim = sequencia.values_list('proximo', flat=True).get()
+        return list(range(fim - quantidade, fim))
+
+
+class NumeroInutilizado(models.Model):
+    """Número de NFC-e que não vai ser autorizado (nota rejeitada ou apagada) e precisa ser inutilizado na SEFAZ"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='numeros_inutilizados')
+    serie = models.PositiveIntegerField(_('Série'))
+    numero = models.PositiveIntegerField(_('Número'))
+    motivo = models.CharField(_('Motivo'), max_length=255, blank=True)
+    registrado_em = models.DateTimeField(_('Registrado em'), auto_now_add=True)
+    protocolo = models.CharField(_('Protocolo de inutilização'), max_length=20, blank=True)
+
+    class Meta:
+        verbose_name = _('Número a inutilizar')
+        verbose_name_plural = _('Números a inutilizar')
+        unique_together = ('restaurant', 'serie', 'numero')
+        ordering = ['restaurant', 'serie', 'numero']
 
     def __str__(self):
-        return f"NFC-e #{self.numero} - {self.restaurant.name}"
+        return f"{self.restaurant} série {self.serie} nº {self.numero}"
+
+    @classmethod
+    def registrar(cls, nota, motivo):
+        if nota.numero is not None:
+            cls.objects.get_or_create(
+                restaurant_id=nota.restaurant_id, serie=nota.serie, numero=nota.numero,
+                defaults={'motivo': motivo[:255]},
+            )
+
+
+
+class ServicoSefaz(models.Model):
+    """Situação da autorização na SEFAZ por ambiente.
+
+    Com `contingencia_desde` preenchido as notas novas são assinadas offline (tpEmis=9) e
+    transmitidas depois pelo worker. O worker liga a contingência após NFCE_CONTINGENCIA_FALHAS
+    falhas de comunicação seguidas e desliga no primeiro retorno da SEFAZ; o admin pode ligar à mão.
+    """
+    ambiente = models.CharField(_('Ambiente'), max_length=1, choices=NotaFiscal.AmbienteChoices.choices, unique=True)
+    falhas_seguidas = models.PositiveIntegerField(_('Falhas seguidas'), default=0)
+    contingencia_desde = models.DateTimeField(_('Em contingência desde'), null=True, blank=True)
+    justificativa = models.CharField(_('Justificativa da contingência'), max_length=256, blank=True)
+    atualizado_em = models.DateTimeField(_('Atualizado em'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('Serviço da SEFAZ')
+        verbose_name_plural = _('Serviços da SEFAZ')
+
+    def __str__(self):
+        situacao = 'contingência' if self.contingencia_desde else 'normal'
+        return f"SEFAZ {self.get_ambiente_display()} ({situacao})"
+
+CAMPOS_CERTIFICADO = {'certificate_file', 'certificate_password'}
+
+
+@receiver(post_save, sender=Restaurant)
+def descartar_certificado_alterado(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or CAMPOS_CERTIFICADO & set(update_fields):
+        certificados.descartar_se_alterado(instance)
+
+
+@receiver(post_delete, sender=Restaurant)
+def descartar_certificado_removido(sender, instance, **kwargs):
+    certificados.descartar(instance)
+
+
+CAMPOS_CUPOM = {'chave', 'qrcode_url', 'status'}
+
+
+@receiver(post_save, sender=NotaFiscal)
+def reagendar_cupom(sender, instance, update_fields=None, **kwargs):
+    """O cupom mostra a chave, o QR Code e a contingência: a nova versão do PDF vai para o pool"""
+    if instance.qrcode_url and (update_fields is None or CAMPOS_CUPOM & set(update_fields)):
+        transaction.on_commit(lambda: cupons.agendar_cupom(instance.card_payment_id))
 
 
+@receiver(post_delete, sender=NotaFiscal)
+def registrar_numero_de_nota_apagada(sender, instance, origin=None, **kwargs):
+    if origem_da_exclusao(origin) not in (NotaFiscal, CardPayment, Card):
+        return  # cascata do restaurante: o NumeroInutilizado apontaria para ele
+    if instance.status != NotaFiscal.Status.AUTORIZADA:
+        NumeroInutilizado.registrar(instance, "Nota apagada antes da autorização")
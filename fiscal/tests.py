@@ -1,3 +1,624 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.serialization import pkcs12
+from cryptography.x509.oid import NameOID
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from lxml import etree
+
+from fiscal.models import NotaFiscal, NumeroInutilizado, ServicoSefaz, comprimir_xml
+from fiscal.utils import certificados, emissao, exportacao, sefaz_fake, sefaz_local
+from fiscal.utils.assinatura import assinar_nfe
+from fiscal.utils.xml_nfce import NS_NFE, montar_xml_nfce
+from restaurants.models import Card, CardItem, CardPayment, MenuItem, Restaurant
+
+MEDIA_DE_TESTE = tempfile.mkdtemp(prefix='fiscal-tests-')
+DS = '{http://www.w3.org/2000/09/xmldsig#}'
+
+
+def gerar_pfx(senha=b'1234'):
+    """Certificado A1 autoassinado (.pfx) para assinar nos testes"""
+    chave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "RESTAURANTE TESTE:12345678000195")])
+    certificado = (
+        x509.CertificateBuilder().subject_name(nome).issuer_name(nome).public_key(chave.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(datetime.datetime(2024, 1, 1)).not_valid_after(datetime.datetime(2034, 1, 1))
+        .sign(chave, hashes.SHA256())
+    )
+    return pkcs12.serialize_key_and_certificates(
+        b'teste', chave, certificado, None, serialization.BestAvailableEncryption(senha)
+    )
+
+
+@override_settings(
+    MEDIA_ROOT=MEDIA_DE_TESTE,
+    NFCE_TRANSMISSOR='fiscal.utils.sefaz_fake.enviar_lote_para_sefaz',
+    NFCE_LOTE_JANELA_SEGUNDOS=0,
+    NFCE_RETRY_BASE_SEGUNDOS=30,
+    NFCE_RESERVA_SEGUNDOS=300,
+    NFCE_MAX_TENTATIVAS=3,
+    NFCE_CONTINGENCIA_FALHAS=3,
+)
+class NFCeTestCase(TestCase):
+    """Restaurante emissor com certificado e CSC; a SEFAZ é a falsa (sefaz_fake)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        dono = get_user_model().objects.create_user('dono', password='x')
+        cls.restaurante = Restaurant.objects.create(
+            owner=dono, name='Restaurante Teste', slug='teste', address='Rua A, 10', phone='85999999999',
+            email='r@r.com', cnpj='12345678000195', state='CE', city='FORTALEZA', street='Rua A', number='10',
+            neighborhood='Centro', zip_code='60000-000', state_registration='061234567',
+            certificate_password='1234', csc='CSCTESTE123', csc_id='000001',
+        )
+        cls.restaurante.certificate_file.save('teste.pfx', ContentFile(gerar_pfx()))
+        cls.prato = MenuItem.objects.create(restaurant=cls.restaurante, name='Prato', price=Decimal('25.90'))
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_DE_TESTE, ignore_errors=True)
+
+    def setUp(self):
+        sefaz_fake.reiniciar()
+
+    def enfileirar(self):
+        card = Card.objects.create(restaurant=self.restaurante, number=Card.objects.count() + 1)
+        CardItem.objects.create(card=card, menu_item=self.prato, price=self.prato.price)
+        pagamento = CardPayment.objects.create(
+            restaurant=self.restaurante, card=card, payment_method=CardPayment.PaymentMethod.CASH
+        )
+        return emissao.emitir(pagamento)
+
+    def rodar_fila(self, *cenarios):
+        """Um passo do worker (sem as threads: a transação do teste não é visível para outras conexões)"""
+        sefaz_fake.roteiro.extend(cenarios)
+        reservadas = emissao.reservar_notas(100)
+        for grupo in emissao.agrupar_por_restaurante(reservadas):
+            emissao.processar_lote(list(
+                NotaFiscal.objects.select_related('restaurant', 'card_payment__card').filter(pk__in=grupo).order_by('pk')
+            ))
+        return reservadas
+
+    def vencer(self, nota):
+        """Simula a passagem do tempo até a próxima tentativa da nota"""
+        NotaFiscal.objects.filter(pk=nota.pk).update(proxima_tentativa=timezone.now() - datetime.timedelta(seconds=1))
+
+    def assertAutorizadaPelaSefaz(self, nota):
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.AUTORIZADA)
+        self.assertEqual(nota.protocolo, sefaz_fake.autorizadas[nota.chave])
+        self.assertEqual(nota.recibo, '')
+
+    def assertAgendadaEm(self, nota, segundos):
+        atraso = (nota.proxima_tentativa - timezone.now()).total_seconds()
+        self.assertAlmostEqual(atraso, segundos, delta=5)
+
+
+class FilaDeEmissaoTests(NFCeTestCase):
+    def test_autoriza_em_lote(self):
+        notas = [self.enfileirar() for _ in range(3)]
+        self.rodar_fila('autorizar')
+        self.assertEqual(len(sefaz_fake.recebidos), 1)
+        self.assertEqual(len(sefaz_fake.recebidos[0]), 3)
+        for nota in notas:
+            nota.refresh_from_db()
+            self.assertEqual(nota.status, NotaFiscal.Status.AUTORIZADA)
+            self.assertTrue(nota.protocolo)
+            self.assertIsNone(nota.proxima_tentativa)
+        self.assertEqual(sorted(nota.numero for nota in notas), [1, 2, 3])
+
+    def test_falha_de_rede_reagenda_com_backoff_exponencial(self):
+        nota = self.enfileirar()
+        self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.ASSINADA)
+        self.assertEqual(nota.tentativas, 1)
+        self.assertIn('ConnectionError', nota.ultimo_erro)
+        self.assertAgendadaEm(nota, 30)
+
+        self.vencer(nota)
+        self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        self.assertEqual(nota.tentativas, 2)
+        self.assertAgendadaEm(nota, 60)
+
+        self.vencer(nota)
+        self.rodar_fila('autorizar')
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.AUTORIZADA)
+        self.assertEqual(nota.ultimo_erro, '')
+
+    def test_desiste_depois_do_maximo_de_tentativas(self):
+        nota = self.enfileirar()
+        for _ in range(3):
+            self.vencer(nota)
+            self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        self.assertEqual(nota.tentativas, 3)
+        self.assertIsNone(nota.proxima_tentativa)
+        self.assertEqual(self.rodar_fila(), [])
+
+    def test_sefaz_paralisada_108_e_109_nao_rejeita(self):
+        for cenario, cstat in (('paralisado', '108'), ('suspenso', '109')):
+            with self.subTest(cstat=cstat):
+                nota = self.enfileirar()
+                self.rodar_fila(cenario)
+                nota.refresh_from_db()
+                self.assertEqual(nota.status, NotaFiscal.Status.ASSINADA)
+                self.assertIn(cstat, nota.ultimo_erro)
+                self.assertIsNotNone(nota.proxima_tentativa)
+                self.vencer(nota)
+                self.rodar_fila('autorizar')
+                nota.refresh_from_db()
+                self.assertEqual(nota.status, NotaFiscal.Status.AUTORIZADA)
+
+    def test_falhas_seguidas_ligam_a_contingencia(self):
+        nota = self.enfileirar()
+        for cenario in ('indisponivel', 'paralisado', 'suspenso'):
+            self.vencer(nota)
+            self.rodar_fila(cenario)
+        self.assertIsNotNone(emissao.em_contingencia(nota.ambiente))
+        self.vencer(nota)
+        self.rodar_fila('autorizar')
+        self.assertFalse(ServicoSefaz.objects.filter(contingencia_desde__isnull=False).exists())
+
+    def test_rejeicao_e_definitiva(self):
+        nota = self.enfileirar()
+        self.rodar_fila('rejeitar')
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.REJEITADA)
+        self.assertEqual(nota.codigo_status, '225')
+        self.assertIsNone(nota.proxima_tentativa)
+        self.assertEqual(self.rodar_fila(), [])
+
+    def test_reserva_expirada_volta_para_a_fila(self):
+        nota = self.enfileirar()
+        self.assertEqual(emissao.reservar_notas(10), [nota.pk])  # worker reservou e morreu
+        self.assertEqual(emissao.reservar_notas(10), [])  # outro worker não pega a nota reservada
+
+        NotaFiscal.objects.filter(pk=nota.pk).update(
+            proxima_tentativa=F('proxima_tentativa') - datetime.timedelta(seconds=301)
+        )
+        self.assertEqual(self.rodar_fila('autorizar'), [nota.pk])
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.AUTORIZADA)
+
+
+class LoteSemRespostaTests(NFCeTestCase):
+    def test_recibo_em_processamento_e_consultado_sem_reenviar(self):
+        notas = [self.enfileirar() for _ in range(2)]
+        self.rodar_fila('processando')
+        for nota in notas:
+            nota.refresh_from_db()
+            self.assertEqual(nota.status, NotaFiscal.Status.ASSINADA)
+            self.assertTrue(nota.recibo)
+            self.assertIn('LoteEmProcessamento', nota.ultimo_erro)
+        self.assertFalse(ServicoSefaz.objects.filter(falhas_seguidas__gt=0).exists())
+
+        for nota in notas:
+            self.vencer(nota)
+        self.rodar_fila()
+        self.assertEqual(len(sefaz_fake.recebidos), 1)  # só o envio original
+        for nota in notas:
+            self.assertAutorizadaPelaSefaz(nota)
+
+    def test_duplicidade_grava_o_protocolo_da_autorizacao(self):
+        nota = self.enfileirar()
+        self.rodar_fila('processando')
+        NotaFiscal.objects.filter(pk=nota.pk).update(recibo='')  # worker caiu antes de guardar o recibo
+        self.vencer(nota)
+        self.rodar_fila()
+        self.assertEqual(len(sefaz_fake.recebidos), 2)  # reenviada: a SEFAZ responde 204
+        self.assertAutorizadaPelaSefaz(nota)
+        self.assertEqual(nota.codigo_status, '100')
+        self.assertFalse(NumeroInutilizado.objects.exists())
+
+    def test_duplicidade_com_outra_chave_usa_a_chave_autorizada(self):
+        nota = self.enfileirar()
+        self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        outra = nota.chave[:35] + '12345678' + nota.chave[43]  # mesmo número, outro cNF
+        sefaz_fake.autorizadas[outra] = '399999999999999'
+        self.vencer(nota)
+        self.rodar_fila()
+        nota.refresh_from_db()
+        self.assertEqual((nota.status, nota.chave, nota.protocolo), (NotaFiscal.Status.AUTORIZADA, outra, '399999999999999'))
+
+    def test_duplicidade_sem_autorizacao_continua_na_fila(self):
+        nota = self.enfileirar()
+        self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        with self.assertRaisesMessage(emissao.FalhaTemporaria, '217'):  # a chave não consta na SEFAZ
+            emissao.registrar_retorno(nota, '204', 'Rejeição: Duplicidade de NF-e', '')
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.ASSINADA)
+
+
+@override_settings(
+    NFCE_TRANSMISSOR='fiscal.utils.sefaz_ce.enviar_lote_para_sefaz',
+    NFCE_RECIBO_CONSULTAS=2,
+    NFCE_RECIBO_ESPERA_SEGUNDOS=0,
+    NFCE_WSDL_CACHE=f'{MEDIA_DE_TESTE}/wsdl.sqlite3',
+)
+class SefazLocalTests(NFCeTestCase):
+    """O caminho real do sefaz_ce (zeep, lote assíncrono, recibo) contra a SEFAZ local"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.servidor = sefaz_local.iniciar(porta=0)
+        cls.addClassCleanup(cls.servidor.shutdown)
+        url = cls.servidor.url_base
+        cls.enterClassContext(override_settings(NFCE_WSDL_BASE={'homologacao': url, 'producao': url}))
+
+    def setUp(self):
+        super().setUp()
+        self.servidor.chamadas.clear()
+        self.servidor.consultas_em_processamento = 3  # mais que NFCE_RECIBO_CONSULTAS
+
+    def servicos_chamados(self):
+        return [servico for servico, _, _ in self.servidor.chamadas]
+
+    def test_recibo_que_estoura_o_tempo_e_consultado_de_novo(self):
+        notas = [self.enfileirar() for _ in range(2)]
+        self.rodar_fila()
+        self.assertEqual(self.servicos_chamados(), ['NFeAutorizacao4'] + ['NFeRetAutorizacao4'] * 2)
+        for nota in notas:
+            nota.refresh_from_db()
+            self.assertTrue(nota.recibo)
+            self.vencer(nota)
+
+        self.rodar_fila()
+        self.assertEqual(self.servicos_chamados().count('NFeAutorizacao4'), 1)
+        for nota in notas:
+            self.assertAutorizadaPelaSefaz(nota)
+
+    def test_tempo_esgotado_seguido_de_duplicidade(self):
+        notas = [self.enfileirar() for _ in range(2)]
+        self.rodar_fila()
+        NotaFiscal.objects.update(recibo='')  # recibo perdido: o lote vai de novo
+        self.servidor.consultas_em_processamento = 0
+        for nota in notas:
+            self.vencer(nota)
+
+        self.rodar_fila()
+        self.assertEqual(self.servicos_chamados()[3:], [
+            'NFeAutorizacao4', 'NFeRetAutorizacao4', 'NFeConsultaProtocolo4', 'NFeConsultaProtocolo4',
+        ])
+        for nota in notas:
+            self.assertAutorizadaPelaSefaz(nota)
+            self.assertEqual(nota.codigo_status, '100')
+
+
+class NumeroInutilizadoTests(NFCeTestCase):
+    def assinada(self):
+        nota = self.enfileirar()
+        self.rodar_fila('indisponivel')
+        nota.refresh_from_db()
+        return nota
+
+    def inutilizados(self):
+        return list(NumeroInutilizado.objects.values_list('numero', flat=True))
+
+    def test_rejeicao_da_nota_registra_o_numero(self):
+        nota = self.enfileirar()
+        self.rodar_fila('rejeitar')
+        nota.refresh_from_db()
+        self.assertEqual(self.inutilizados(), [nota.numero])
+
+    def test_rejeicoes_que_nao_liberam_o_numero(self):
+        nota = self.assinada()
+        for cstat, motivo, do_lote in (
+            ('110', 'Uso Denegado', False),
+            ('206', 'Rejeição: NF-e já está inutilizada na Base de dados da SEFAZ', False),
+            ('656', 'Rejeição: Consumo Indevido', True),
+        ):
+            with self.subTest(cstat=cstat):
+                emissao.registrar_retorno(nota, cstat, motivo, '', rejeicao_do_lote=do_lote)
+                self.assertEqual(nota.status, NotaFiscal.Status.REJEITADA)
+        self.assertEqual(self.inutilizados(), [])
+
+    def test_nota_apagada_antes_da_autorizacao(self):
+        primeira, segunda = self.assinada(), self.assinada()
+        primeira.delete()
+        segunda.card_payment.card.delete()
+        self.assertEqual(sorted(self.inutilizados()), [primeira.numero, segunda.numero])
+
+    def test_cascata_do_restaurante_nao_registra(self):
+        card = Card.objects.create(restaurant=self.restaurante, number=1)  # sem itens (menu_item é PROTECT)
+        pagamento = CardPayment.objects.create(
+            restaurant=self.restaurante, card=card, payment_method=CardPayment.PaymentMethod.CASH
+        )
+        NotaFiscal.objects.filter(pk=NotaFiscal.enfileirar(pagamento).pk).update(numero=7)
+        Restaurant.objects.get(pk=self.restaurante.pk).delete()
+        connection.check_constraints()
+        self.assertEqual(self.inutilizados(), [])
+
+
+def c14n(elemento):
+    """C14N 1.0 da subárvore, como na Reference da assinatura.
+
+    A subárvore vira um documento próprio antes: a c14n do lxml direto num elemento interno
+    emite xmlns="" nos filhos com libxml2 2.14.
+    """
+    return etree.tostring(etree.fromstring(etree.tostring(elemento)), method='c14n')
+
+
+class AssinaturaEmMemoriaTests(NFCeTestCase):
+    def verificar(self, xml, certificado):
+        raiz = etree.fromstring(xml)
+        inf_nfe = raiz.find(f'{{{NS_NFE}}}infNFe')
+        assinatura = raiz.find(f'{DS}Signature')
+        referencia = assinatura.find(f'{DS}SignedInfo/{DS}Reference')
+        self.assertEqual(referencia.get('URI'), f"#{inf_nfe.get('Id')}")
+        digest = base64.b64encode(hashlib.sha1(c14n(inf_nfe)).digest()).decode()
+        self.assertEqual(referencia.findtext(f'{DS}DigestValue').strip(), digest)
+        certificado.certificado.public_key().verify(
+            base64.b64decode(assinatura.findtext(f'{DS}SignatureValue')),
+            c14n(assinatura.find(f'{DS}SignedInfo')), padding.PKCS1v15(), hashes.SHA1(),
+        )
+        return inf_nfe.get('Id')
+
+    def test_mil_notas_assinadas_em_paralelo_sem_tocar_o_disco(self):
+        nota = NotaFiscal.objects.select_related('restaurant', 'card_payment').get(pk=self.enfileirar().pk)
+        documentos = []
+        for numero in range(1, 1001):
+            nota.numero, nota.chave = numero, None
+            documentos.append(montar_xml_nfce(nota))
+        certificado = certificados.certificado_do_restaurante(self.restaurante)
+
+        with mock.patch('builtins.open', side_effect=AssertionError('assinatura abriu um arquivo')), \
+                mock.patch('tempfile.mkstemp', side_effect=AssertionError('assinatura criou arquivo temporário')):
+            with ThreadPoolExecutor(8) as executor:
+                assinados = list(executor.map(lambda xml: assinar_nfe(xml, certificado), documentos))
+
+        ids = {self.verificar(xml, certificado) for xml in assinados}
+        self.assertEqual(len(ids), 1000)
+
+    def test_xml_comprimido_mantem_a_assinatura(self):
+        nota = self.enfileirar()
+        self.rodar_fila('autorizar')
+        nota = NotaFiscal.objects.get(pk=nota.pk)
+        self.assertEqual(bytes(nota.xml_gz[:2]), b'\x1f\x8b')
+        xml = nota.xml
+        self.assertTrue(xml.startswith('<NFe xmlns="http://www.portalfiscal.inf.br/nfe">'))
+        self.assertEqual(self.verificar(xml.encode(), certificados.certificado_do_restaurante(self.restaurante)),
+                         f'NFe{nota.chave}')
+        self.assertEqual(comprimir_xml(xml), bytes(nota.xml_gz))  # c14n + gzip sem mtime: determinístico
+
+
+class XmlComprimidoTests(NFCeTestCase):
+    """Listagens do admin não leem o XML; o download entrega o gzip do banco quando pode"""
+
+    def setUp(self):
+        super().setUp()
+        self.nota = self.enfileirar()
+        self.rodar_fila('autorizar')
+        self.nota.refresh_from_db()
+        admin = get_user_model().objects.create_superuser('admin', password='x')
+        self.client.force_login(admin)
+
+    def assertNaoLeXml(self, changelist, objeto):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse(changelist))
+        self.assertContains(response, f'/{objeto.pk}/change/')
+        self.assertFalse([q['sql'] for q in queries if 'xml_gz' in q['sql']])
+
+    def test_listagens_do_admin_nao_selecionam_xml_gz(self):
+        self.assertNaoLeXml('admin:fiscal_notafiscal_changelist', self.nota)
+        self.assertNaoLeXml('admin:restaurants_cardpayment_changelist', self.nota.card_payment)
+
+    def baixar(self, **headers):
+        response = self.client.get(reverse('baixar_xml_nfce', args=[self.nota.pk]), **headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{self.nota.chave}-nfe.xml"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        return response
+
+    def test_download_em_gzip_sai_direto_do_banco(self):
+        response = self.baixar(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response.content, bytes(self.nota.xml_gz))
+
+    def test_download_sem_gzip_descomprime(self):
+        response = self.baixar()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response.content.decode('utf-8'), self.nota.xml)
+
+
+class ExportacaoTests(NFCeTestCase):
+    """CSV e ZIP da contabilidade (fiscal/utils/exportacao.py e manage.py exportar_notas)"""
+
+    def setUp(self):
+        super().setUp()
+        notas = [self.enfileirar() for _ in range(4)]
+        self.rodar_fila('autorizar')
+        self.dezembro, self.virada, self.janeiro, self.sem_xml = [
+            NotaFiscal.objects.get(pk=nota.pk) for nota in notas
+        ]
+        self.emitir_em(self.dezembro, datetime.datetime(2025, 12, 1, 0, 0))
+        self.emitir_em(self.virada, datetime.datetime(2025, 12, 31, 23, 30))  # 02:30 UTC de 1º de janeiro
+        self.emitir_em(self.janeiro, datetime.datetime(2026, 1, 1, 0, 0))
+        self.emitir_em(self.sem_xml, datetime.datetime(2025, 12, 15, 12, 0))
+        NotaFiscal.objects.filter(pk=self.sem_xml.pk).update(xml_gz=b'')
+
+    def emitir_em(self, nota, quando):
+        nota.emitido_em = timezone.make_aware(quando)
+        NotaFiscal.objects.filter(pk=nota.pk).update(emitido_em=nota.emitido_em)
+
+    def test_virada_de_dezembro_para_janeiro_em_hora_local(self):
+        self.assertEqual(
+            list(exportacao.notas_do_mes(2025, 12).order_by('emitido_em')),
+            [self.dezembro, self.sem_xml, self.virada],
+        )
+        self.assertEqual(list(exportacao.notas_do_mes(2026, 1)), [self.janeiro])
+        self.assertFalse(exportacao.notas_do_mes(2025, 12, self.restaurante.pk + 1).exists())
+
+    def test_notas_nao_autorizadas_ficam_de_fora(self):
+        NotaFiscal.objects.filter(pk=self.dezembro.pk).update(status=NotaFiscal.Status.REJEITADA)
+        self.assertNotIn(self.dezembro, exportacao.notas_do_mes(2025, 12))
+
+    def test_csv_em_uma_consulta_com_hora_local(self):
+        with self.assertNumQueries(1):
+            linhas = list(csv.reader(exportacao.linhas_csv(exportacao.notas_do_mes(2025, 12))))
+        self.assertEqual(linhas[0], exportacao.CABECALHO_CSV)
+        self.assertEqual(linhas[3], [
+            str(self.virada.numero), '1', '12345678000195', self.virada.chave, '25.90', '31/12/2025 23:30',
+            'Homologação',
+        ])
+        self.assertEqual([linha[3] for linha in linhas[1:]], [self.dezembro.chave, self.sem_xml.chave, self.virada.chave])
+
+    def test_zip_com_um_xml_por_nota_autorizada(self):
+        conteudo = b''.join(exportacao.partes_zip_xmls(exportacao.notas_do_mes(2025, 12)))
+        with zipfile.ZipFile(io.BytesIO(conteudo)) as arquivo_zip:
+            self.assertIsNone(arquivo_zip.testzip())
+            self.assertEqual(arquivo_zip.namelist(), [f'{self.dezembro.chave}-nfe.xml', f'{self.virada.chave}-nfe.xml'])
+            self.assertEqual(arquivo_zip.read(f'{self.virada.chave}-nfe.xml').decode(), self.virada.xml)
+
+    def test_comando_grava_csv_e_zip(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            saida = io.StringIO()
+            call_command('exportar_notas', '--mes', '2025-12', '--saida', pasta, stdout=saida)
+            with open(f'{pasta}/notas_2025-12.csv', encoding='utf-8') as arquivo:
+                self.assertEqual(len(list(csv.reader(arquivo))), 4)
+            with zipfile.ZipFile(f'{pasta}/xmls_2025-12.zip') as arquivo_zip:
+                self.assertEqual(len(arquivo_zip.namelist()), 2)
+        self.assertIn('notas_2025-12.csv: 3 notas', saida.getvalue())
+
+    def test_mes_invalido(self):
+        with self.assertRaisesMessage(CommandError, 'AAAA-MM'):
+            call_command('exportar_notas', '--mes', '12/2025')
+
+
+class CertificadoEmCacheTests(NFCeTestCase):
+    """O .pfx é decifrado uma vez por restaurante e relido só quando o cadastro muda"""
+
+    def setUp(self):
+        super().setUp()
+        certificados.limpar()
+        self.addCleanup(certificados.limpar)
+        self.ler_pfx = self.enterContext(mock.patch.object(certificados, 'ler_pfx', wraps=certificados.ler_pfx))
+
+    def em_cache(self, restaurante):
+        return ('restaurant', restaurante.pk) in certificados._cache
+
+    def test_decifra_uma_vez_por_restaurante(self):
+        primeiro = certificados.certificado_do_restaurante(self.restaurante)
+        for _ in range(5):
+            self.assertIs(certificados.certificado_do_restaurante(self.restaurante), primeiro)
+        outro = Restaurant.objects.create(
+            owner=self.restaurante.owner, name='Outro', slug='outro', address='Rua B', phone='1', email='o@o.com',
+            certificate_password='1234',
+        )
+        outro.certificate_file.save('outro.pfx', ContentFile(gerar_pfx()))
+        self.assertIsNot(certificados.certificado_do_restaurante(outro), primeiro)
+        certificados.certificado_do_restaurante(outro)
+        self.assertEqual(self.ler_pfx.call_count, 2)
+
+    def test_novo_arquivo_no_cadastro_descarta(self):
+        antigo = certificados.certificado_do_restaurante(self.restaurante)
+        self.restaurante.certificate_file.save('novo.pfx', ContentFile(gerar_pfx()))
+        self.assertFalse(self.em_cache(self.restaurante))
+        novo = certificados.certificado_do_restaurante(self.restaurante)
+        self.assertNotEqual(novo.certificado_pem, antigo.certificado_pem)
+        self.assertEqual(self.ler_pfx.call_count, 2)
+
+    def test_arquivo_substituido_no_disco_e_relido(self):
+        certificados.certificado_do_restaurante(self.restaurante)
+        caminho = self.restaurante.certificate_file.path
+        with open(caminho, 'wb') as arquivo:  # mesmo caminho e senha, outro certificado
+            arquivo.write(gerar_pfx())
+        mtime = os.stat(caminho).st_mtime_ns + 1_000_000_000
+        os.utime(caminho, ns=(mtime, mtime))
+        certificados.certificado_do_restaurante(self.restaurante)
+        certificados.certificado_do_restaurante(self.restaurante)
+        self.assertEqual(self.ler_pfx.call_count, 2)
+
+    def test_troca_de_senha_descarta(self):
+        certificados.certificado_do_restaurante(self.restaurante)
+        self.restaurante.name = 'Outro nome'
+        self.restaurante.save(update_fields=['name'])
+        self.assertTrue(self.em_cache(self.restaurante))
+
+        self.restaurante.certificate_password = 'outra'
+        self.restaurante.save(update_fields=['certificate_password'])
+        self.assertFalse(self.em_cache(self.restaurante))
+
+    def test_restaurante_apagado_sai_do_cache(self):
+        certificados.certificado_do_restaurante(self.restaurante)
+        Restaurant.objects.get(pk=self.restaurante.pk).delete()
+        self.assertFalse(self.em_cache(self.restaurante))
+
+
+class ContingenciaOfflineTests(NFCeTestCase):
+    """Com a SEFAZ em contingência a nota é assinada no próprio pedido (tpEmis=9) e transmitida depois"""
+
+    def setUp(self):
+        super().setUp()
+        ServicoSefaz.objects.create(
+            ambiente=NotaFiscal.AmbienteChoices.HOMOLOGACAO, contingencia_desde=timezone.now(),
+            justificativa='SEFAZ indisponivel para autorizacao',
+        )
+
+    def test_emitir_assina_na_hora(self):
+        nota = self.enfileirar()
+        nota.refresh_from_db()
+        self.assertEqual(nota.status, NotaFiscal.Status.CONTINGENCIA)
+        self.assertEqual(nota.chave[34], '9')
+        raiz = etree.fromstring(nota.xml.encode())
+        ide = raiz.find(f'.//{{{NS_NFE}}}ide')
+        self.assertEqual(ide.findtext(f'{{{NS_NFE}}}tpEmis'), '9')
+        self.assertEqual(ide.findtext(f'{{{NS_NFE}}}xJust'), 'SEFAZ indisponivel para autorizacao')
+        self.assertIsNotNone(ide.findtext(f'{{{NS_NFE}}}dhCont'))
+        self.assertEqual(raiz.findtext(f'.//{{{NS_NFE}}}qrCode'), nota.qrcode_url)
+        self.assertEqual(sefaz_fake.recebidos, [])  # nada foi transmitido no pedido
+
+    def test_qrcode_offline_confere_com_o_hash_calculado_a_mao(self):
+        nota = self.enfileirar()
+        nota.refresh_from_db()
+        raiz = etree.fromstring(nota.xml.encode())
+        dia = raiz.findtext(f'.//{{{NS_NFE}}}dhEmi')[8:10]
+        valor = raiz.findtext(f'.//{{{NS_NFE}}}ICMSTot/{{{NS_NFE}}}vNF')
+        digest = raiz.findtext(f'.//{DS}DigestValue').strip()
+        self.assertEqual(valor, '25.90')
+
+        base = f"{nota.chave}|2|2|{dia}|25.90|{digest.encode().hex()}|1"
+        esperado = f"{base}|{hashlib.sha1((base + 'CSCTESTE123').encode()).hexdigest().upper()}"
+        parametro = nota.qrcode_url.split('?p=', 1)[1]
+        self.assertEqual(parametro, esperado)
+        self.assertEqual(len(parametro.split('|')), 8)
+
+    def test_fila_transmite_depois_a_mesma_nota(self):
+        nota = self.enfileirar()
+        nota.refresh_from_db()
+        assinada = nota.xml
+        self.vencer(nota)
+        self.rodar_fila('autorizar')
+        self.assertAutorizadaPelaSefaz(nota)
+        self.assertEqual(nota.chave[34], '9')
+        self.assertEqual(nota.xml, assinada)  # não assina de novo: o cupom já saiu com este QR Code
+        self.assertEqual(len(sefaz_fake.recebidos), 1)
+        self.assertIsNone(emissao.em_contingencia(nota.ambiente))  # a resposta da SEFAZ encerra a contingência
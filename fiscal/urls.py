@@ -5,4 +5,5 @@ from fiscal import views as fiscal_views
 urlpatterns = [
     path('emitir-nfce/<int:pk>/', views.emitir_nfce, name='emitir_nfce'),
     path('admin/emitir-nfce/<int:pk>/', fiscal_views.emitir_nfce, name='emitir_nfce'),
+    path('notas/<int:pk>/xml/', views.baixar_xml, name='baixar_xml_nfce'),
 ]
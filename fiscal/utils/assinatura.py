@@ -1,27 +1,50 @@
-from cryptography.hazmat.primitives.serialization import pkcs12, Encoding, PrivateFormat, NoEncryption
-from cryptography.hazmat.backends import default_backend
-from signxml import XMLSigner, methods
+import xmlsec
 from lxml import etree
-from signxml import XMLSigner
+from signxml import XMLSigner, methods
 
-def assinar_xml_com_signxml(xml_path, pfx_path, pfx_password):
-    # Carrega o arquivo PFX
-    with open(pfx_path, 'rb') as f:
-        pfx_data = f.read()
+from fiscal.utils.certificados import carregar_certificado
+from fiscal.utils.xml_nfce import NS_NFE
 
-    # Extrai chave privada e certificado
-    private_key, cert, _ = pkcs12.load_key_and_certificates(
-        pfx_data, pfx_password.encode(), backend=default_backend()
-    )
 
-    # Exporta como PEM
-    private_key_pem = private_key.private_bytes(
-        Encoding.PEM,
-        PrivateFormat.TraditionalOpenSSL,
-        NoEncryption()
-    )
+def assinar_arvore(raiz, certificado):
+    """Assina no lugar o elemento NFe (lxml) com o CertificadoA1 (fiscal.utils.certificados)"""
+    inf_nfe = raiz.find(f'{{{NS_NFE}}}infNFe')
+
+    # Signature sem prefixo, depois de infNFe, como pede o leiaute (RSA-SHA1, C14N 1.0)
+    assinatura = xmlsec.template.create(raiz, xmlsec.Transform.C14N, xmlsec.Transform.RSA_SHA1)
+    referencia = xmlsec.template.add_reference(assinatura, xmlsec.Transform.SHA1, uri=f"#{inf_nfe.get('Id')}")
+    xmlsec.template.add_transform(referencia, xmlsec.Transform.ENVELOPED)
+    xmlsec.template.add_transform(referencia, xmlsec.Transform.C14N)
+    xmlsec.template.add_x509_data(xmlsec.template.ensure_key_info(assinatura))
+    raiz.append(assinatura)
+
+    contexto = xmlsec.SignatureContext()
+    contexto.register_id(inf_nfe, 'Id')
+    contexto.key = certificado.chave_xmlsec
+    contexto.sign(assinatura)
+    return raiz
+
+
+def assinar_nfe(nfe, certificado):
+    """Assina a NFe em memória e devolve os bytes, serializados uma única vez.
+
+    `nfe` pode ser bytes ou o elemento lxml (assinado no lugar). Nada é escrito em disco.
+    """
+    raiz = etree.fromstring(nfe) if isinstance(nfe, bytes) else nfe
+    return etree.tostring(assinar_arvore(raiz, certificado), encoding='utf-8')
 
-    cert_pem = cert.public_bytes(Encoding.PEM)
+
+class AssinadorNFe(XMLSigner):
+    """O leiaute da NF-e ainda exige RSA-SHA1; o signxml só aceita SHA1 sobrescrevendo esta checagem"""
+
+    def check_deprecated_methods(self):
+        pass
+
+
+def assinar_xml_com_signxml(xml_path, pfx_path=None, pfx_password=None, certificado=None):
+    """Assina a NFe de um arquivo com o signxml (scripts avulsos; a fila usa assinar_nfe)"""
+    if certificado is None:
+        certificado = carregar_certificado(pfx_path, pfx_password)
 
     # Carrega XML
     with open(xml_path, 'rb') as f:
@@ -31,25 +54,20 @@ def assinar_xml_com_signxml(xml_path, pfx_path, pfx_password):
     root = etree.fromstring(xml_data)
 
     # Assinador
-    
-
-    signer = XMLSigner(
+    signer = AssinadorNFe(
         method=methods.enveloped,
         signature_algorithm='rsa-sha1',
-        digest_algorithm='sha1'
+        digest_algorithm='sha1',
+        c14n_algorithm='http://www.w3.org/TR/2001/REC-xml-c14n-20010315',
     )
 
-
-
-
-
-    # Assina
+    # Assina com os objetos já carregados (sem reconverter PEM a cada nota)
     signed_root = signer.sign(
         root,
-        key=private_key_pem,
-        cert=cert_pem,
-        reference_uri=""
+        key=certificado.chave,
+        cert=[certificado.certificado],
+        reference_uri=f"#{root.find('.//{*}infNFe').get('Id')}"
     )
 
     # Serializa
-    return etree.tostring(signed_root, pretty_print=True, encoding="utf-8")
+    return etree.tostring(signed_root, encoding="utf-8")
@@ -0,0 +1,96 @@
+# fiscal/utils/certificados.py
+"""Cache em memória dos certificados A1 (.pfx) dos restaurantes.
+
+Decifrar o PKCS#12 é a parte cara da assinatura; aqui isso acontece uma vez por
+restaurante e por processo. A entrada vale enquanto o caminho, o mtime do arquivo e
+a senha forem os mesmos, e é descartada quando o cadastro troca o certificado
+(sinais no fim de fiscal/models.py).
+"""
+import hashlib
+import os
+import threading
+from dataclasses import dataclass
+from functools import cached_property
+
+from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, pkcs12
+
+
+@dataclass
+class CertificadoA1:
+    chave: object  # chave privada (cryptography)
+    certificado: object  # x509.Certificate
+    chave_pem: bytes
+    certificado_pem: bytes
+
+    @cached_property
+    def chave_xmlsec(self):
+        """xmlsec.Key com o certificado anexado (o SignatureContext guarda uma cópia)"""
+        import xmlsec
+
+        chave = xmlsec.Key.from_memory(self.chave_pem, xmlsec.constants.KeyDataFormatPem)
+        chave.load_cert_from_memory(self.certificado_pem, xmlsec.constants.KeyDataFormatPem)
+        return chave
+
+
+_cache = {}  # chave do cache -> (identidade, CertificadoA1)
+_lock = threading.Lock()
+
+
+def _identidade(caminho, senha):
+    return caminho, os.stat(caminho).st_mtime_ns, hashlib.sha256(senha.encode()).hexdigest()
+
+
+def ler_pfx(caminho, senha):
+    """Lê e decifra o .pfx, sem cache"""
+    with open(caminho, 'rb') as arquivo:
+        chave, certificado, _ = pkcs12.load_key_and_certificates(arquivo.read(), senha.encode())
+    return CertificadoA1(
+        chave=chave,
+        certificado=certificado,
+        chave_pem=chave.private_bytes(Encoding.PEM, PrivateFormat.TraditionalOpenSSL, NoEncryption()),
+        certificado_pem=certificado.public_bytes(Encoding.PEM),
+    )
+
+
+def carregar_certificado(caminho, senha, chave_cache=None):
+    """CertificadoA1 do cache; relê o arquivo se ele mudou (caminho, mtime ou senha)"""
+    chave_cache = chave_cache or caminho
+    identidade = _identidade(caminho, senha)
+    with _lock:
+        entrada = _cache.get(chave_cache)
+    if entrada and entrada[0] == identidade:
+        return entrada[1]
+    certificado = ler_pfx(caminho, senha)
+    with _lock:
+        _cache[chave_cache] = (identidade, certificado)
+    return certificado
+
+
+def certificado_do_restaurante(restaurant):
+    return carregar_certificado(
+        restaurant.certificate_file.path, restaurant.certificate_password, chave_cache=('restaurant', restaurant.pk)
+    )
+
+
+def descartar(restaurant):
+    with _lock:
+        _cache.pop(('restaurant', restaurant.pk), None)
+
+
+def descartar_se_alterado(restaurant):
+    """Tira do cache o certificado do restaurante se o arquivo ou a senha do cadastro mudaram"""
+    with _lock:
+        entrada = _cache.get(('restaurant', restaurant.pk))
+    if entrada is None:
+        return
+    try:
+        atual = _identidade(restaurant.certificate_file.path, restaurant.certificate_password)
+    except (ValueError, OSError):  # sem arquivo
+        atual = None
+    if entrada[0] != atual:
+        descartar(restaurant)
+
+
+def limpar():
+    with _lock:
+        _cache.clear()
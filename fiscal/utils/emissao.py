@@ -1,19 +1,333 @@
-from fiscal.utils.assinatura import assinar_xml_com_signxml as assinar_xml
-from fiscal.utils.sefaz_ce import enviar_xml_para_sefaz
+# fiscal/utils/emissao.py
+"""Fila de emissão de NFC-e.
 
-from pathlib import Path
+Cada CardPayment vira uma NotaFiscal PENDENTE (NotaFiscal.enfileirar). O worker
+`manage.py processar_nfce` reserva as notas vencidas, agrupa por restaurante e, num
+pool de threads, monta e assina o XML de cada nota (-> ASSINADA) e transmite o grupo
+à SEFAZ em lotes de até 50 (-> AUTORIZADA ou REJEITADA, pelo protNFe de cada chave).
+Um restaurante só é atendido quando a nota vencida mais antiga dele espera há
+NFCE_LOTE_JANELA_SEGUNDOS, para juntar as vendas próximas no mesmo lote.
+Falhas de rede ou SEFAZ paralisada reagendam as notas com backoff exponencial.
 
-def emitir_nfce_cardpayment(cardpayment):
-    xml_path = f'/tmp/nfce_{cardpayment.id}.xml'
+A SEFAZ pode já ter a nota mesmo quando a fila não viu a resposta. Lote que continua
+em processamento guarda o recibo (NotaFiscal.recibo) e a próxima tentativa consulta
+o recibo em vez de reenviar. Duplicidade (204/539) não é rejeição: a chave é
+consultada (NfeConsultaProtocolo) e o protocolo da autorização é gravado.
 
-    # Aqui você gera o XML da nota com os dados do pagamento (salve como xml_path)
-    with open(xml_path, 'w') as f:
-        f.write(cardpayment.gerar_xml())  # Suponha que cardpayment gere XML
+Numeração: a nota só recebe número (SequenciaNFCe) quando vai ser assinada; o worker
+reserva um bloco por lote de uma vez. Números de notas rejeitadas ou apagadas ficam
+em NumeroInutilizado, para a inutilização na SEFAZ.
 
-    certificado_path = Path('/caminho/do/certificado.pfx')
-    senha_certificado = 'sua_senha'
+Contingência offline (tpEmis=9): após NFCE_CONTINGENCIA_FALHAS falhas de comunicação
+seguidas o ServicoSefaz do ambiente entra em contingência. Notas novas passam a ser
+assinadas na hora, com o QR Code offline (-> CONTINGENCIA), e o cupom já pode ser
+impresso; o próprio worker as transmite depois, sem desistir, e a primeira resposta
+da SEFAZ encerra a contingência.
+"""
+import logging
+import re
+from collections import defaultdict
+from datetime import timedelta
 
-    xml_assinado = assinar_xml(xml_path, certificado_path, senha_certificado)
-    resposta = enviar_xml_para_sefaz(xml_assinado)
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from lxml import etree
+from zeep.exceptions import TransportError
 
-    return resposta
+from fiscal.models import NotaFiscal, NumeroInutilizado, SequenciaNFCe, ServicoSefaz
+from fiscal.utils.assinatura import assinar_arvore
+from fiscal.utils.certificados import certificado_do_restaurante
+from fiscal.utils.sefaz_ce import LOTE_MAXIMO, LoteEmProcessamento
+from fiscal.utils.qrcode_nfce import adicionar_qrcode
+from fiscal.utils.xml_nfce import NS_NFE, TP_EMIS_CONTINGENCIA, montar_arvore_nfce
+
+logger = logging.getLogger(__name__)
+
+CSTAT_AUTORIZADA = {'100', '150'}
+CSTAT_TEMPORARIO = {'108', '109'}  # serviço paralisado: não é rejeição da nota
+CSTAT_LOTE_PROCESSADO = {'104'}
+CSTAT_DUPLICIDADE = {'204', '539'}  # a SEFAZ já tem a nota (539: o número, com outra chave)
+# Denegada, cancelada ou já inutilizada: o número foi consumido na SEFAZ e não se inutiliza
+CSTAT_NUMERO_USADO = {'110', '205', '206', '218', '301', '302', '303'}
+
+STATUS_NA_FILA = [NotaFiscal.Status.PENDENTE, NotaFiscal.Status.ASSINADA, NotaFiscal.Status.CONTINGENCIA]
+
+
+class FalhaTemporaria(Exception):
+    pass
+
+
+# Erros que indicam SEFAZ fora do ar (contam para entrar em contingência)
+FALHAS_DE_COMUNICACAO = (FalhaTemporaria, OSError, TransportError)
+
+
+def _config(nome, padrao):
+    return getattr(settings, nome, padrao)
+
+
+def _sefaz(funcao):
+    """Função do módulo do NFCE_TRANSMISSOR (sefaz_ce ou sefaz_fake): enviar_lote_para_sefaz,
+    consultar_recibo ou consultar_protocolo"""
+    modulo = _config('NFCE_TRANSMISSOR', 'fiscal.utils.sefaz_ce.enviar_lote_para_sefaz').rsplit('.', 1)[0]
+    return import_string(f"{modulo}.{funcao}")
+
+
+def _ambiente(nota):
+    return 'homologacao' if nota.ambiente == NotaFiscal.AmbienteChoices.HOMOLOGACAO else 'producao'
+
+
+def interpretar_retorno(xml_resposta):
+    """(cStat, xMotivo) do lote e {chave: (cStat, xMotivo, nProt)} dos protNFe"""
+    raiz = etree.fromstring(xml_resposta)
+    protocolos = {}
+    for inf_prot in raiz.iter(f'{{{NS_NFE}}}infProt'):
+        protocolos[inf_prot.findtext(f'{{{NS_NFE}}}chNFe')] = (
+            inf_prot.findtext(f'{{{NS_NFE}}}cStat', ''),
+            inf_prot.findtext(f'{{{NS_NFE}}}xMotivo', ''),
+            inf_prot.findtext(f'{{{NS_NFE}}}nProt', ''),
+        )
+    return raiz.findtext(f'{{{NS_NFE}}}cStat', ''), raiz.findtext(f'{{{NS_NFE}}}xMotivo', ''), protocolos
+
+
+def em_contingencia(ambiente):
+    """ServicoSefaz do ambiente se ele estiver em contingência, senão None"""
+    return ServicoSefaz.objects.filter(ambiente=ambiente, contingencia_desde__isnull=False).first()
+
+
+def registrar_falha_sefaz(ambiente, erro):
+    ServicoSefaz.objects.get_or_create(ambiente=ambiente)
+    servicos = ServicoSefaz.objects.filter(ambiente=ambiente)
+    servicos.update(falhas_seguidas=F('falhas_seguidas') + 1, atualizado_em=timezone.now())
+    servicos.filter(
+        contingencia_desde__isnull=True, falhas_seguidas__gte=_config('NFCE_CONTINGENCIA_FALHAS', 3)
+    ).update(contingencia_desde=timezone.now(), justificativa=f"SEFAZ indisponivel: {erro}"[:256])
+
+
+def registrar_resposta_sefaz(ambiente):
+    ServicoSefaz.objects.filter(ambiente=ambiente).exclude(
+        falhas_seguidas=0, contingencia_desde__isnull=True
+    ).update(falhas_seguidas=0, contingencia_desde=None, justificativa='', atualizado_em=timezone.now())
+
+
+def numerar(notas):
+    """Numera as notas ainda sem número, na ordem da lista, com um bloco da sequência por série"""
+    sem_numero = defaultdict(list)
+    for nota in notas:
+        if nota.numero is None:
+            sem_numero[nota.restaurant_id, nota.serie].append(nota)
+    for (restaurante, serie), grupo in sem_numero.items():
+        with transaction.atomic():  # o bloco só sai da sequência junto com as notas numeradas
+            for nota, numero in zip(grupo, SequenciaNFCe.reservar(restaurante, serie, len(grupo))):
+                nota.numero = numero
+            NotaFiscal.objects.bulk_update(grupo, ['numero'])
+
+
+def assinar_nota(nota, contingencia=None):
+    """Monta e assina o XML e inclui o QR Code; com `contingencia` (ServicoSefaz) a nota sai offline"""
+    restaurante = nota.restaurant
+    numerar([nota])
+    if contingencia:
+        arvore = montar_arvore_nfce(
+            nota, TP_EMIS_CONTINGENCIA,
+            contingencia_desde=contingencia.contingencia_desde, justificativa=contingencia.justificativa,
+        )
+    else:
+        arvore = montar_arvore_nfce(nota)
+    assinar_arvore(arvore, certificado_do_restaurante(restaurante))
+    nota.qrcode_url = adicionar_qrcode(arvore, restaurante.csc, restaurante.csc_id)
+    nota.xml = etree.tostring(arvore, encoding='utf-8')
+    nota.status = NotaFiscal.Status.CONTINGENCIA if contingencia else NotaFiscal.Status.ASSINADA
+    nota.save(update_fields=['chave', 'xml_gz', 'qrcode_url', 'status'])
+
+
+def emitir(card_payment):
+    """Enfileira a nota do pagamento; em contingência já a assina offline, para o cupom sair com o QR Code"""
+    nota = NotaFiscal.enfileirar(card_payment)
+    contingencia = nota.status == NotaFiscal.Status.PENDENTE and em_contingencia(nota.ambiente)
+    if not contingencia:
+        return nota
+    # Reserva como o worker (reservar_notas), para a nota não ser assinada duas vezes
+    prazo = timezone.now() + timedelta(seconds=_config('NFCE_RESERVA_SEGUNDOS', 300))
+    if NotaFiscal.objects.filter(
+        pk=nota.pk, status=NotaFiscal.Status.PENDENTE, proxima_tentativa=nota.proxima_tentativa
+    ).update(proxima_tentativa=prazo):
+        assinar_nota(nota, contingencia)
+        nota.proxima_tentativa = timezone.now()
+        nota.save(update_fields=['proxima_tentativa'])
+    return nota
+
+
+def buscar_autorizacao(nota, chave=None):
+    """Consulta a chave na SEFAZ (NfeConsultaProtocolo) e grava a autorização que já existe.
+
+    Sem autorização a nota continua na fila: duplicidade nunca vira rejeição.
+    """
+    chave = chave or nota.chave
+    cstat, motivo, protocolos = interpretar_retorno(_sefaz('consultar_protocolo')(chave, _ambiente(nota)))
+    if chave not in protocolos or protocolos[chave][0] not in CSTAT_AUTORIZADA:
+        raise FalhaTemporaria(f"Consulta da chave {chave}: {cstat} - {motivo}")
+    if chave != nota.chave:
+        logger.warning("NFC-e #%s autorizada com outra chave (%s): o XML guardado não é o autorizado", nota.numero, chave)
+        nota.chave = chave
+    registrar_retorno(nota, *protocolos[chave])
+
+
+def registrar_retorno(nota, cstat, motivo, protocolo, rejeicao_do_lote=False):
+    """Grava o retorno da SEFAZ para a nota.
+
+    Só a rejeição da própria nota (protNFe) garante que ela não foi autorizada: apenas
+    essas vão para NumeroInutilizado. Com `rejeicao_do_lote` a SEFAZ recusou o lote
+    sem olhar a nota, que pode ter sido autorizada num envio anterior.
+    """
+    if cstat in CSTAT_TEMPORARIO:
+        raise FalhaTemporaria(f"{cstat} - {motivo}")
+    if cstat in CSTAT_DUPLICIDADE:
+        chave = re.search(r'chNFe:\s*(\d{44})', motivo)
+        return buscar_autorizacao(nota, chave and chave.group(1))
+    nota.codigo_status = cstat
+    nota.motivo = motivo[:255]
+    nota.proxima_tentativa = None
+    nota.ultimo_erro = ''
+    nota.recibo = ''
+    if cstat in CSTAT_AUTORIZADA:
+        nota.status = NotaFiscal.Status.AUTORIZADA
+        nota.protocolo = protocolo
+        nota.autorizado_em = timezone.now()
+    else:
+        nota.status = NotaFiscal.Status.REJEITADA
+    nota.save(update_fields=[
+        'chave', 'codigo_status', 'motivo', 'proxima_tentativa', 'ultimo_erro', 'recibo', 'status', 'protocolo',
+        'autorizado_em',
+    ])
+    if nota.status == NotaFiscal.Status.REJEITADA and not rejeicao_do_lote and cstat not in CSTAT_NUMERO_USADO:
+        NumeroInutilizado.registrar(nota, f"Rejeitada: {cstat} - {motivo}")
+
+
+def transmitir_lote(notas):
+    """Envia notas assinadas do mesmo restaurante e ambiente num lote e grava o retorno de cada uma.
+
+    Notas com recibo (todas do mesmo lote) não são reenviadas: o recibo é consultado.
+    """
+    recibo = notas[0].recibo
+    try:
+        if recibo:
+            resposta = _sefaz('consultar_recibo')(recibo, _ambiente(notas[0]))
+        else:
+            xmls = [nota.xml.encode('utf-8') for nota in notas]
+            resposta = _sefaz('enviar_lote_para_sefaz')(xmls, _ambiente(notas[0]))
+    except LoteEmProcessamento as erro:
+        for nota in notas:
+            nota.recibo = erro.recibo
+        NotaFiscal.objects.filter(pk__in=[nota.pk for nota in notas]).update(recibo=erro.recibo)
+        registrar_resposta_sefaz(notas[0].ambiente)  # a SEFAZ respondeu, só não terminou o lote
+        raise
+    cstat_lote, motivo_lote, protocolos = interpretar_retorno(resposta)
+    if cstat_lote in CSTAT_TEMPORARIO:
+        raise FalhaTemporaria(f"{cstat_lote} - {motivo_lote}")
+    registrar_resposta_sefaz(notas[0].ambiente)
+    for nota in notas:
+        try:
+            if nota.chave in protocolos:
+                registrar_retorno(nota, *protocolos[nota.chave])
+            elif recibo:
+                # Recibo sem o protNFe (expirado, inexistente...): a situação sai da consulta pela chave
+                nota.recibo = ''
+                nota.save(update_fields=['recibo'])
+                buscar_autorizacao(nota)
+            elif cstat_lote in CSTAT_LOTE_PROCESSADO:
+                raise FalhaTemporaria(f"Lote {cstat_lote} sem protNFe para a chave {nota.chave}")
+            else:
+                registrar_retorno(nota, cstat_lote, motivo_lote, '', rejeicao_do_lote=True)
+        except FalhaTemporaria as erro:
+            agendar_nova_tentativa(nota, erro)
+
+
+def agendar_nova_tentativa(nota, erro):
+    nota.ultimo_erro = f"{type(erro).__name__}: {erro}"
+    if nota.tentativas >= _config('NFCE_MAX_TENTATIVAS', 8) and nota.status != NotaFiscal.Status.CONTINGENCIA:
+        nota.proxima_tentativa = None  # desiste; o admin pode reenviar (a de contingência já foi entregue ao cliente)
+    else:
+        atraso = _config('NFCE_RETRY_BASE_SEGUNDOS', 30) * 2 ** (nota.tentativas - 1)
+        nota.proxima_tentativa = timezone.now() + timedelta(seconds=min(atraso, 3600))
+    nota.save(update_fields=['ultimo_erro', 'proxima_tentativa'])
+
+
+def processar_lote(notas):
+    """Um passo da fila para notas de um restaurante: assina as pendentes e transmite em lotes"""
+    if not notas:
+        return notas
+    contingencia = em_contingencia(notas[0].ambiente)
+    numerar([nota for nota in notas if nota.status == NotaFiscal.Status.PENDENTE])
+    assinadas = []
+    for nota in notas:
+        nota.tentativas += 1
+        nota.save(update_fields=['tentativas'])
+        try:
+            if nota.status == NotaFiscal.Status.PENDENTE:
+                assinar_nota(nota, contingencia)
+            assinadas.append(nota)
+        except Exception as erro:
+            logger.warning("NFC-e #%s (tentativa %s): %s", nota.numero or nota.pk, nota.tentativas, erro)
+            agendar_nova_tentativa(nota, erro)
+    por_recibo = defaultdict(list)
+    for nota in assinadas:
+        por_recibo[nota.recibo].append(nota)
+    novas = por_recibo.pop('', [])
+    lotes = list(por_recibo.values())  # cada recibo é um lote já enviado
+    lotes += [novas[inicio:inicio + LOTE_MAXIMO] for inicio in range(0, len(novas), LOTE_MAXIMO)]
+    for lote in lotes:
+        try:
+            transmitir_lote(lote)
+        except Exception as erro:
+            logger.warning("Lote de %s NFC-e (restaurante %s): %s", len(lote), lote[0].restaurant_id, erro)
+            if isinstance(erro, FALHAS_DE_COMUNICACAO) and not isinstance(erro, LoteEmProcessamento):
+                registrar_falha_sefaz(lote[0].ambiente, erro)
+            for nota in lote:
+                agendar_nova_tentativa(nota, erro)
+    return notas
+
+
+def processar_lote_por_ids(nota_ids):
+    """Executado nas threads do worker: cada thread usa (e fecha) sua própria conexão"""
+    close_old_connections()
+    try:
+        notas = NotaFiscal.objects.select_related('restaurant', 'card_payment__card').filter(pk__in=nota_ids)
+        return processar_lote(list(notas.order_by('pk')))
+    finally:
+        close_old_connections()
+
+
+def agrupar_por_restaurante(nota_ids):
+    """Listas de ids por (restaurante, ambiente): cada lista vira lote(s) de um mesmo emitente.
+
+    Um grupo por restaurante também mantém cada sequência de numeração numa única thread.
+    """
+    grupos = defaultdict(list)
+    for pk, restaurante, ambiente in NotaFiscal.objects.filter(pk__in=nota_ids).values_list(
+        'pk', 'restaurant_id', 'ambiente'
+    ):
+        grupos[restaurante, ambiente].append(pk)
+    return list(grupos.values())
+
+
+def reservar_notas(limite):
+    """Reserva até `limite` notas vencidas empurrando a próxima tentativa (evita dois workers na mesma nota).
+
+    Só entram restaurantes cuja nota vencida mais antiga já esperou a janela do lote.
+    """
+    agora = timezone.now()
+    prazo = agora + timedelta(seconds=_config('NFCE_RESERVA_SEGUNDOS', 300))
+    na_fila = NotaFiscal.objects.filter(status__in=STATUS_NA_FILA)
+    prontos = na_fila.filter(
+        proxima_tentativa__lte=agora - timedelta(seconds=_config('NFCE_LOTE_JANELA_SEGUNDOS', 2))
+    ).values('restaurant_id')
+    candidatas = na_fila.filter(
+        proxima_tentativa__lte=agora, restaurant_id__in=prontos
+    ).order_by('proxima_tentativa').values_list('pk', 'proxima_tentativa')[:limite]
+    return [
+        pk for pk, quando in candidatas
+        if NotaFiscal.objects.filter(pk=pk, proxima_tentativa=quando).update(proxima_tentativa=prazo)
+    ]
@@ -0,0 +1,85 @@
+# fiscal/utils/exportacao.py
+"""Exportação das notas para a contabilidade: CSV e ZIP dos XMLs assinados.
+
+Os dois formatos são geradores: as notas vêm do banco em blocos (.iterator) e cada
+bloco é escrito e liberado antes do próximo, então um mês com dezenas de milhares
+de notas não fica inteiro na memória. Servem ao admin (StreamingHttpResponse) e ao
+comando `manage.py exportar_notas` (arquivos em disco).
+"""
+import csv
+import gzip
+import zipfile
+from datetime import datetime
+
+from django.utils import timezone
+
+from fiscal.models import NotaFiscal
+
+BLOCO = 2000  # notas por consulta no CSV
+BLOCO_XML = 200  # o XML pesa mais: blocos menores
+
+CABECALHO_CSV = ['Número', 'Série', 'CNPJ', 'Chave', 'Valor', 'Emitido em', 'Ambiente']
+
+
+class _Eco:
+    """Pseudo-arquivo do csv.writer: devolve a linha em vez de guardar"""
+
+    def write(self, valor):
+        return valor
+
+
+def linhas_csv(notas):
+    """Gera o CSV linha a linha (uma única consulta com join, sem N+1)"""
+    escritor = csv.writer(_Eco())
+    ambientes = dict(NotaFiscal.AmbienteChoices.choices)
+    yield escritor.writerow(CABECALHO_CSV)
+    linhas = notas.order_by('emitido_em', 'pk').values_list(
+        'numero', 'serie', 'restaurant__cnpj', 'chave', 'card_payment__amount', 'emitido_em', 'ambiente'
+    )
+    for numero, serie, cnpj, chave, valor, emitido_em, ambiente in linhas.iterator(chunk_size=BLOCO):
+        yield escritor.writerow([
+            numero, serie, cnpj, chave or '', valor,
+            timezone.localtime(emitido_em).strftime('%d/%m/%Y %H:%M'), ambientes.get(ambiente, ambiente),
+        ])
+
+
+class _Saida:
+    """Destino não posicionável do ZipFile: acumula os bytes até o gerador entregá-los"""
+
+    def __init__(self):
+        self.partes = []
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self.partes)
+        self.partes.clear()
+        return dados
+
+
+def partes_zip_xmls(notas):
+    """Gera o ZIP com um {chave}-nfe.xml por nota, entregue em pedaços conforme cada XML é escrito"""
+    saida = _Saida()
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo_zip:
+        xmls = notas.exclude(xml_gz=b'').order_by('emitido_em', 'pk').values_list('chave', 'xml_gz')
+        for chave, xml_gz in xmls.iterator(chunk_size=BLOCO_XML):
+            arquivo_zip.writestr(f"{chave}-nfe.xml", gzip.decompress(xml_gz))
+            yield saida.esvaziar()
+    yield saida.esvaziar()  # diretório central
+
+
+def notas_do_mes(ano, mes, restaurante_id=None):
+    """Notas autorizadas emitidas no mês (hora local)"""
+    inicio = timezone.make_aware(datetime(ano, mes, 1))
+    fim = timezone.make_aware(datetime(ano + mes // 12, mes % 12 + 1, 1))
+    notas = NotaFiscal.objects.filter(
+        status=NotaFiscal.Status.AUTORIZADA, emitido_em__gte=inicio, emitido_em__lt=fim
+    )
+    if restaurante_id:
+        notas = notas.filter(restaurant_id=restaurante_id)
+    return notas
@@ -0,0 +1,58 @@
+# fiscal/utils/qrcode_nfce.py
+"""QR Code da NFC-e (versão 2) e o grupo infNFeSupl da NFe assinada.
+
+Emissão normal: p=chave|2|tpAmb|cIdToken|hash. Contingência offline (tpEmis=9):
+p=chave|2|tpAmb|dia|vNF|DigestValue em hex|cIdToken|hash. O hash é o SHA-1 (hex,
+maiúsculo) dos campos anteriores concatenados ao CSC do restaurante.
+"""
+import hashlib
+
+from django.conf import settings
+from lxml import etree
+
+from fiscal.utils.xml_nfce import NS_NFE, TP_EMIS_CONTINGENCIA
+
+NS_DS = 'http://www.w3.org/2000/09/xmldsig#'
+
+# Consulta pública da SEFAZ-CE por tpAmb; sobrescreva com NFCE_URL_QRCODE / NFCE_URL_CHAVE
+URL_QRCODE = {
+    '1': 'http://nfce.sefaz.ce.gov.br/pages/ShowNFCe.html',
+    '2': 'http://nfceh.sefaz.ce.gov.br/pages/ShowNFCe.html',
+}
+URL_CHAVE = {
+    '1': 'http://nfce.sefaz.ce.gov.br/pages/consultaChaveAcesso.jsf',
+    '2': 'http://nfceh.sefaz.ce.gov.br/pages/consultaChaveAcesso.jsf',
+}
+
+
+def parametro_qrcode(chave, tp_amb, csc, csc_id, dia=None, valor=None, digest=None):
+    """Valor do parâmetro `p`; dia, valor e digest só entram na contingência offline"""
+    id_token = str(int(csc_id))
+    if chave[34] == TP_EMIS_CONTINGENCIA:
+        campos = [chave, '2', tp_amb, dia, valor, digest.encode().hex(), id_token]
+    else:
+        campos = [chave, '2', tp_amb, id_token]
+    base = '|'.join(campos)
+    return f"{base}|{hashlib.sha1((base + csc).encode()).hexdigest().upper()}"
+
+
+def adicionar_qrcode(raiz, csc, csc_id):
+    """Inclui infNFeSupl (entre infNFe e Signature) na NFe já assinada e devolve a URL do QR Code"""
+    if not csc or not csc_id:
+        raise ValueError("Restaurante sem CSC/ID do CSC: não é possível gerar o QR Code da NFC-e")
+    inf_nfe = raiz.find(f'{{{NS_NFE}}}infNFe')
+    ide = inf_nfe.find(f'{{{NS_NFE}}}ide')
+    tp_amb = ide.findtext(f'{{{NS_NFE}}}tpAmb')
+    parametro = parametro_qrcode(
+        inf_nfe.get('Id')[3:], tp_amb, csc, csc_id,
+        dia=ide.findtext(f'{{{NS_NFE}}}dhEmi')[8:10],
+        valor=inf_nfe.findtext(f'{{{NS_NFE}}}total/{{{NS_NFE}}}ICMSTot/{{{NS_NFE}}}vNF'),
+        digest=raiz.findtext(f'.//{{{NS_DS}}}DigestValue', '').strip(),
+    )
+    url = f"{getattr(settings, 'NFCE_URL_QRCODE', URL_QRCODE)[tp_amb]}?p={parametro}"
+
+    supl = etree.Element(f'{{{NS_NFE}}}infNFeSupl')
+    etree.SubElement(supl, f'{{{NS_NFE}}}qrCode').text = url
+    etree.SubElement(supl, f'{{{NS_NFE}}}urlChave').text = getattr(settings, 'NFCE_URL_CHAVE', URL_CHAVE)[tp_amb]
+    inf_nfe.addnext(supl)
+    return url
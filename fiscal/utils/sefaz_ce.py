@@ -1,34 +1,133 @@
 # fiscal/utils/sefaz_ce.py
-import os
-import xmlsec
+"""Webservices de NFC-e da SEFAZ-CE (NFeAutorizacao4, NFeRetAutorizacao4 e NFeConsultaProtocolo4) via zeep.
+
+Os clientes SOAP são criados uma vez por processo e WSDL: a sessão HTTP é reaproveitada
+e o WSDL fica em cache no disco (NFCE_WSDL_CACHE, 1 dia), sem novo download a cada nota.
+"""
+import threading
+import time
+
+import requests
 import zeep
+from django.conf import settings
 from lxml import etree
+from zeep.cache import SqliteCache
+from zeep.transports import Transport
+
+from fiscal.utils.assinatura import assinar_nfe
+from fiscal.utils.certificados import carregar_certificado
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+
+LOTE_MAXIMO = 50  # NF-e por lote aceitas pelo NfeAutorizacao
+CSTAT_LOTE_RECEBIDO = '103'
+CSTAT_LOTE_EM_PROCESSAMENTO = '105'
+
+# Sobrescreva com NFCE_WSDL_BASE (ex.: a SEFAZ local de `manage.py sefaz_local`)
+WSDL_BASE = {
+    'homologacao': 'https://nfceh.sefaz.ce.gov.br/nfce4/services',
+    'producao': 'https://nfce.sefaz.ce.gov.br/nfce4/services',
+}
+
+_clientes = {}
+_lock = threading.Lock()
+
+
+class LoteEmProcessamento(TimeoutError):
+    """A SEFAZ recebeu o lote mas ainda não o processou: consulte o `recibo` depois, sem reenviar"""
+
+    def __init__(self, recibo):
+        super().__init__(f"Lote {recibo} ainda em processamento na SEFAZ")
+        self.recibo = recibo
+
+
+def assinar_xml(xml, cert_pfx_path, cert_password):
+    """Assina a NFe (bytes ou elemento lxml) em memória e devolve bytes; ver assinatura.assinar_nfe"""
+    return assinar_nfe(xml, carregar_certificado(cert_pfx_path, cert_password))
+
 
-def assinar_xml(xml_path, cert_pfx_path, cert_password):
-    # Carregar XML
-    xml = etree.parse(xml_path)
-    # Localizar nó da assinatura
-    signature_node = xmlsec.template.create(
-        xml, xmlsec.Transform.EXCL_C14N, xmlsec.Transform.RSA_SHA1
+def montar_lote(xmls_assinados, id_lote, sincrono=True):
+    """Envelope enviNFe com as NFe já assinadas (indSinc=1 só vale para lote de uma nota)"""
+    lote = (
+        f'<enviNFe xmlns="{NS_NFE}" versao="4.00"><idLote>{id_lote}</idLote>'
+        f'<indSinc>{1 if sincrono else 0}</indSinc>'
+    ).encode()
+    return lote + b''.join(xmls_assinados) + b'</enviNFe>'
+
+
+def cliente_soap(servico, ambiente):
+    """zeep.Client do serviço, criado na primeira chamada e reaproveitado pelas threads do worker"""
+    wsdl = f"{getattr(settings, 'NFCE_WSDL_BASE', WSDL_BASE)[ambiente]}/{servico}?wsdl"
+    with _lock:
+        cliente = _clientes.get(wsdl)
+        if cliente is None:
+            transporte = Transport(
+                session=requests.Session(),
+                cache=SqliteCache(path=getattr(settings, 'NFCE_WSDL_CACHE', None), timeout=86400),
+                timeout=30,
+                operation_timeout=getattr(settings, 'NFCE_TIMEOUT_SEGUNDOS', 30),
+            )
+            cliente = _clientes[wsdl] = zeep.Client(wsdl=wsdl, transport=transporte)
+    return cliente
+
+
+def _chamar(servico, operacao, mensagem, ambiente):
+    resultado = getattr(cliente_soap(servico, ambiente).service, operacao)(etree.fromstring(mensagem))
+    if isinstance(resultado, etree._Element):
+        return resultado
+    # nfeResultMsg é conteúdo misto: o retorno vem em _value_1 (às vezes entre textos em branco)
+    conteudo = resultado['_value_1'] if not isinstance(resultado, list) else resultado
+    if isinstance(conteudo, list):
+        conteudo = next(item for item in conteudo if isinstance(item, etree._Element))
+    return conteudo
+
+
+def consultar_recibo(recibo, ambiente, tentativas=None, espera=None):
+    """retConsReciNFe do lote assíncrono, consultado até sair de "em processamento" (105).
+
+    Se continuar em processamento levanta LoteEmProcessamento: a fila guarda o recibo e
+    volta a consultá-lo na próxima tentativa.
+    """
+    tentativas = tentativas or getattr(settings, 'NFCE_RECIBO_CONSULTAS', 10)
+    espera = getattr(settings, 'NFCE_RECIBO_ESPERA_SEGUNDOS', 1.0) if espera is None else espera
+    tp_amb = '2' if ambiente == 'homologacao' else '1'
+    consulta = (
+        f'<consReciNFe xmlns="{NS_NFE}" versao="4.00"><tpAmb>{tp_amb}</tpAmb><nRec>{recibo}</nRec></consReciNFe>'
+    )
+    for _ in range(tentativas):
+        time.sleep(espera)
+        retorno = _chamar('NFeRetAutorizacao4', 'nfeRetAutorizacaoLote', consulta, ambiente)
+        if retorno.findtext(f'{{{NS_NFE}}}cStat') != CSTAT_LOTE_EM_PROCESSAMENTO:
+            return etree.tostring(retorno)
+    raise LoteEmProcessamento(recibo)
+
+
+def consultar_protocolo(chave, ambiente):
+    """retConsSitNFe da chave (NfeConsultaProtocolo): traz o protNFe se a nota já foi autorizada"""
+    tp_amb = '2' if ambiente == 'homologacao' else '1'
+    consulta = (
+        f'<consSitNFe xmlns="{NS_NFE}" versao="4.00"><tpAmb>{tp_amb}</tpAmb>'
+        f'<xServ>CONSULTAR</xServ><chNFe>{chave}</chNFe></consSitNFe>'
     )
-    xml.getroot().insert(0, signature_node)
+    return etree.tostring(_chamar('NFeConsultaProtocolo4', 'nfeConsultaNF', consulta, ambiente))
+
+
+def enviar_lote_para_sefaz(xmls_assinados, ambiente='homologacao'):
+    """Transmite até LOTE_MAXIMO NFe assinadas num único lote e devolve o retorno com um protNFe por nota.
 
-    # Carregar chave
-    manager = xmlsec.KeysManager()
-    manager.load_pkcs12(cert_pfx_path, cert_password)
+    Lote de uma nota vai síncrono (retEnviNFe); lotes maiores vão assíncronos e o recibo
+    é consultado até o processamento terminar (retConsReciNFe).
+    """
+    if not 0 < len(xmls_assinados) <= LOTE_MAXIMO:
+        raise ValueError(f"Lote deve ter de 1 a {LOTE_MAXIMO} notas ({len(xmls_assinados)})")
+    sincrono = len(xmls_assinados) == 1
+    lote = montar_lote(xmls_assinados, id_lote=time.time_ns() // 1000 % 10 ** 15, sincrono=sincrono)
+    retorno = _chamar('NFeAutorizacao4', 'nfeAutorizacaoLote', lote, ambiente)
+    if sincrono or retorno.findtext(f'{{{NS_NFE}}}cStat') != CSTAT_LOTE_RECEBIDO:
+        return etree.tostring(retorno)
+    return consultar_recibo(retorno.findtext(f'.//{{{NS_NFE}}}nRec'), ambiente)
 
-    # Assinar
-    ctx = xmlsec.SignatureContext(manager)
-    ctx.sign(signature_node)
-    return etree.tostring(xml)
 
 def enviar_xml_para_sefaz(xml_assinado, ambiente='homologacao'):
-    # Carregar o WSDL da SEFAZ-CE
-    if ambiente == 'homologacao':
-        wsdl = 'https://nfce.sefaz.ce.gov.br/nfce/services/NfeAutorizacao?wsdl'
-    else:
-        wsdl = 'https://nfce.sefaz.ce.gov.br/nfce/services/NfeAutorizacao?wsdl'
-
-    client = zeep.Client(wsdl=wsdl)
-    result = client.service.nfeAutorizacaoLote(xml_assinado)
-    return result
+    """Transmite uma NFe assinada e devolve o XML de retorno (retEnviNFe) em bytes"""
+    return enviar_lote_para_sefaz([xml_assinado], ambiente)
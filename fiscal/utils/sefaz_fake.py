@@ -0,0 +1,138 @@
+# fiscal/utils/sefaz_fake.py
+"""SEFAZ falsa para desenvolvimento e testes, sem rede nem certificado do governo.
+
+Ative com NFCE_TRANSMISSOR = 'fiscal.utils.sefaz_fake.enviar_lote_para_sefaz'.
+Cada lote enviado consome um cenário de `roteiro` (padrão: autorizar):
+
+    'autorizar'    -> cStat 100 com protocolo para cada nota
+    'rejeitar'     -> cStat 225 (rejeição definitiva) para cada nota
+    'paralisado'   -> cStat 108 no lote (a fila tenta de novo)
+    'suspenso'     -> cStat 109 no lote (paralisado sem previsão; a fila tenta de novo)
+    'indisponivel' -> ConnectionError (falha de rede, a fila tenta de novo)
+    'processando'  -> autoriza, mas o recibo fica "em processamento" (LoteEmProcessamento);
+                      o resultado sai em consultar_recibo
+
+Como a SEFAZ, responde 204 (duplicidade) a uma chave já autorizada e 539 ao mesmo
+número com outra chave; consultar_protocolo devolve a autorização de cada chave.
+`reiniciar()` esquece tudo (testes).
+
+Para exercitar o cliente SOAP de verdade, veja fiscal/utils/sefaz_local.py.
+"""
+import itertools
+import threading
+from collections import deque
+
+from django.utils import timezone
+from lxml import etree
+
+from fiscal.utils.sefaz_ce import LoteEmProcessamento
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+
+RESPOSTAS = {
+    'autorizar': ('100', 'Autorizado o uso da NF-e'),
+    'rejeitar': ('225', 'Rejeição: Falha no Schema XML da NFe'),
+}
+RESPOSTAS_DO_LOTE = {
+    'paralisado': ('108', 'Serviço Paralisado Momentaneamente (curto prazo)'),
+    'suspenso': ('109', 'Serviço Paralisado sem Previsão'),
+}
+
+roteiro = deque()
+recebidos = []  # um item (lista de XMLs) por lote
+autorizadas = {}  # chave -> nProt
+recibos = {}  # nRec -> retConsReciNFe dos lotes 'processando'
+_protocolos = itertools.count(1)
+_recibos = itertools.count(1)
+_lock = threading.Lock()
+
+
+def reiniciar():
+    with _lock:
+        for estado in (roteiro, recebidos, autorizadas, recibos):
+            estado.clear()
+
+
+def _numero_da_chave(chave):
+    return chave[6:34]  # CNPJ, modelo, série e número (sem UF, AAMM, tpEmis e cNF)
+
+
+def _ret_envi_nfe(tp_amb, cstat_lote, motivo_lote, protocolos=(), raiz='retEnviNFe'):
+    partes = [
+        f'<{raiz} xmlns="{NS_NFE}" versao="4.00"><tpAmb>{tp_amb}</tpAmb><verAplic>FAKE</verAplic>'
+        f'<cStat>{cstat_lote}</cStat><xMotivo>{motivo_lote}</xMotivo><cUF>23</cUF>'
+        f'<dhRecbto>{timezone.now().isoformat(timespec="seconds")}</dhRecbto>'
+    ]
+    for chave, cstat, motivo, numero in protocolos:
+        partes.append(
+            f'<protNFe versao="4.00"><infProt><tpAmb>{tp_amb}</tpAmb><verAplic>FAKE</verAplic>'
+            f'<chNFe>{chave}</chNFe><dhRecbto>{timezone.now().isoformat(timespec="seconds")}</dhRecbto>'
+            f'<nProt>{numero}</nProt><cStat>{cstat}</cStat><xMotivo>{motivo}</xMotivo></infProt></protNFe>'
+        )
+    partes.append(f'</{raiz}>')
+    return ''.join(partes).encode()
+
+
+def _decidir(chave, cenario):
+    """(cStat, xMotivo, nProt) da nota; chamado com _lock"""
+    if chave in autorizadas:
+        return '204', f'Rejeição: Duplicidade de NF-e [nProt:{autorizadas[chave]}]', ''
+    outra = next((c for c in autorizadas if _numero_da_chave(c) == _numero_da_chave(chave)), None)
+    if outra:
+        return '539', f'Rejeição: Duplicidade de NF-e com diferença na Chave de Acesso [chNFe:{outra}]', ''
+    cstat, motivo = RESPOSTAS['autorizar' if cenario == 'processando' else cenario]
+    if cstat != '100':
+        return cstat, motivo, ''
+    autorizadas[chave] = f"3{next(_protocolos):014d}"
+    return cstat, motivo, autorizadas[chave]
+
+
+def enviar_lote_para_sefaz(xmls_assinados, ambiente='homologacao'):
+    with _lock:
+        recebidos.append(list(xmls_assinados))
+        cenario = roteiro.popleft() if roteiro else 'autorizar'
+    tp_amb = '2' if ambiente == 'homologacao' else '1'
+
+    if cenario == 'indisponivel':
+        raise ConnectionError("SEFAZ falsa indisponível")
+    if cenario in RESPOSTAS_DO_LOTE:
+        return _ret_envi_nfe(tp_amb, *RESPOSTAS_DO_LOTE[cenario])
+
+    protocolos = []
+    with _lock:
+        for xml_assinado in xmls_assinados:
+            for inf_nfe in etree.fromstring(xml_assinado).iter(f'{{{NS_NFE}}}infNFe'):
+                chave = inf_nfe.get('Id')[3:]
+                protocolos.append((chave, *_decidir(chave, cenario)))
+        if cenario == 'processando':
+            recibo = f"23{next(_recibos):013d}"
+            recibos[recibo] = _ret_envi_nfe(tp_amb, '104', 'Lote processado', protocolos, raiz='retConsReciNFe')
+            raise LoteEmProcessamento(recibo)
+    return _ret_envi_nfe(tp_amb, '104', 'Lote processado', protocolos)
+
+
+def consultar_recibo(recibo, ambiente='homologacao'):
+    tp_amb = '2' if ambiente == 'homologacao' else '1'
+    with _lock:
+        retorno = recibos.get(recibo)
+    return retorno or _ret_envi_nfe(
+        tp_amb, '656', 'Rejeição: Recibo inexistente', raiz='retConsReciNFe'
+    )
+
+
+def consultar_protocolo(chave, ambiente='homologacao'):
+    tp_amb = '2' if ambiente == 'homologacao' else '1'
+    with _lock:
+        protocolo = autorizadas.get(chave)
+    if not protocolo:
+        return _ret_envi_nfe(
+            tp_amb, '217', 'Rejeição: NF-e não consta na base de dados da SEFAZ', raiz='retConsSitNFe'
+        )
+    return _ret_envi_nfe(
+        tp_amb, '100', 'Autorizado o uso da NF-e', [(chave, '100', 'Autorizado o uso da NF-e', protocolo)],
+        raiz='retConsSitNFe',
+    )
+
+
+def enviar_xml_para_sefaz(xml_assinado, ambiente='homologacao'):
+    return enviar_lote_para_sefaz([xml_assinado], ambiente)
@@ -0,0 +1,173 @@
+# fiscal/utils/sefaz_local.py
+"""SEFAZ local: servidor SOAP 1.2 que imita NFeAutorizacao4, NFeRetAutorizacao4 e NFeConsultaProtocolo4.
+
+Serve os WSDLs e responde com as decisões de sefaz_fake (inclusive o `roteiro`), para
+exercitar o caminho real de sefaz_ce (zeep, lote assíncrono, consulta do recibo) sem
+rede. Suba com `manage.py sefaz_local` e aponte NFCE_WSDL_BASE para
+{'homologacao': 'http://127.0.0.1:8765/services', 'producao': ...}; ou, em código,
+`servidor = iniciar(porta=0)` e `servidor.url_base`.
+"""
+import itertools
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from lxml import etree
+
+from fiscal.utils import sefaz_fake
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+NS_SOAP12 = 'http://www.w3.org/2003/05/soap-envelope'
+NS_WSDL = 'http://www.portalfiscal.inf.br/nfe/wsdl'
+
+SERVICOS = {
+    'NFeAutorizacao4': 'nfeAutorizacaoLote',
+    'NFeRetAutorizacao4': 'nfeRetAutorizacaoLote',
+    'NFeConsultaProtocolo4': 'nfeConsultaNF',
+}
+
+WSDL = """<?xml version="1.0" encoding="utf-8"?>
+<wsdl:definitions xmlns:wsdl="http://schemas.xmlsoap.org/wsdl/" xmlns:soap12="http://schemas.xmlsoap.org/wsdl/soap12/"
+    xmlns:s="http://www.w3.org/2001/XMLSchema" xmlns:tns="{ns}" targetNamespace="{ns}">
+  <wsdl:types>
+    <s:schema elementFormDefault="qualified" targetNamespace="{ns}">
+      <s:element name="nfeDadosMsg"><s:complexType mixed="true"><s:sequence><s:any/></s:sequence></s:complexType></s:element>
+      <s:element name="nfeResultMsg"><s:complexType mixed="true"><s:sequence><s:any/></s:sequence></s:complexType></s:element>
+    </s:schema>
+  </wsdl:types>
+  <wsdl:message name="entrada"><wsdl:part name="nfeDadosMsg" element="tns:nfeDadosMsg"/></wsdl:message>
+  <wsdl:message name="saida"><wsdl:part name="nfeResultMsg" element="tns:nfeResultMsg"/></wsdl:message>
+  <wsdl:portType name="{servico}Soap12">
+    <wsdl:operation name="{operacao}"><wsdl:input message="tns:entrada"/><wsdl:output message="tns:saida"/></wsdl:operation>
+  </wsdl:portType>
+  <wsdl:binding name="{servico}Soap12" type="tns:{servico}Soap12">
+    <soap12:binding transport="http://schemas.xmlsoap.org/soap/http"/>
+    <wsdl:operation name="{operacao}">
+      <soap12:operation soapAction="{ns}/{operacao}" style="document"/>
+      <wsdl:input><soap12:body use="literal"/></wsdl:input>
+      <wsdl:output><soap12:body use="literal"/></wsdl:output>
+    </wsdl:operation>
+  </wsdl:binding>
+  <wsdl:service name="{servico}">
+    <wsdl:port name="{servico}Soap12" binding="tns:{servico}Soap12"><soap12:address location="{url}"/></wsdl:port>
+  </wsdl:service>
+</wsdl:definitions>
+"""
+
+
+class SefazLocal(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, endereco, consultas_em_processamento=1):
+        super().__init__(endereco, ManipuladorSefaz)
+        self.consultas_em_processamento = consultas_em_processamento  # respostas 105 antes do resultado
+        self.lotes = {}  # nRec -> [retorno, consultas restantes em processamento]
+        self.recibos = itertools.count(1)
+        self.chamadas = []  # (serviço, indSinc, quantidade de NFe) por requisição
+        self.lock = threading.Lock()
+
+    @property
+    def url_base(self):
+        host, porta = self.server_address[:2]
+        return f"http://{host}:{porta}/services"
+
+    def autorizar(self, envi_nfe, tp_amb):
+        xmls = [etree.tostring(nfe) for nfe in envi_nfe.iterfind(f'{{{NS_NFE}}}NFe')]
+        sincrono = envi_nfe.findtext(f'{{{NS_NFE}}}indSinc') == '1'
+        with self.lock:
+            self.chamadas.append(('NFeAutorizacao4', sincrono, len(xmls)))
+        ambiente = 'homologacao' if tp_amb == '2' else 'producao'
+        if sincrono and len(xmls) > 1:
+            return sefaz_fake._ret_envi_nfe(tp_amb, '452', 'Rejeição: Solicitada resposta síncrona para Lote com mais de uma NF-e')
+        retorno = sefaz_fake.enviar_lote_para_sefaz(xmls, ambiente)  # ConnectionError vira HTTP 503
+        if sincrono:
+            return retorno
+        recibo = f"23{next(self.recibos):013d}"
+        with self.lock:
+            self.lotes[recibo] = [etree.fromstring(retorno), self.consultas_em_processamento]
+        return (
+            f'<retEnviNFe xmlns="{NS_NFE}" versao="4.00"><tpAmb>{tp_amb}</tpAmb><verAplic>LOCAL</verAplic>'
+            f'<cStat>103</cStat><xMotivo>Lote recebido com sucesso</xMotivo><cUF>23</cUF>'
+            f'<infRec><nRec>{recibo}</nRec><tMed>1</tMed></infRec></retEnviNFe>'
+        ).encode()
+
+    def consultar(self, cons_reci, tp_amb):
+        recibo = cons_reci.findtext(f'{{{NS_NFE}}}nRec')
+        with self.lock:
+            self.chamadas.append(('NFeRetAutorizacao4', None, 0))
+            lote = self.lotes.get(recibo)
+            if lote and lote[1] > 0:
+                lote[1] -= 1
+                cstat, motivo, protocolos = '105', 'Lote em processamento', []
+            elif lote:
+                retorno = lote[0]
+                cstat, motivo = retorno.findtext(f'{{{NS_NFE}}}cStat'), retorno.findtext(f'{{{NS_NFE}}}xMotivo')
+                protocolos = retorno.findall(f'{{{NS_NFE}}}protNFe')
+            else:
+                cstat, motivo, protocolos = '656', 'Rejeição: Recibo inexistente', []
+        consulta = etree.fromstring(
+            f'<retConsReciNFe xmlns="{NS_NFE}" versao="4.00"><tpAmb>{tp_amb}</tpAmb><verAplic>LOCAL</verAplic>'
+            f'<nRec>{recibo}</nRec><cStat>{cstat}</cStat><xMotivo>{motivo}</xMotivo><cUF>23</cUF></retConsReciNFe>'
+        )
+        consulta.extend(protocolos)
+        return etree.tostring(consulta)
+
+    def consultar_protocolo(self, cons_sit, tp_amb):
+        with self.lock:
+            self.chamadas.append(('NFeConsultaProtocolo4', None, 0))
+        ambiente = 'homologacao' if tp_amb == '2' else 'producao'
+        return sefaz_fake.consultar_protocolo(cons_sit.findtext(f'{{{NS_NFE}}}chNFe'), ambiente)
+
+
+class ManipuladorSefaz(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive, como a SEFAZ
+
+    def log_message(self, *args):
+        pass
+
+    def _servico(self):
+        servico = self.path.split('?')[0].rstrip('/').rsplit('/', 1)[-1]
+        return servico if servico in SERVICOS else None
+
+    def _responder(self, status, corpo, tipo):
+        self.send_response(status)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+    def do_GET(self):
+        servico = self._servico()
+        if not servico or 'wsdl' not in self.path.lower():
+            return self._responder(404, b'', 'text/plain')
+        wsdl = WSDL.format(
+            ns=f"{NS_WSDL}/{servico}", servico=servico, operacao=SERVICOS[servico],
+            url=f"{self.server.url_base}/{servico}",
+        )
+        self._responder(200, wsdl.encode(), 'text/xml; charset=utf-8')
+
+    def do_POST(self):
+        servico = self._servico()
+        envelope = etree.fromstring(self.rfile.read(int(self.headers['Content-Length'])))
+        mensagem = envelope.find(f'{{{NS_SOAP12}}}Body/{{{NS_WSDL}/{servico}}}nfeDadosMsg')[0]
+        tp_amb = mensagem.findtext(f'.//{{{NS_NFE}}}tpAmb', '2')
+        try:
+            if servico == 'NFeAutorizacao4':
+                retorno = self.server.autorizar(mensagem, tp_amb)
+            elif servico == 'NFeConsultaProtocolo4':
+                retorno = self.server.consultar_protocolo(mensagem, tp_amb)
+            else:
+                retorno = self.server.consultar(mensagem, tp_amb)
+        except ConnectionError:
+            return self._responder(503, b'SEFAZ local indisponivel', 'text/plain')
+        corpo = (
+            f'<soap12:Envelope xmlns:soap12="{NS_SOAP12}"><soap12:Body>'
+            f'<nfeResultMsg xmlns="{NS_WSDL}/{servico}">'
+        ).encode() + retorno + b'</nfeResultMsg></soap12:Body></soap12:Envelope>'
+        self._responder(200, corpo, 'application/soap+xml; charset=utf-8')
+
+
+def iniciar(host='127.0.0.1', porta=8765, **opcoes):
+    """Sobe a SEFAZ local numa thread e devolve o servidor (porta=0 escolhe uma porta livre)"""
+    servidor = SefazLocal((host, porta), **opcoes)
+    threading.Thread(target=servidor.serve_forever, daemon=True, name='sefaz-local').start()
+    return servidor
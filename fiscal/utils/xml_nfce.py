@@ -0,0 +1,145 @@
+# fiscal/utils/xml_nfce.py
+"""Montagem do XML (layout 4.00) da NFC-e de um CardPayment, ainda sem assinatura."""
+import secrets
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+from lxml import etree
+
+NS_NFE = 'http://www.portalfiscal.inf.br/nfe'
+VERSAO = '4.00'
+
+CODIGOS_UF = {
+    'RO': '11', 'AC': '12', 'AM': '13', 'RR': '14', 'PA': '15', 'AP': '16', 'TO': '17',
+    'MA': '21', 'PI': '22', 'CE': '23', 'RN': '24', 'PB': '25', 'PE': '26', 'AL': '27',
+    'SE': '28', 'BA': '29', 'MG': '31', 'ES': '32', 'RJ': '33', 'SP': '35', 'PR': '41',
+    'SC': '42', 'RS': '43', 'MS': '50', 'MT': '51', 'GO': '52', 'DF': '53',
+}
+
+# CardPayment.PaymentMethod -> tPag
+FORMAS_PAGAMENTO = {'CA': '01', 'CR': '03', 'DE': '04', 'PX': '17', 'OT': '99'}
+
+TP_EMIS_NORMAL = '1'
+TP_EMIS_CONTINGENCIA = '9'  # NFC-e offline: assinada no caixa, transmitida depois
+
+
+def _digito_verificador(chave43):
+    """Módulo 11 com pesos 2..9 da direita para a esquerda"""
+    soma = sum(int(digito) * (2 + i % 8) for i, digito in enumerate(reversed(chave43)))
+    resto = soma % 11
+    return '0' if resto < 2 else str(11 - resto)
+
+
+def calcular_chave(cuf, emissao, cnpj, serie, numero, tp_emis, codigo_numerico):
+    chave43 = (
+        f"{cuf}{emissao:%y%m}{cnpj:0>14}65{serie:03d}{numero:09d}{tp_emis}{codigo_numerico:08d}"
+    )
+    return chave43 + _digito_verificador(chave43)
+
+
+def _valor(valor, casas=2):
+    return f"{Decimal(valor or 0):.{casas}f}"
+
+
+def _sub(pai, tag, texto=None):
+    elemento = etree.SubElement(pai, f"{{{NS_NFE}}}{tag}")
+    if texto is not None:
+        elemento.text = str(texto)
+    return elemento
+
+
+def montar_arvore_nfce(nota, tp_emis=TP_EMIS_NORMAL, contingencia_desde=None, justificativa=''):
+    """Define a chave da nota (se ainda não tiver) e devolve o elemento NFe (lxml), para assinar em memória.
+
+    Em contingência (tp_emis='9') informe quando ela começou e a justificativa (dhCont/xJust).
+    """
+    pagamento = nota.card_payment
+    restaurante = nota.restaurant
+    emissao = timezone.localtime(pagamento.paid_at)
+    cuf = CODIGOS_UF.get(restaurante.state.upper(), '23')
+    if not nota.chave:
+        nota.chave = calcular_chave(
+            cuf, emissao, restaurante.cnpj, nota.serie, nota.numero, tp_emis, secrets.randbelow(99999999) + 1
+        )
+    chave = nota.chave
+    codigo_municipio = getattr(settings, 'NFCE_CODIGO_MUNICIPIO', '2304400')
+
+    raiz = etree.Element(f"{{{NS_NFE}}}NFe", nsmap={None: NS_NFE})
+    inf = _sub(raiz, 'infNFe')
+    inf.set('versao', VERSAO)
+    inf.set('Id', f"NFe{chave}")
+
+    ide = _sub(inf, 'ide')
+    for tag, texto in (
+        ('cUF', cuf), ('cNF', chave[35:43]), ('natOp', 'VENDA'), ('mod', '65'),
+        ('serie', nota.serie), ('nNF', nota.numero), ('dhEmi', emissao.isoformat(timespec='seconds')),
+        ('tpNF', '1'), ('idDest', '1'), ('cMunFG', codigo_municipio), ('tpImp', '4'),
+        ('tpEmis', chave[34]), ('cDV', chave[43]), ('tpAmb', nota.ambiente), ('finNFe', '1'),
+        ('indFinal', '1'), ('indPres', '1'), ('procEmi', '0'), ('verProc', 'restaurants 1.0'),
+    ):
+        _sub(ide, tag, texto)
+    if chave[34] == TP_EMIS_CONTINGENCIA:
+        _sub(ide, 'dhCont', timezone.localtime(contingencia_desde or timezone.now()).isoformat(timespec='seconds'))
+        _sub(ide, 'xJust', (justificativa or 'SEFAZ indisponivel para autorizacao da NFC-e')[:256])
+
+    emit = _sub(inf, 'emit')
+    _sub(emit, 'CNPJ', restaurante.cnpj)
+    _sub(emit, 'xNome', restaurante.name[:60])
+    endereco = _sub(emit, 'enderEmit')
+    for tag, texto in (
+        ('xLgr', restaurante.street), ('nro', restaurante.number or 'S/N'), ('xBairro', restaurante.neighborhood),
+        ('cMun', codigo_municipio), ('xMun', restaurante.city), ('UF', restaurante.state.upper()),
+        ('CEP', restaurante.zip_code.replace('-', '')),
+    ):
+        _sub(endereco, tag, texto)
+    _sub(emit, 'IE', restaurante.state_registration)
+    _sub(emit, 'CRT', restaurante.tax_regime or '1')
+
+    itens = pagamento.card.card_items.select_related('menu_item')
+    total_produtos = Decimal('0')
+    for numero_item, item in enumerate(itens, start=1):
+        preco = item.price or item.menu_item.price
+        subtotal = item.subtotal()
+        total_produtos += Decimal(_valor(subtotal))
+        det = _sub(inf, 'det')
+        det.set('nItem', str(numero_item))
+        prod = _sub(det, 'prod')
+        for tag, texto in (
+            ('cProd', item.menu_item_id), ('cEAN', 'SEM GTIN'), ('xProd', item.menu_item.name[:120]),
+            ('NCM', getattr(settings, 'NFCE_NCM_PADRAO', '21069090')), ('CFOP', '5102'), ('uCom', 'UN'),
+            ('qCom', _valor(item.quantity, 4)), ('vUnCom', _valor(preco, 10)), ('vProd', _valor(subtotal)),
+            ('cEANTrib', 'SEM GTIN'), ('uTrib', 'UN'), ('qTrib', _valor(item.quantity, 4)),
+            ('vUnTrib', _valor(preco, 10)), ('indTot', '1'),
+        ):
+            _sub(prod, tag, texto)
+        imposto = _sub(det, 'imposto')
+        icms = _sub(_sub(imposto, 'ICMS'), 'ICMSSN102')
+        _sub(icms, 'orig', '0')
+        _sub(icms, 'CSOSN', '102')
+        _sub(_sub(_sub(imposto, 'PIS'), 'PISNT'), 'CST', '07')
+        _sub(_sub(_sub(imposto, 'COFINS'), 'COFINSNT'), 'CST', '07')
+
+    icms_tot = _sub(_sub(inf, 'total'), 'ICMSTot')
+    for tag in ('vBC', 'vICMS', 'vICMSDeson', 'vFCP', 'vBCST', 'vST', 'vFCPST', 'vFCPSTRet'):
+        _sub(icms_tot, tag, '0.00')
+    _sub(icms_tot, 'vProd', _valor(total_produtos))
+    for tag in ('vFrete', 'vSeg', 'vDesc', 'vII', 'vIPI', 'vIPIDevol', 'vPIS', 'vCOFINS', 'vOutro'):
+        _sub(icms_tot, tag, '0.00')
+    _sub(icms_tot, 'vNF', _valor(total_produtos))
+
+    _sub(_sub(inf, 'transp'), 'modFrete', '9')
+
+    pag = _sub(inf, 'pag')
+    det_pag = _sub(pag, 'detPag')
+    _sub(det_pag, 'tPag', FORMAS_PAGAMENTO.get(pagamento.payment_method, '99'))
+    _sub(det_pag, 'vPag', _valor(pagamento.paid_amount or pagamento.amount))
+    if pagamento.change_amount:
+        _sub(pag, 'vTroco', _valor(pagamento.change_amount))
+
+    return raiz
+
+
+def montar_xml_nfce(nota, tp_emis=TP_EMIS_NORMAL, **contingencia):
+    """Como montar_arvore_nfce, serializado em bytes"""
+    return etree.tostring(montar_arvore_nfce(nota, tp_emis, **contingencia), encoding='utf-8', xml_declaration=False)
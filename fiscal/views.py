@@ -1,8 +1,13 @@
-from django.shortcuts import render
-from django.http import JsonResponse
+from django.shortcuts import render, get_object_or_404, redirect
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
+from django.urls import reverse
 from .utils.nfce import emitir_nfce
 from restaurants.models import CardPayment
-from .utils.emissao import emitir_nfce_cardpayment
+from .models import NotaFiscal
+from .utils import emissao
 
 
 def emitir_nfce_view(request):
@@ -21,17 +26,35 @@ def emitir_nfce_view(request):
 
 # fiscal/views.py
 
+@staff_member_required
 def emitir_nfce(request, pk):
-    pagamento = CardPayment.objects.get(pk=pk)
-    restaurante = pagamento.restaurant
-
-    cert_path = restaurante.certificate_file.path
-    senha = restaurante.certificate_password
-    ambiente = 2 if restaurante.emit_nfce else 1  # ou deixe sempre 2 para homologação
-
-    resposta = emitir_nfce_cardpayment(pagamento, cert_path, senha, ambiente)
-
-    return JsonResponse(resposta.dict())
-
-
-
+    """Só enfileira a nota e volta para o admin; o worker processar_nfce assina e transmite.
+
+    Com a SEFAZ em contingência a nota já é assinada offline aqui, para o cupom sair na hora.
+    """
+    pagamentos = CardPayment.objects.select_related('restaurant')
+    if not request.user.is_superuser:
+        pagamentos = pagamentos.filter(restaurant__owner=request.user)
+    pagamento = get_object_or_404(pagamentos, pk=pk)
+
+    nota = emissao.emitir(pagamento)
+    messages.info(request, f"NFC-e do pagamento #{pagamento.pk} na fila de emissão ({nota.get_status_display()}).")
+    return redirect(request.META.get('HTTP_REFERER') or reverse('admin:restaurants_cardpayment_changelist'))
+
+
+@staff_member_required
+def baixar_xml(request, pk):
+    """XML assinado da nota; vai em gzip direto do banco quando o navegador aceita (sem descomprimir)"""
+    notas = NotaFiscal.objects.only('chave', 'xml_gz')
+    if not request.user.is_superuser:
+        notas = notas.filter(restaurant__owner=request.user)
+    nota = get_object_or_404(notas.exclude(xml_gz=b''), pk=pk)
+
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        resposta = HttpResponse(bytes(nota.xml_gz), content_type='application/xml')
+        resposta['Content-Encoding'] = 'gzip'
+    else:
+        resposta = HttpResponse(nota.xml, content_type='application/xml; charset=utf-8')
+    patch_vary_headers(resposta, ['Accept-Encoding'])
+    resposta['Content-Disposition'] = f'attachment; filename="{nota.chave}-nfe.xml"'
+    return resposta
@@ -5,12 +5,14 @@ from requests.exceptions import RequestException
 import threading
 import os
 from dotenv import load_dotenv
+from cliente_comandas import ClienteComandas
 
 # Load environment variables
 load_dotenv()
 API_BASE_URL = os.getenv("API_BASE_URL", "http://localhost:8000/api/")
 HEADERS = {}
 comandas = []
+cliente = ClienteComandas(API_BASE_URL, HEADERS, comandas)
 page = None
 
 def main(page_param: ft.Page):
@@ -80,10 +82,7 @@ def fetch_menu_items():
     print(f"Buscando itens do cardápio... restaurant_id={restaurant_id}")
     page.client_storage.remove("menu_items")
     try:
-        response = requests.get(f"{API_BASE_URL}menu-items", headers=HEADERS, timeout=10)
-        print(f"Resposta do /api/menu-items: {response.status_code}, {response.text}")
-        response.raise_for_status()
-        menu_items = response.json()
+        menu_items = cliente.get_json_condicional(f"{API_BASE_URL}menu-items")
         for item in menu_items:
             if item.get("restaurant_id") != restaurant_id:
                 print(f"Erro: Item {item['name']} tem restaurant_id={item['restaurant_id']}, esperado={restaurant_id}")
@@ -139,6 +138,20 @@ def fetch_comandas():
             show_login_screen(error_message="Sessão expirada. Faça login novamente.")
         return []
 
+def sync_comandas():
+    cliente.sync_comandas(recarregar=fetch_comandas)
+    page.client_storage.set("comandas", comandas)
+    return comandas
+
+def renovar_sessao():
+    access_token = cliente.renovar_token(page.client_storage.get("refresh_token"))
+    if access_token:
+        page.client_storage.set("access_token", access_token)
+    return bool(access_token)
+
+def sessao_expirada():
+    show_login_screen(error_message="Sessão expirada. Faça login novamente.")
+
 def create_comanda():
     restaurant_id = page.client_storage.get("restaurant_id")
     print(f"Criando nova comanda... restaurant_id={restaurant_id}")
@@ -190,6 +203,7 @@ def create_comanda():
 
 def show_login_screen(error_message=None):
     print("Exibindo tela de login")
+    cliente.parar_eventos()
     username_field = ft.TextField(
         label="Usuário",
         prefix_icon=ft.Icons.PERSON,
@@ -434,10 +448,7 @@ def show_main_interface():
         if hasattr(page, 'comanda_dropdown') and page.comanda_dropdown and page.comanda_dropdown.value:
             comanda_id = int(page.comanda_dropdown.value.split("ID: ")[1].strip(")"))
             try:
-                response = requests.get(f"{API_BASE_URL}cards/{comanda_id}", headers=HEADERS, timeout=10)
-                print(f"Resposta do /api/cards/{comanda_id}: {response.status_code}, {response.text}")
-                response.raise_for_status()
-                comanda = response.json()
+                comanda = cliente.get_json_condicional(f"{API_BASE_URL}cards/{comanda_id}")
                 print(f"Comanda carregada: {comanda}")
             except RequestException as e:
                 print(f"Erro ao buscar comanda: {str(e)}")
@@ -555,19 +566,18 @@ def show_main_interface():
             page.snack_bar.open = True
         page.update()
 
-    def atualizar_comandas_periodicamente():
+    def atualizar_comandas():
         restaurant_id = page.client_storage.get("restaurant_id")
-        print(f"Atualizando comandas periodicamente... restaurant_id={restaurant_id}")
+        print(f"Atualizando comandas (evento do servidor)... restaurant_id={restaurant_id}")
         if restaurant_id is None:
             print("Erro: restaurant_id não definido. Retornando à tela de login.")
             show_login_screen(error_message="Sessão inválida. Faça login novamente.")
             return
         try:
-            comandas[:] = fetch_comandas()
+            sync_comandas()
             if hasattr(page, 'comanda_dropdown') and page.comanda_dropdown:
                 page.comanda_dropdown.options = [ft.dropdown.Option(f"Comanda {c['number']} (ID: {c['id']})") for c in comandas if c["is_active"]]
             page.update()
-            threading.Timer(10.0, atualizar_comandas_periodicamente).start()
         except Exception as e:
             print(f"Erro ao atualizar comandas: {str(e)}")
             if "Faça login novamente" in str(e) or "Autenticação necessária" in str(e):
@@ -576,9 +586,9 @@ def show_main_interface():
                 page.snack_bar = ft.SnackBar(ft.Text(f"Erro ao atualizar comandas: {str(e)}"))
                 page.snack_bar.open = True
                 page.update()
-                threading.Timer(10.0, atualizar_comandas_periodicamente).start()
 
-    threading.Timer(10.0, atualizar_comandas_periodicamente).start()
+    # Atualizações chegam por push (SSE) em vez de polling
+    cliente.iniciar_eventos(atualizar_comandas, renovar_sessao, sessao_expirada)
 
     main_layout = ft.Column(
         [
@@ -1,14 +1,9 @@
 from django.utils.safestring import mark_safe
 
 from django.contrib import admin
-from .models import Restaurant, Category, MenuItem, Customer, Card, CardItem, Stock,CardPayment, RestaurantUser
+from .models import Restaurant, Category, MenuItem, Customer, Card, CardItem, PhysicalCard, Stock,CardPayment, RestaurantUser, StockMovement, DailySalesSummary, stock_balance_expression
 from django.utils.timezone import localdate
-
-import qrcode
-import base64
-from io import BytesIO
-
-import uuid
+from django.db.models import OuterRef
 
 from django import forms
 from .models import MenuItem
@@ -23,64 +18,10 @@ from fiscal.models import NotaFiscal
 
 class MenuItemWithStockLabelChoiceField(forms.ModelChoiceField):
     def label_from_instance(self, obj):
-        try:
-            stock = obj.stock.quantity
-        except:
-            stock = 0
+        # `stock_balance` é anotado no queryset (ver CardItemInline)
+        stock = getattr(obj, 'stock_balance', None) or 0
         return f"{obj.name} (Estoque: {stock})"
 
-def gerar_payload_pix(chave_pix: str, valor: float, nome_recebedor: str, cidade: str, txid: str = None) -> str:
-    valor_str = f"{valor:.2f}"
-
-    if not txid:
-        # Gera um txid automático se não receber
-        txid = uuid.uuid4().hex[:6].upper()  # 6 caracteres aleatórios
-
-    gui = "BR.GOV.BCB.PIX"
-    merchant_info = f"00{len(gui):02d}{gui}" + f"01{len(chave_pix):02d}{chave_pix}"
-    merchant_info_formatado = f"26{len(merchant_info):02d}{merchant_info}"
-
-    info_adicional = f"05{len(txid):02d}{txid}"
-    info_adicional_formatado = f"62{len(info_adicional):02d}{info_adicional}"
-
-    payload_sem_crc = (
-        "000201"
-        + merchant_info_formatado
-        + "52040000"
-        + "5303986"
-        + f"54{len(valor_str):02d}{valor_str}"
-        + "5802BR"
-        + f"59{len(nome_recebedor):02d}{nome_recebedor}"
-        + f"60{len(cidade):02d}{cidade}"
-        + info_adicional_formatado
-        + "6304"
-    )
-
-    crc16 = calcular_crc16(payload_sem_crc)
-    payload_completo = payload_sem_crc + crc16
-    return payload_completo
-
-
-def calcular_crc16(payload):
-    polinomio = 0x1021
-    resultado = 0xFFFF
-
-    for caractere in payload:
-        resultado ^= ord(caractere) << 8
-        for _ in range(8):
-            if (resultado & 0x8000) != 0:
-                resultado = (resultado << 1) ^ polinomio
-            else:
-                resultado <<= 1
-            resultado &= 0xFFFF
-
-    return f"{resultado:04X}"
-
-
-
-
-
-
 @admin.register(Restaurant)
 class RestaurantAdmin(admin.ModelAdmin):
     list_display = ('name', 'owner', 'phone', 'email', 'is_active')
@@ -244,7 +185,9 @@ class CardItemInline(admin.TabularInline):
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
         if db_field.name == "menu_item" and not request.user.is_superuser:
-            kwargs["queryset"] = MenuItem.objects.filter(restaurant__owner=request.user)
+            kwargs["queryset"] = MenuItem.objects.filter(restaurant__owner=request.user).annotate(
+                stock_balance=stock_balance_expression(OuterRef('pk'))
+            )
             return MenuItemWithStockLabelChoiceField(queryset=kwargs["queryset"])
         return super().formfield_for_foreignkey(db_field, request, **kwargs)
 
@@ -289,18 +232,25 @@ class CardAdmin(admin.ModelAdmin):
     status_display.short_description = "Status do dia"
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).with_totals()
         return qs if request.user.is_superuser else qs.filter(restaurant__owner=request.user)
     
     def total_display(self, obj):
-        total = sum(item.subtotal() for item in obj.card_items.all())
-        return f"R$ {total:.2f}"
+        return f"R$ {obj.total():.2f}"
     total_display.short_description = ('Total')
+    total_display.admin_order_field = 'total_amount'
 
     def save_model(self, request, obj, form, change):
         if not request.user.is_superuser and not obj.restaurant_id:
             obj.restaurant = Restaurant.objects.filter(owner=request.user).first()
-        super().save_model(request, obj, form, change)
+        if change:
+            super().save_model(request, obj, form, change)
+        else:
+            Card.open(obj.restaurant, card=obj)  # número da comanda física livre ou da sequência
+
+    def get_readonly_fields(self, request, obj=None):
+        readonly_fields = super().get_readonly_fields(request, obj)
+        return readonly_fields if obj else (*readonly_fields, 'number')
 
     def get_fields(self, request, obj=None):
         fields = super().get_fields(request, obj)
@@ -312,6 +262,29 @@ class CardAdmin(admin.ModelAdmin):
     inlines = [CardItemInline]
 
 
+@admin.register(PhysicalCard)
+class PhysicalCardAdmin(admin.ModelAdmin):
+    """Comandas de plástico do restaurante; crie uma faixa de uma vez com `manage.py criar_comandas_fisicas`"""
+    list_display = ('number', 'restaurant')
+    list_filter = ('restaurant',)
+    search_fields = ('number',)
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('restaurant')
+        return qs if request.user.is_superuser else qs.filter(restaurant__owner=request.user)
+
+    def get_fields(self, request, obj=None):
+        fields = super().get_fields(request, obj)
+        if not request.user.is_superuser:
+            fields = [f for f in fields if f != 'restaurant']
+        return fields
+
+    def save_model(self, request, obj, form, change):
+        if not request.user.is_superuser and not obj.restaurant_id:
+            obj.restaurant = Restaurant.objects.filter(owner=request.user).first()
+        super().save_model(request, obj, form, change)
+
+
 
 
 
@@ -324,14 +297,15 @@ class CardPaymentAdmin(admin.ModelAdmin):
     readonly_fields = ('amount', 'change_amount', 'paid_at','qrcode_pix')
     
     def nota_fiscal_emitida(self, obj):
-        return hasattr(obj, 'nota_fiscal')
+        return hasattr(obj, 'nota_fiscal') and obj.nota_fiscal.status == NotaFiscal.Status.AUTORIZADA
     nota_fiscal_emitida.boolean = True
     nota_fiscal_emitida.short_description = "NFC-e Emitida?"
 
     def emitir_nfce_link(self, obj):
         if hasattr(obj, 'nota_fiscal'):
-            return format_html('<a href="{}" target="_blank">Ver NFC-e</a>',
-                reverse('admin:fiscal_notafiscal_change', args=[obj.nota_fiscal.id])
+            return format_html('<a href="{}" target="_blank">Ver NFC-e ({})</a>',
+                reverse('admin:fiscal_notafiscal_change', args=[obj.nota_fiscal.id]),
+                obj.nota_fiscal.get_status_display(),
             )
         return format_html(
             '<a class="button" href="{}">Emitir NFC-e</a>',
@@ -359,7 +333,7 @@ class CardPaymentAdmin(admin.ModelAdmin):
 
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).select_related('nota_fiscal').defer('nota_fiscal__xml_gz')
         return qs if request.user.is_superuser else qs.filter(restaurant__owner=request.user)
 
     def formfield_for_foreignkey(self, db_field, request, **kwargs):
@@ -407,26 +381,14 @@ class CardPaymentAdmin(admin.ModelAdmin):
 
         if not obj.restaurant.chave_pix:
             return "Restaurante sem chave Pix cadastrada."
-        
-        txid = f"CARD{obj.card.number:04d}"  # Exemplo: cartão 23 vira "CARD0023"
-
-        # Gerar Payload Pix
-        payload = gerar_payload_pix(
-            chave_pix=obj.restaurant.chave_pix,  # <- CORRETO AGORA
-            valor=float(obj.amount),
-            #nome_recebedor=obj.restaurant.name[:25],  # Máximo 25 caracteres
-            nome_recebedor="ENEAS BEZERRA TELES",
-            cidade=obj.restaurant.city,  # Máximo 15 caracteres
-            txid=txid
-        )
 
-        # Gerar QR Code
-        qr = qrcode.make(payload)
-        buffer = BytesIO()
-        qr.save(buffer, format='PNG')
-        img_base64 = base64.b64encode(buffer.getvalue()).decode()
-        img_html = f'<img src="data:image/png;base64,{img_base64}" width="300" height="300" />'
-        return mark_safe(img_html)
+        # A imagem vem de /pix/<id>.png (cacheada); o CRC no final do payload versiona a URL
+        try:
+            payload = obj.pix_payload()
+        except ValueError as e:
+            return f"Dados do Pix inválidos: {e}"
+        url = f"{reverse('pix_qrcode', args=[obj.pk])}?v={payload[-4:]}"
+        return format_html('<img src="{}" width="300" height="300" />', url)
 
 
     qrcode_pix.short_description = "QR Code Pix"
@@ -435,12 +397,13 @@ class CardPaymentAdmin(admin.ModelAdmin):
 
 @admin.register(Stock)
 class StockAdmin(admin.ModelAdmin):
-    list_display = ('menu_item_name', 'quantity')
+    list_display = ('menu_item_name', 'balance_display', 'quantity')
     search_fields = ('menu_item__name',)
+    readonly_fields = ('quantity', 'balance_display')
     actions = ['repor_estoque']
     #########################
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).with_balance()
         # Superusuário vê tudo
         if request.user.is_superuser:
             return qs
@@ -480,13 +443,79 @@ class StockAdmin(admin.ModelAdmin):
         return obj.restaurant.name
     restaurant_name.short_description = 'Restaurante'
 
+    def balance_display(self, obj):
+        return obj.balance() if obj.pk else 0
+    balance_display.short_description = 'Saldo atual'
+    balance_display.admin_order_field = 'balance_amount'
+
     @admin.action(description='Repor 10 unidades selecionadas')
     def repor_estoque(self, request, queryset):
-        for stock in queryset:
-            stock.quantity += 10
-            stock.save()
+        StockMovement.objects.bulk_create([
+            StockMovement(
+                restaurant_id=stock.restaurant_id,
+                menu_item_id=stock.menu_item_id,
+                quantity=10,
+                reason=StockMovement.Reason.ADJUSTMENT,
+                notes='Reposição pelo admin',
+            )
+            for stock in queryset
+        ])
         self.message_user(request, "Reposição concluída com sucesso!")
 
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+    """Livro de movimentos: só inclusão (ajustes manuais), nunca edição ou exclusão"""
+    list_display = ('created_at', 'menu_item', 'quantity', 'reason', 'notes')
+    list_filter = ('reason', 'created_at')
+    search_fields = ('menu_item__name', 'notes')
+    fields = ('menu_item', 'quantity', 'reason', 'notes')
+    date_hierarchy = 'created_at'
+
+    def has_change_permission(self, request, obj=None):
+        return obj is None
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('menu_item')
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(restaurant__owner=request.user)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == "menu_item" and not request.user.is_superuser:
+            kwargs["queryset"] = MenuItem.objects.filter(restaurant__owner=request.user)
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def save_model(self, request, obj, form, change):
+        obj.restaurant_id = obj.menu_item.restaurant_id
+        Stock.objects.get_or_create(menu_item=obj.menu_item, defaults={'restaurant_id': obj.restaurant_id})
+        super().save_model(request, obj, form, change)
+
+@admin.register(DailySalesSummary)
+class DailySalesSummaryAdmin(admin.ModelAdmin):
+    """Resumo mantido pelos signals de CardPayment: somente leitura"""
+    list_display = ('date', 'restaurant', 'payment_method', 'count', 'gross_amount', 'change_amount')
+    list_filter = ('payment_method', 'date')
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        qs = super().get_queryset(request).select_related('restaurant')
+        if request.user.is_superuser:
+            return qs
+        return qs.filter(restaurant__owner=request.user)
+
 from .models import StockEntry, StockEntryItem
 
 class StockEntryItemInline(admin.TabularInline):
@@ -0,0 +1,219 @@
+# restaurants/cupons.py
+"""Cupom de venda: um modelo único (Cupom) e seus formatos de saída.
+
+carregar_cupom() monta o Cupom com duas consultas fixas (pagamento e itens com o
+produto). A partir dele saem o PDF (este módulo), o ESC/POS e o texto simples
+(restaurants/escpos.py), usados pela view /cupom/ e por /api/card-payments/.../receipt.
+
+O HTML do cupom é montado no processo do Django e o WeasyPrint roda num pool de
+processos separado. O PDF fica gravado em disco pelo id do pagamento e o sha256 do
+HTML: o mesmo cupom nunca é renderizado duas vezes e qualquer alteração (pagamento ou
+NFC-e assinada) gera outro HTML, logo outro arquivo. A nova versão é agendada no pool
+(pelos signals do CardPayment e da NotaFiscal) e as anteriores do mesmo pagamento são
+apagadas quando ela fica pronta.
+"""
+import base64
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal
+from functools import partial
+from multiprocessing import get_context
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Prefetch
+from django.http import Http404
+from django.template.loader import render_to_string
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+_em_andamento = {}  # pagamento_id -> (caminho, futuro) da versão mais recente enviada ao pool
+
+
+@dataclass
+class ItemCupom:
+    nome: str
+    quantidade: Decimal
+    preco: Decimal
+    subtotal: Decimal
+
+
+@dataclass
+class Cupom:
+    pagamento_id: int
+    restaurante: str
+    comanda: int
+    pago_em: datetime
+    forma_pagamento: str
+    valor: Decimal
+    valor_recebido: Decimal = None
+    troco: Decimal = None
+    observacoes: str = ''
+    itens: list = field(default_factory=list)
+    nfce_chave: str = ''  # preenchidos quando a NFC-e já foi assinada (normal ou contingência)
+    nfce_qrcode: str = ''
+    nfce_contingencia: bool = False
+
+
+def carregar_cupom(**filtros):
+    """Cupom do pagamento mais recente que atende aos filtros (Http404 se não houver)"""
+    from .models import CardItem, CardPayment
+
+    pagamento = CardPayment.objects.select_related('card', 'restaurant', 'nota_fiscal').defer(
+        'nota_fiscal__xml_gz'
+    ).prefetch_related(
+        Prefetch('card__card_items', queryset=CardItem.objects.select_related('menu_item'))
+    ).filter(**filtros).order_by('-paid_at').first()
+    if pagamento is None:
+        raise Http404("Pagamento não encontrado")
+    nota = getattr(pagamento, 'nota_fiscal', None)
+    if nota is not None and not nota.qrcode_url:
+        nota = None
+
+    return Cupom(
+        pagamento_id=pagamento.id,
+        restaurante=pagamento.restaurant.name,
+        comanda=pagamento.card.number,
+        pago_em=timezone.localtime(pagamento.paid_at),
+        forma_pagamento=pagamento.get_payment_method_display(),
+        valor=pagamento.amount,
+        valor_recebido=pagamento.paid_amount,
+        troco=pagamento.change_amount,
+        observacoes=pagamento.notes,
+        itens=[
+            ItemCupom(
+                nome=item.menu_item.name,
+                quantidade=item.quantity,
+                preco=item.price or item.menu_item.price,
+                subtotal=item.subtotal(),
+            )
+            for item in pagamento.card.card_items.all()
+        ],
+        nfce_chave=nota.chave if nota else '',
+        nfce_qrcode=nota.qrcode_url if nota else '',
+        nfce_contingencia=bool(nota and nota.status == nota.Status.CONTINGENCIA),
+    )
+
+
+def _diretorio():
+    return Path(getattr(settings, 'CUPOM_PDF_DIR', Path(settings.MEDIA_ROOT) / 'cupons'))
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn: o filho não herda conexões de banco nem threads do servidor
+            _pool = ProcessPoolExecutor(
+                max_workers=getattr(settings, 'CUPOM_PDF_WORKERS', 2),
+                mp_context=get_context('spawn'),
+            )
+        return _pool
+
+
+def _gravar_pdf(html, caminho):
+    """Roda no processo do pool: só depende do WeasyPrint, não do Django"""
+    caminho = Path(caminho)
+    if caminho.exists():
+        return str(caminho)
+    from weasyprint import HTML
+
+    pdf = HTML(string=html).write_pdf()
+    caminho.parent.mkdir(parents=True, exist_ok=True)
+    # grava num temporário e renomeia: quem lê nunca vê um PDF pela metade
+    fd, temporario = tempfile.mkstemp(dir=caminho.parent, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as arquivo:
+        arquivo.write(pdf)
+    os.replace(temporario, caminho)
+    return str(caminho)
+
+
+def render_cupom_html(cupom):
+    contexto = {'cupom': cupom}
+    if cupom.nfce_qrcode:
+        from .pix import qrcode_png
+
+        contexto['nfce_qrcode_png'] = base64.b64encode(qrcode_png(cupom.nfce_qrcode)).decode('ascii')
+    return render_to_string('cupom.html', contexto)
+
+
+def caminho_cupom(cupom, html):
+    chave = hashlib.sha256(html.encode('utf-8')).hexdigest()
+    return _diretorio() / f"{cupom.pagamento_id % 256:02x}" / f"{cupom.pagamento_id}-{chave}.pdf"
+
+
+def _descartar_anteriores(caminho):
+    """Apaga os PDFs das outras versões do cupom do mesmo pagamento"""
+    pagamento_id = caminho.name.split('-', 1)[0]
+    for antigo in caminho.parent.glob(f"{pagamento_id}-*.pdf"):
+        if antigo != caminho:
+            antigo.unlink(missing_ok=True)
+
+
+def _aguardar_pool(pagamento_id, caminho):
+    """Espera um pouco pelo PDF que o pool já está gerando, em vez de renderizar uma segunda cópia"""
+    with _pool_lock:
+        agendado = _em_andamento.get(pagamento_id)
+    if agendado is None or agendado[0] != caminho:
+        return
+    try:
+        agendado[1].result(timeout=getattr(settings, 'CUPOM_PDF_ESPERA_SEGUNDOS', 5))
+    except Exception:
+        pass  # demorou ou falhou (a falha é registrada em _concluir): a view renderiza na hora
+
+
+def obter_cupom_pdf(cupom):
+    """Caminho do PDF do cupom; renderiza na hora apenas se o pool não gerou (nem está gerando)"""
+    html = render_cupom_html(cupom)
+    caminho = caminho_cupom(cupom, html)
+    if not caminho.exists():
+        _aguardar_pool(cupom.pagamento_id, caminho)
+    if not caminho.exists():
+        _gravar_pdf(html, caminho)
+        _descartar_anteriores(caminho)
+    return caminho
+
+
+def agendar_cupom(payment_id):
+    """Envia a versão atual do cupom para o pool (via on_commit do CardPayment e da NotaFiscal)"""
+    try:
+        cupom = carregar_cupom(pk=payment_id)
+        html = render_cupom_html(cupom)
+        caminho = caminho_cupom(cupom, html)
+        if caminho.exists():
+            _descartar_anteriores(caminho)
+            return
+        pool = _get_pool()
+        with _pool_lock:
+            agendado = _em_andamento.get(payment_id)
+            if agendado is not None and agendado[0] == caminho:
+                return
+            futuro = pool.submit(_gravar_pdf, html, str(caminho))
+            _em_andamento[payment_id] = (caminho, futuro)
+        futuro.add_done_callback(partial(_concluir, payment_id, caminho))
+    except Exception:
+        # o cupom ainda pode ser gerado sob demanda pela view
+        logger.exception("Falha ao agendar o cupom do pagamento %s", payment_id)
+
+
+def _concluir(payment_id, caminho, futuro):
+    """Callback do pool: registra a falha e descarta as versões que ficaram obsoletas"""
+    with _pool_lock:
+        mais_recente = _em_andamento.get(payment_id, (None, None))[1] is futuro
+        if mais_recente:
+            del _em_andamento[payment_id]
+    if futuro.exception() is not None:
+        logger.error("Falha ao gerar cupom em PDF", exc_info=futuro.exception())
+    elif mais_recente:
+        _descartar_anteriores(caminho)
+    else:
+        caminho.unlink(missing_ok=True)  # uma versão mais nova foi agendada enquanto esta era gerada
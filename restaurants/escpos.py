@@ -0,0 +1,157 @@
+# restaurants/escpos.py
+"""Cupom em ESC/POS (e texto simples) para impressoras térmicas, sem motor de PDF nem navegador.
+
+Os renderizadores recebem o Cupom montado por restaurants/cupons.py. Este módulo
+não depende do Django: o caixa (caixa.py) importa o Spooler para mandar os bytes
+recebidos de /api/card-payments/{card_id}/receipt?format=escpos direto para a
+impressora (ex.: /dev/usb/lp0) ou para um arquivo.
+"""
+import logging
+import queue
+import threading
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+ESC = b'\x1b'
+GS = b'\x1d'
+
+INICIALIZAR = ESC + b'@'
+CODEPAGE_PC860 = ESC + b't\x03'  # português (acentos e ç)
+ALINHAR_ESQUERDA = ESC + b'a\x00'
+ALINHAR_CENTRO = ESC + b'a\x01'
+NEGRITO_LIGA = ESC + b'E\x01'
+NEGRITO_DESLIGA = ESC + b'E\x00'
+FONTE_DUPLA = GS + b'!\x11'
+FONTE_NORMAL = GS + b'!\x00'
+AVANCAR_E_CORTAR = GS + b'V\x42\x03'  # avança 3 linhas e faz corte parcial
+
+CONTENT_TYPE = 'application/vnd.escpos'
+LARGURA_PADRAO = 48  # colunas da fonte A em bobina de 80 mm (42 para 58 mm)
+
+
+def _texto(texto):
+    return str(texto).encode('cp860', errors='replace')
+
+
+def _colunas(esquerda, direita, largura):
+    esquerda = str(esquerda)[:largura - len(str(direita)) - 1]
+    return esquerda.ljust(largura - len(str(direita))) + str(direita)
+
+
+def _numero(valor):
+    return f"{Decimal(valor or 0):.2f}".replace('.', ',')
+
+
+def _moeda(valor):
+    return f"R$ {_numero(valor)}"
+
+
+def _linhas_cupom(cupom, largura):
+    """Layout em colunas fixas compartilhado pelo ESC/POS e pelo texto: (estilo, texto)"""
+    linhas = [
+        ('titulo', cupom.restaurante[:largura // 2]),
+        ('centro', f"Cupom de Pagamento #{cupom.pagamento_id}"),
+        ('centro', f"Comanda {cupom.comanda} - {cupom.pago_em:%d/%m/%Y %H:%M}"),
+        ('normal', '-' * largura),
+    ]
+    for item in cupom.itens:
+        linhas.append(('normal', item.nome[:largura]))
+        linhas.append(('normal', _colunas(
+            f"  {_numero(item.quantidade)} x {_moeda(item.preco)}", _moeda(item.subtotal), largura
+        )))
+    linhas += [
+        ('normal', '-' * largura),
+        ('negrito', _colunas("TOTAL", _moeda(cupom.valor), largura)),
+        ('normal', _colunas(cupom.forma_pagamento, _moeda(cupom.valor_recebido or cupom.valor), largura)),
+    ]
+    if cupom.troco:
+        linhas.append(('normal', _colunas("Troco", _moeda(cupom.troco), largura)))
+    if cupom.observacoes:
+        linhas.append(('normal', cupom.observacoes))
+    if cupom.nfce_chave:
+        linhas.append(('normal', '-' * largura))
+        if cupom.nfce_contingencia:
+            linhas += [('titulo', "EM CONTINGÊNCIA"), ('centro', "Pendente de autorização")]
+        grupos = [cupom.nfce_chave[i:i + 4] for i in range(0, 44, 4)]
+        linhas += [
+            ('centro', "NFC-e - Chave de acesso"),
+            ('centro', ' '.join(grupos[:6])),
+            ('centro', ' '.join(grupos[6:])),
+            ('qrcode', cupom.nfce_qrcode),
+        ]
+    return linhas
+
+
+def gerar_cupom_texto(cupom, largura=LARGURA_PADRAO):
+    """Cupom em texto simples (mesmo layout da bobina; o QR Code sai como a URL)"""
+    return '\n'.join(
+        texto.center(largura).rstrip() if estilo in ('titulo', 'centro') else texto
+        for estilo, texto in _linhas_cupom(cupom, largura)
+    ) + '\n'
+
+
+_ESTILOS = {
+    'titulo': (ALINHAR_CENTRO + FONTE_DUPLA, FONTE_NORMAL + ALINHAR_ESQUERDA),
+    'centro': (ALINHAR_CENTRO, ALINHAR_ESQUERDA),
+    'negrito': (NEGRITO_LIGA, NEGRITO_DESLIGA),
+    'normal': (b'', b''),
+}
+
+
+def _qrcode(dados, modulo=4):
+    """QR Code nativo da impressora (GS ( k, modelo 2, correção M)"""
+    dados = dados.encode('ascii')
+    tamanho = len(dados) + 3
+    return b''.join([
+        GS + b'(k\x04\x00\x31\x41\x32\x00',
+        GS + b'(k\x03\x00\x31\x43' + bytes([modulo]),
+        GS + b'(k\x03\x00\x31\x45\x31',
+        GS + b'(k' + bytes([tamanho % 256, tamanho // 256]) + b'\x31\x50\x30' + dados,
+        GS + b'(k\x03\x00\x31\x51\x30',
+    ])
+
+
+def gerar_cupom_escpos(cupom, largura=LARGURA_PADRAO):
+    """Bytes ESC/POS do cupom (mesmos dados do cupom em PDF)"""
+    partes = [INICIALIZAR, CODEPAGE_PC860]
+    for estilo, texto in _linhas_cupom(cupom, largura):
+        if estilo == 'qrcode':
+            partes += [ALINHAR_CENTRO, _qrcode(texto), b'\n', ALINHAR_ESQUERDA]
+            continue
+        antes, depois = _ESTILOS[estilo]
+        partes += [antes, _texto(texto), b'\n', depois]
+    partes.append(AVANCAR_E_CORTAR)
+    return b''.join(partes)
+
+
+class Spooler:
+    """Fila de impressão: uma thread grava os trabalhos em ordem no dispositivo.
+
+    O destino é o caminho do dispositivo (/dev/usb/lp0, /dev/ttyUSB0, compartilhamento
+    LPT) ou um arquivo comum, que funciona como impressora falsa nos testes.
+    """
+
+    def __init__(self, destino):
+        self.destino = destino
+        self._fila = queue.Queue()
+        self._thread = threading.Thread(target=self._trabalhar, name='escpos-spooler', daemon=True)
+        self._thread.start()
+
+    def imprimir(self, dados):
+        self._fila.put(dados)
+
+    def aguardar(self):
+        """Bloqueia até todos os trabalhos enviados terem sido gravados"""
+        self._fila.join()
+
+    def _trabalhar(self):
+        while True:
+            dados = self._fila.get()
+            try:
+                with open(self.destino, 'ab', buffering=0) as impressora:
+                    impressora.write(dados)
+            except OSError:
+                logger.exception("Falha ao imprimir em %s", self.destino)
+            finally:
+                self._fila.task_done()
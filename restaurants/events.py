@@ -0,0 +1,102 @@
+# restaurants/events.py
+"""Canal de eventos em memória (Server-Sent Events) para os terminais Flet.
+
+Os signals de Card/CardItem/CardPayment publicam um evento por restaurante e cada
+conexão aberta em /api/cards/events recebe a mensagem. O evento só avisa que algo
+mudou; o terminal busca o conteúdo em /api/cards/sync.
+
+O broker vive no processo: com vários workers, cada um só enxerga as alterações
+feitas por ele mesmo, então o deploy deve usar um único processo ASGI (core/asgi.py).
+"""
+import asyncio
+import json
+import queue
+import threading
+from collections import defaultdict
+
+KEEPALIVE_SECONDS = 15
+MAX_PENDING_EVENTS = 100
+
+_subscribers = defaultdict(set)
+_lock = threading.Lock()
+
+
+class _AsyncSubscriber:
+    def __init__(self):
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            pass  # cliente lento: o próximo /cards/sync recupera tudo
+
+    def put(self, message):
+        self.loop.call_soon_threadsafe(self._put, message)
+
+
+class _SyncSubscriber:
+    def __init__(self):
+        self.queue = queue.Queue(maxsize=MAX_PENDING_EVENTS)
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            pass
+
+
+def _format(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _subscribe(restaurant_id, subscriber):
+    with _lock:
+        _subscribers[restaurant_id].add(subscriber)
+
+
+def _unsubscribe(restaurant_id, subscriber):
+    with _lock:
+        _subscribers[restaurant_id].discard(subscriber)
+        if not _subscribers[restaurant_id]:
+            del _subscribers[restaurant_id]
+
+
+def publish(restaurant_id, event, data):
+    """Envia o evento para todos os terminais conectados do restaurante (thread-safe)."""
+    message = _format(event, data)
+    with _lock:
+        subscribers = list(_subscribers.get(restaurant_id, ()))
+    for subscriber in subscribers:
+        subscriber.put(message)
+
+
+async def stream_async(restaurant_id):
+    """Gerador assíncrono de mensagens SSE (servidor ASGI)."""
+    subscriber = _AsyncSubscriber()
+    _subscribe(restaurant_id, subscriber)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                yield await asyncio.wait_for(subscriber.queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+    finally:
+        _unsubscribe(restaurant_id, subscriber)
+
+
+def stream_sync(restaurant_id):
+    """Gerador síncrono de mensagens SSE (runserver/WSGI; ocupa uma thread por conexão)."""
+    subscriber = _SyncSubscriber()
+    _subscribe(restaurant_id, subscriber)
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                yield subscriber.queue.get(timeout=KEEPALIVE_SECONDS)
+            except queue.Empty:
+                yield ": keepalive\n\n"
+    finally:
+        _unsubscribe(restaurant_id, subscriber)
@@ -0,0 +1,61 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max, Sum
+from django.utils import timezone
+
+from restaurants.models import Stock, StockMovement, StockSnapshot
+
+
+class Command(BaseCommand):
+    help = "Consolida os movimentos de estoque em snapshots datados (rodar periodicamente, ex.: cron)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--minutos', type=int, default=5,
+            help="Só consolida movimentos com mais de N minutos (evita transações ainda em andamento)",
+        )
+
+    def handle(self, *args, **options):
+        agora = timezone.now()
+        limite = agora - timedelta(minutes=options['minutos'])
+        ultimo_id = StockMovement.objects.filter(created_at__lte=limite).aggregate(ultimo=Max('id'))['ultimo']
+        if not ultimo_id:
+            self.stdout.write("Nenhum movimento para consolidar.")
+            return
+
+        # O registro de movimentos não cria o Stock (só INSERT no livro): os itens novos entram aqui
+        Stock.objects.bulk_create([
+            Stock(restaurant_id=restaurante, menu_item_id=item)
+            for item, restaurante in StockMovement.objects.filter(
+                id__lte=ultimo_id, menu_item__stock__isnull=True
+            ).order_by().values_list('menu_item_id', 'restaurant_id').distinct()
+        ], ignore_conflicts=True)
+
+        consolidados = 0
+        for stock in Stock.objects.select_related('menu_item'):
+            with transaction.atomic():
+                anterior = StockSnapshot.objects.filter(menu_item_id=stock.menu_item_id).order_by('-last_movement_id').first()
+                desde_id = anterior.last_movement_id if anterior else 0
+                if desde_id >= ultimo_id:
+                    continue
+                delta = StockMovement.objects.filter(
+                    menu_item_id=stock.menu_item_id, id__gt=desde_id, id__lte=ultimo_id
+                ).aggregate(total=Sum('quantity'))['total']
+                if delta is None:
+                    continue
+                quantidade = (anterior.quantity if anterior else Decimal('0')) + delta
+                StockSnapshot.objects.create(
+                    restaurant_id=stock.restaurant_id,
+                    menu_item_id=stock.menu_item_id,
+                    quantity=quantidade,
+                    last_movement_id=ultimo_id,
+                    taken_at=agora,
+                )
+                Stock.objects.filter(pk=stock.pk).update(quantity=float(quantidade))
+                consolidados += 1
+                self.stdout.write(f"{stock.menu_item.name}: {quantidade}")
+
+        self.stdout.write(self.style.SUCCESS(f"{consolidados} itens consolidados até o movimento #{ultimo_id}."))
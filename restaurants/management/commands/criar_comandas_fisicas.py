@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+from restaurants.models import PhysicalCard, Restaurant
+
+
+class Command(BaseCommand):
+    help = "Cadastra as comandas de plástico (faixa de números) que o create_card reaproveita"
+
+    def add_arguments(self, parser):
+        parser.add_argument('restaurante_id', type=int)
+        parser.add_argument('--de', type=int, default=1, help="Primeiro número da faixa")
+        parser.add_argument('--ate', type=int, required=True, help="Último número da faixa")
+
+    def handle(self, *args, **options):
+        restaurante = Restaurant.objects.filter(pk=options['restaurante_id']).first()
+        if not restaurante:
+            raise CommandError(f"Restaurante {options['restaurante_id']} não existe")
+        if options['de'] < 1 or options['ate'] < options['de']:
+            raise CommandError("Faixa inválida")
+
+        antes = restaurante.physical_cards.count()
+        PhysicalCard.objects.bulk_create(
+            [PhysicalCard(restaurant=restaurante, number=n) for n in range(options['de'], options['ate'] + 1)],
+            ignore_conflicts=True,
+        )
+        criadas = restaurante.physical_cards.count() - antes
+        self.stdout.write(self.style.SUCCESS(
+            f"{restaurante.name}: {criadas} comanda(s) física(s) criada(s) ({options['de']} a {options['ate']})"
+        ))
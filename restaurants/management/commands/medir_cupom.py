@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from restaurants import cupons, escpos
+
+
+def _pdf(cupom):
+    from weasyprint import HTML
+
+    return HTML(string=cupons.render_cupom_html(cupom)).write_pdf()
+
+
+FORMATOS = {
+    'pdf': _pdf,
+    'escpos': escpos.gerar_cupom_escpos,
+    'txt': escpos.gerar_cupom_texto,
+}
+
+
+class Command(BaseCommand):
+    help = "Mede tempo e consultas por cupom (carregar + renderizar) em cada formato, sem usar o cache de PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument('payment_id', type=int)
+        parser.add_argument('--repeticoes', type=int, default=20)
+
+    def handle(self, *args, **options):
+        repeticoes = options['repeticoes']
+        cupom = cupons.carregar_cupom(pk=options['payment_id'])
+        self.stdout.write(f"Pagamento #{cupom.pagamento_id}: {len(cupom.itens)} itens, {repeticoes} repetições")
+
+        for nome, renderizar in FORMATOS.items():
+            renderizar(cupom)  # aquecimento (templates, fontes)
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                for _ in range(repeticoes):
+                    saida = renderizar(cupons.carregar_cupom(pk=options['payment_id']))
+                decorrido = time.perf_counter() - inicio
+            self.stdout.write(
+                f"{nome:>7}: {decorrido / repeticoes * 1000:8.2f} ms/cupom, "
+                f"{len(consultas) / repeticoes:.0f} consultas/cupom, {len(saida)} bytes"
+            )
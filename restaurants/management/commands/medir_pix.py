@@ -0,0 +1,42 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from restaurants import pix
+
+
+def _crc16_bit_a_bit(payload):
+    """Implementação antiga (cópia do caixa.py/admin), só para comparação"""
+    crc = 0xFFFF
+    for byte in payload.encode('utf-8'):
+        crc ^= byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x1021) if crc & 0x8000 else (crc << 1)
+            crc &= 0xFFFF
+    return f"{crc:04X}"
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark do Pix: CRC16 por tabela x bit a bit e montagem do payload (sem o LRU)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeticoes', type=int, default=20000)
+
+    def handle(self, *args, **options):
+        repeticoes = options['repeticoes']
+        payload = pix.gerar_payload_pix('123e4567-e12b-12d1-a456-426655440000', 123.45, 'Fulano de Tal', 'Brasília', 'CARD0023')
+        assert _crc16_bit_a_bit(payload[:-4]) == pix.calcular_crc16(payload[:-4]) == payload[-4:]
+
+        medidas = {
+            'crc16 tabela': lambda: pix.calcular_crc16(payload),
+            'crc16 bit a bit': lambda: _crc16_bit_a_bit(payload),
+            'payload': lambda: pix._payload.__wrapped__(
+                '123e4567-e12b-12d1-a456-426655440000', '123.45', 'Fulano de Tal', 'Brasilia', 'CARD0023'
+            ),
+        }
+        for nome, funcao in medidas.items():
+            inicio = time.perf_counter()
+            for _ in range(repeticoes):
+                funcao()
+            decorrido = time.perf_counter() - inicio
+            self.stdout.write(f"{nome:>16}: {decorrido / repeticoes * 1e6:8.2f} µs")
@@ -0,0 +1,24 @@
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from restaurants.models import reconstruir_resumo_diario
+
+
+class Command(BaseCommand):
+    help = "Recalcula o resumo diário de vendas (DailySalesSummary) a partir dos pagamentos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--restaurante', type=int, action='append', help="ID do restaurante (pode repetir)")
+        parser.add_argument('--desde', help="Só recalcula a partir desta data (AAAA-MM-DD)")
+
+    def handle(self, *args, **options):
+        desde = None
+        if options['desde']:
+            try:
+                desde = datetime.strptime(options['desde'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError("Data inválida, use AAAA-MM-DD.")
+
+        linhas = reconstruir_resumo_diario(options['restaurante'], desde)
+        self.stdout.write(self.style.SUCCESS(f"{linhas} linhas de resumo recalculadas."))
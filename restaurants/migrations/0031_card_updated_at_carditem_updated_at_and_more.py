@@ -0,0 +1,27 @@
+# Generated by Django 5.2 on 2026-10-18 20:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0030_remove_orderitem_order_remove_orderitem_menu_item_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='card',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='carditem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['restaurant', 'updated_at'], name='restaurants_restaur_683c9a_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2 on 2026-10-18 20:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0031_card_updated_at_carditem_updated_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='menuitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.2 on 2026-10-18 20:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from decimal import Decimal
+from django.db import migrations, models
+
+def snapshot_saldos_atuais(apps, schema_editor):
+    """O saldo atual de cada Stock vira o snapshot inicial do livro de movimentos"""
+    Stock = apps.get_model('restaurants', 'Stock')
+    StockSnapshot = apps.get_model('restaurants', 'StockSnapshot')
+    StockSnapshot.objects.bulk_create([
+        StockSnapshot(
+            restaurant_id=stock.restaurant_id,
+            menu_item_id=stock.menu_item_id,
+            quantity=Decimal(str(round(stock.quantity, 2))),
+            last_movement_id=0,
+        )
+        for stock in Stock.objects.all()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0032_menuitem_updated_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='stock',
+            name='quantity',
+            field=models.FloatField(default=0, verbose_name='Quantidade na última consolidação'),
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Quantidade')),
+                ('reason', models.CharField(choices=[('SA', 'Venda'), ('SC', 'Cancelamento de venda'), ('EN', 'Entrada'), ('AJ', 'Ajuste')], max_length=2, verbose_name='Motivo')),
+                ('notes', models.CharField(blank=True, max_length=255, verbose_name='Observações')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Data')),
+                ('card_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='restaurants.carditem')),
+                ('menu_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='restaurants.menuitem')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='restaurants.restaurant')),
+                ('stock_entry_item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='restaurants.stockentryitem')),
+            ],
+            options={
+                'verbose_name': 'Movimento de Estoque',
+                'verbose_name_plural': 'Movimentos de Estoque',
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['menu_item', 'id'], name='restaurants_menu_it_08d15c_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='StockSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, max_digits=12, verbose_name='Quantidade')),
+                ('last_movement_id', models.PositiveBigIntegerField(default=0, verbose_name='Último movimento consolidado')),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Consolidado em')),
+                ('menu_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='restaurants.menuitem')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_snapshots', to='restaurants.restaurant')),
+            ],
+            options={
+                'verbose_name': 'Consolidação de Estoque',
+                'verbose_name_plural': 'Consolidações de Estoque',
+                'ordering': ['-taken_at'],
+                'indexes': [models.Index(fields=['menu_item', '-last_movement_id'], name='restaurants_menu_it_87b89f_idx')],
+            },
+        ),
+        migrations.RunPython(snapshot_saldos_atuais, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2 on 2026-10-18 20:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0033_stockmovement_stocksnapshot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cardpayment',
+            index=models.Index(fields=['restaurant', 'paid_at'], name='restaurants_restaur_b09f78_idx'),
+        ),
+    ]
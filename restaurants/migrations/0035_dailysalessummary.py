@@ -0,0 +1,56 @@
+# Generated by Django 5.2 on 2026-10-18 20:23
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+def preencher_resumo_diario(apps, schema_editor):
+    """Gera o resumo a partir dos pagamentos já existentes"""
+    CardPayment = apps.get_model('restaurants', 'CardPayment')
+    DailySalesSummary = apps.get_model('restaurants', 'DailySalesSummary')
+    linhas = CardPayment.objects.annotate(
+        dia=TruncDate('paid_at', tzinfo=timezone.get_current_timezone())
+    ).order_by().values('restaurant_id', 'dia', 'payment_method').annotate(
+        quantidade=Count('id'), total=Sum('amount'), troco=Sum('change_amount'),
+    )
+    DailySalesSummary.objects.bulk_create([
+        DailySalesSummary(
+            restaurant_id=linha['restaurant_id'],
+            date=linha['dia'],
+            payment_method=linha['payment_method'],
+            count=linha['quantidade'],
+            gross_amount=linha['total'] or 0,
+            change_amount=linha['troco'] or 0,
+        )
+        for linha in linhas
+    ])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0034_cardpayment_restaurant_paid_at_idx'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySalesSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='Data')),
+                ('payment_method', models.CharField(choices=[('CA', 'Dinheiro'), ('CR', 'Crédito'), ('DE', 'Débito'), ('PX', 'Pix'), ('OT', 'Outro')], max_length=2, verbose_name='Forma Pagamento')),
+                ('count', models.PositiveIntegerField(default=0, verbose_name='Quantidade')),
+                ('gross_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Valor recebido')),
+                ('change_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Troco')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='restaurants.restaurant')),
+            ],
+            options={
+                'verbose_name': 'Resumo Diário de Vendas',
+                'verbose_name_plural': 'Resumos Diários de Vendas',
+                'ordering': ['-date', 'payment_method'],
+                'unique_together': {('restaurant', 'date', 'payment_method')},
+            },
+        ),
+        migrations.RunPython(preencher_resumo_diario, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 5.2 on 2026-10-18 20:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Max
+
+
+def criar_sequencias(apps, schema_editor):
+    """Comandas abertas com número repetido (corrida do max + 1) recebem números novos, a mais
+    antiga fica com o original; a sequência de cada restaurante começa depois do maior número"""
+    Card = apps.get_model('restaurants', 'Card')
+    CardSequence = apps.get_model('restaurants', 'CardSequence')
+    ultimos = dict(
+        Card.objects.order_by().values('restaurant_id').annotate(ultimo=Max('number'))
+        .values_list('restaurant_id', 'ultimo')
+    )
+    vistos = set()
+    for card in Card.objects.filter(is_active=True).order_by('restaurant_id', 'number', 'pk'):
+        if (card.restaurant_id, card.number) in vistos:
+            ultimos[card.restaurant_id] += 1
+            card.number = ultimos[card.restaurant_id]
+            card.save(update_fields=['number'])
+        vistos.add((card.restaurant_id, card.number))
+    CardSequence.objects.bulk_create([
+        CardSequence(restaurant_id=restaurante, next_number=ultimo + 1) for restaurante, ultimo in ultimos.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0035_dailysalessummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_number', models.PositiveIntegerField(default=1, verbose_name='Próximo número')),
+            ],
+            options={
+                'verbose_name': 'Sequência de comandas',
+                'verbose_name_plural': 'Sequências de comandas',
+            },
+        ),
+        migrations.CreateModel(
+            name='PhysicalCard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='Número da Comanda')),
+            ],
+            options={
+                'verbose_name': 'Comanda física',
+                'verbose_name_plural': 'Comandas físicas',
+                'ordering': ['number'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cardsequence',
+            name='restaurant',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='card_sequence', to='restaurants.restaurant'),
+        ),
+        migrations.AddField(
+            model_name='physicalcard',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='physical_cards', to='restaurants.restaurant'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='physicalcard',
+            unique_together={('restaurant', 'number')},
+        ),
+        migrations.RunPython(criar_sequencias, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='card',
+            constraint=models.UniqueConstraint(condition=models.Q(('is_active', True)), fields=('restaurant', 'number'), name='card_number_unique_active'),
+        ),
+    ]
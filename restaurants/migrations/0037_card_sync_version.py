@@ -0,0 +1,61 @@
+# Generated by Django 5.2 on 2026-10-18 21:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0036_card_number_allocation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='Versão')),
+            ],
+            options={
+                'verbose_name': 'Versão das comandas',
+                'verbose_name_plural': 'Versões das comandas',
+            },
+        ),
+        migrations.CreateModel(
+            name='DeletedCard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('card_id', models.PositiveBigIntegerField()),
+                ('version', models.PositiveBigIntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Comanda apagada',
+                'verbose_name_plural': 'Comandas apagadas',
+            },
+        ),
+        migrations.AddField(
+            model_name='card',
+            name='version',
+            field=models.PositiveBigIntegerField(default=0, editable=False, verbose_name='Versão'),
+        ),
+        migrations.AddIndex(
+            model_name='card',
+            index=models.Index(fields=['restaurant', 'version'], name='restaurants_restaur_b37066_idx'),
+        ),
+        migrations.AddField(
+            model_name='cardversion',
+            name='restaurant',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='card_version', to='restaurants.restaurant'),
+        ),
+        migrations.AddField(
+            model_name='deletedcard',
+            name='restaurant',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_cards', to='restaurants.restaurant'),
+        ),
+        migrations.AddIndex(
+            model_name='deletedcard',
+            index=models.Index(fields=['restaurant', 'version'], name='restaurants_restaur_129791_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2 on 2026-10-18 21:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('restaurants', '0037_card_sync_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.PositiveBigIntegerField(default=0, verbose_name='Versão')),
+                ('restaurant', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='menu_version', to='restaurants.restaurant')),
+            ],
+            options={
+                'verbose_name': 'Versão do cardápio',
+                'verbose_name_plural': 'Versões do cardápio',
+            },
+        ),
+    ]
@@ -1,13 +1,19 @@
 import re
-from django.db import models
+from datetime import datetime, time
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q, Max, Sum, Count, Value, ExpressionWrapper, OuterRef, Subquery
+from django.db.models.functions import Coalesce, TruncDate
 from django.core.exceptions import ValidationError
 from django.contrib.auth import get_user_model
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
 from django.utils.timezone import localdate
 from django.utils.crypto import get_random_string
-from django.db.models.signals import post_save
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.utils import timezone
 from django.dispatch import receiver
+from . import cupons, events, pix
 
 User = get_user_model()
 
@@ -146,6 +152,7 @@ class MenuItem(models.Model):
     is_available = models.BooleanField(_('Disponível?'), default=True)
     preparation_time = models.PositiveIntegerField(_('Tempo de preparo (min)'), default=15)
     ingredients = models.TextField(_('Ingredientes'), blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _('Item do Cardápio')
@@ -171,11 +178,34 @@ class Customer(models.Model):
     def __str__(self):
         return f"{self.name} - {self.phone or 'Sem telefone'}"
 
+def card_item_subtotal(prefix=''):
+    """Expressão SQL do subtotal de um CardItem: coalesce(price, menu_item.price) * quantity"""
+    return ExpressionWrapper(
+        Coalesce(F(f'{prefix}price'), F(f'{prefix}menu_item__price')) * F(f'{prefix}quantity'),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+def card_total_expression(prefix=''):
+    return Coalesce(
+        Sum(card_item_subtotal(prefix)),
+        Value(Decimal('0.00')),
+        output_field=models.DecimalField(max_digits=12, decimal_places=2),
+    )
+
+class CardQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Anota `total_amount` em cada comanda, calculado pelo banco numa única query"""
+        return self.annotate(total_amount=card_total_expression('card_items__'))
+
 class Card(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='cards')
     number = models.PositiveIntegerField(_('Número da Comanda'))
     is_active = models.BooleanField(_('Ativo?'), default=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    version = models.PositiveBigIntegerField(_('Versão'), default=0, editable=False)
+
+    objects = CardQuerySet.as_manager()
 
     @property
     def was_paid_today(self):
@@ -185,17 +215,186 @@ class Card(models.Model):
     class Meta:
         indexes = [
             models.Index(fields=['restaurant', 'is_active']),
+            models.Index(fields=['restaurant', 'updated_at']),
+            models.Index(fields=['restaurant', 'version']),
         ]
         unique_together = ('id', 'restaurant', 'number')
+        constraints = [
+            # Índice parcial: também é o caminho da busca das comandas abertas por número
+            models.UniqueConstraint(
+                fields=['restaurant', 'number'], condition=Q(is_active=True), name='card_number_unique_active'
+            ),
+        ]
         ordering = ['number']
         verbose_name = _('Comanda')
         verbose_name_plural = _('Comandas')
 
     def __str__(self):
-        return f"{self.number} Valor: {sum(item.subtotal() for item in self.card_items.all()):.2f}"
+        return f"{self.number} Valor: {self.total():.2f}"
+
+    def save(self, *args, **kwargs):
+        """Toda gravação leva uma versão nova da CardVersion, na mesma transação (cursor do /api/cards/sync)"""
+        with transaction.atomic():
+            self.version = CardVersion.bump(self.restaurant_id)
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'version'}
+            super().save(*args, **kwargs)
+
+    OPEN_ATTEMPTS = 10
+
+    @classmethod
+    def open(cls, restaurant, card=None):
+        """Abre uma comanda com a comanda física livre de menor número ou, sem nenhuma, o próximo da CardSequence.
+
+        As aberturas de um restaurante são serializadas pela linha da CardVersion (travada antes de escolher
+        o número); a constraint de número ativo único ainda cobre quem grava sem passar por aqui.
+        `card` é uma comanda ainda não salva (a do admin) que recebe o número; sem ela, abre uma nova.
+        """
+        card = card or cls(is_active=True)
+        card.restaurant = restaurant
+        for attempt in range(cls.OPEN_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    CardVersion.bump(restaurant.pk)  # trava até o commit: o próximo terminal já vê esta comanda
+                    card.number = PhysicalCard.first_free(restaurant)
+                    if card.number is None:
+                        card.number = CardSequence.take(restaurant.pk)
+                    card.save(force_insert=True)
+                return card
+            except IntegrityError:
+                card.pk = None
+                if attempt == cls.OPEN_ATTEMPTS - 1:
+                    raise
+
+    def clean(self):
+        # O form do admin pode não ter o restaurante, e aí o Django pula a constraint: valida aqui
+        if self.is_active and self.restaurant_id and self.number is not None:
+            if Card.objects.filter(
+                restaurant_id=self.restaurant_id, number=self.number, is_active=True
+            ).exclude(pk=self.pk).exists():
+                raise ValidationError({'number': _('There is already an open card with this number.')})
 
     def total(self):
-        return sum(item.subtotal() for item in self.card_items.all())
+        """Usa o valor anotado por `with_totals()` ou os itens já pré-carregados; senão agrega no banco"""
+        if hasattr(self, 'total_amount'):
+            return self.total_amount
+        if 'card_items' in getattr(self, '_prefetched_objects_cache', {}):
+            return sum((item.subtotal() for item in self.card_items.all()), Decimal('0.00'))
+        return self.card_items.aggregate(total=card_total_expression())['total']
+
+class PhysicalCard(models.Model):
+    """Comanda de plástico: o número é fixo e volta a ficar livre quando a comanda aberta com ele é paga"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='physical_cards')
+    number = models.PositiveIntegerField(_('Número da Comanda'))
+
+    class Meta:
+        unique_together = ('restaurant', 'number')
+        ordering = ['number']
+        verbose_name = _('Comanda física')
+        verbose_name_plural = _('Comandas físicas')
+
+    def __str__(self):
+        return f"Comanda física {self.number}"
+
+    @classmethod
+    def first_free(cls, restaurant):
+        in_use = Card.objects.filter(restaurant=restaurant, is_active=True).values('number')
+        return cls.objects.filter(restaurant=restaurant).exclude(number__in=in_use).values_list(
+            'number', flat=True
+        ).order_by('number').first()
+
+class CardSequence(models.Model):
+    """Próximo número de comanda sem cartão físico (restaurante sem comandas físicas ou todas em uso)"""
+    restaurant = models.OneToOneField(Restaurant, on_delete=models.CASCADE, related_name='card_sequence')
+    next_number = models.PositiveIntegerField(_('Próximo número'), default=1)
+
+    class Meta:
+        verbose_name = _('Sequência de comandas')
+        verbose_name_plural = _('Sequências de comandas')
+
+    def __str__(self):
+        return f"{self.restaurant}: próxima comanda {self.next_number}"
+
+    @classmethod
+    def take(cls, restaurant_id):
+        """Número seguinte, num UPDATE atômico (trava a linha até o commit; sem varrer as comandas)"""
+        sequence = cls.objects.filter(restaurant_id=restaurant_id)
+        with transaction.atomic():
+            if not sequence.update(next_number=F('next_number') + 1):
+                last = max(
+                    Card.objects.filter(restaurant_id=restaurant_id).aggregate(last=Max('number'))['last'] or 0,
+                    PhysicalCard.objects.filter(restaurant_id=restaurant_id).aggregate(last=Max('number'))['last'] or 0,
+                )
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(restaurant_id=restaurant_id, next_number=last + 2)
+                except IntegrityError:  # outro terminal criou a sequência ao mesmo tempo
+                    sequence.update(next_number=F('next_number') + 1)
+            return sequence.values_list('next_number', flat=True).get() - 1
+
+class RestaurantVersion(models.Model):
+    """Contador de alterações por restaurante.
+
+    bump() trava a linha até o commit, então as versões ficam na ordem em que as alterações
+    são confirmadas e um leitor nunca passa por cima de uma transação ainda aberta.
+    """
+    value = models.PositiveBigIntegerField(_('Versão'), default=0)
+
+    class Meta:
+        abstract = True
+
+    def __str__(self):
+        return f"{self.restaurant}: versão {self.value}"
+
+    @classmethod
+    def bump(cls, restaurant_id):
+        """Próxima versão; chame dentro da transação que grava a alteração"""
+        counter = cls.objects.filter(restaurant_id=restaurant_id)
+        with transaction.atomic():
+            if not counter.update(value=F('value') + 1):
+                try:
+                    with transaction.atomic():
+                        cls.objects.create(restaurant_id=restaurant_id, value=1)
+                except IntegrityError:  # outro terminal criou o contador ao mesmo tempo
+                    counter.update(value=F('value') + 1)
+            return counter.values_list('value', flat=True).get()
+
+    @classmethod
+    def current(cls, restaurant_id):
+        return cls.objects.filter(restaurant_id=restaurant_id).values_list('value', flat=True).first() or 0
+
+class CardVersion(RestaurantVersion):
+    """Versão das comandas: é o cursor do /api/cards/sync e entra no ETag das comandas"""
+    restaurant = models.OneToOneField(Restaurant, on_delete=models.CASCADE, related_name='card_version')
+
+    class Meta:
+        verbose_name = _('Versão das comandas')
+        verbose_name_plural = _('Versões das comandas')
+
+class MenuVersion(RestaurantVersion):
+    """Versão do cardápio (MenuItem salvo ou apagado): entra no ETag do cardápio e das comandas"""
+    restaurant = models.OneToOneField(Restaurant, on_delete=models.CASCADE, related_name='menu_version')
+
+    class Meta:
+        verbose_name = _('Versão do cardápio')
+        verbose_name_plural = _('Versões do cardápio')
+
+class DeletedCard(models.Model):
+    """Lápide de comanda apagada, para o /api/cards/sync avisar os terminais"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='deleted_cards')
+    card_id = models.PositiveBigIntegerField()
+    version = models.PositiveBigIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['restaurant', 'version']),
+        ]
+        verbose_name = _('Comanda apagada')
+        verbose_name_plural = _('Comandas apagadas')
+
+    def __str__(self):
+        return f"Comanda {self.card_id} apagada (versão {self.version})"
 
 class CardItem(models.Model):
     card = models.ForeignKey(Card, on_delete=models.CASCADE, related_name='card_items')
@@ -210,6 +409,7 @@ class CardItem(models.Model):
         blank=True
     )
     is_ready = models.BooleanField(_('Pronto?'), default=False)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name = _('Item do Cartão')
@@ -233,10 +433,39 @@ class CardItem(models.Model):
 
 
 
+def stock_balance_expression(menu_item_ref):
+    """Saldo de estoque = último snapshot + soma dos movimentos posteriores a ele.
+
+    `menu_item_ref` aponta para o id do item na query externa (ex.: OuterRef('menu_item')).
+    As duas subqueries usam os índices (menu_item, last_movement_id) e (menu_item, id).
+    """
+    decimal_field = models.DecimalField(max_digits=12, decimal_places=2)
+    def latest_snapshot(ref):
+        return StockSnapshot.objects.filter(menu_item=ref).order_by('-last_movement_id')
+
+    # O snapshot dentro da subquery de movimentos se correlaciona com a query externa (OuterRef aninhado)
+    movements = StockMovement.objects.filter(
+        menu_item=menu_item_ref,
+        id__gt=Coalesce(Subquery(latest_snapshot(OuterRef(menu_item_ref)).values('last_movement_id')[:1]), Value(0)),
+    ).order_by().values('menu_item').annotate(total=Sum('quantity')).values('total')
+    snapshot = latest_snapshot(menu_item_ref)
+    return ExpressionWrapper(
+        Coalesce(Subquery(snapshot.values('quantity')[:1]), Value(Decimal('0')), output_field=decimal_field)
+        + Coalesce(Subquery(movements), Value(Decimal('0')), output_field=decimal_field),
+        output_field=decimal_field,
+    )
+
+class StockQuerySet(models.QuerySet):
+    def with_balance(self):
+        """Anota `balance_amount` (saldo atual calculado a partir do livro de movimentos)"""
+        return self.annotate(balance_amount=stock_balance_expression(OuterRef('menu_item')))
+
 class Stock(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='stocks')
     menu_item = models.OneToOneField(MenuItem, on_delete=models.CASCADE, related_name='stock')
-    quantity = models.FloatField(_('Quantidade em estoque'), default=0)
+    quantity = models.FloatField(_('Quantidade na última consolidação'), default=0)
+
+    objects = StockQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('Estoque')
@@ -244,7 +473,62 @@ class Stock(models.Model):
         ordering = ['menu_item__name']
 
     def __str__(self):
-        return f"{self.menu_item.name} - {self.quantity} unidades"
+        return f"{self.menu_item.name} - {self.balance()} unidades"
+
+    def balance(self):
+        """Saldo atual: usa o valor anotado por `with_balance()` quando disponível"""
+        if hasattr(self, 'balance_amount'):
+            return self.balance_amount
+        return MenuItem.objects.filter(pk=self.menu_item_id).annotate(
+            balance_amount=stock_balance_expression(OuterRef('pk'))
+        ).values_list('balance_amount', flat=True).get()
+
+class StockMovement(models.Model):
+    """Livro de movimentos de estoque: só recebe INSERTs (vendas, cancelamentos, entradas, ajustes)"""
+    class Reason(models.TextChoices):
+        SALE = 'SA', _('Venda')
+        SALE_CANCEL = 'SC', _('Cancelamento de venda')
+        ENTRY = 'EN', _('Entrada')
+        ADJUSTMENT = 'AJ', _('Ajuste')
+
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='stock_movements')
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='stock_movements')
+    quantity = models.DecimalField(_('Quantidade'), max_digits=12, decimal_places=2)
+    reason = models.CharField(_('Motivo'), max_length=2, choices=Reason.choices)
+    card_item = models.ForeignKey(CardItem, on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    stock_entry_item = models.ForeignKey('StockEntryItem', on_delete=models.SET_NULL, null=True, blank=True, related_name='stock_movements')
+    notes = models.CharField(_('Observações'), max_length=255, blank=True)
+    created_at = models.DateTimeField(_('Data'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('Movimento de Estoque')
+        verbose_name_plural = _('Movimentos de Estoque')
+        ordering = ['-id']
+        indexes = [
+            models.Index(fields=['menu_item', 'id']),
+        ]
+
+    def __str__(self):
+        return f"{self.menu_item.name} {self.quantity:+} ({self.get_reason_display()})"
+
+class StockSnapshot(models.Model):
+    """Saldo consolidado de um item até o movimento `last_movement_id` (gerado por compactar_estoque)"""
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='stock_snapshots')
+    menu_item = models.ForeignKey(MenuItem, on_delete=models.CASCADE, related_name='stock_snapshots')
+    quantity = models.DecimalField(_('Quantidade'), max_digits=12, decimal_places=2)
+    last_movement_id = models.PositiveBigIntegerField(_('Último movimento consolidado'), default=0)
+    taken_at = models.DateTimeField(_('Consolidado em'), default=timezone.now)
+
+    class Meta:
+        verbose_name = _('Consolidação de Estoque')
+        verbose_name_plural = _('Consolidações de Estoque')
+        ordering = ['-taken_at']
+        indexes = [
+            models.Index(fields=['menu_item', '-last_movement_id']),
+        ]
+
+    def __str__(self):
+        return f"{self.menu_item.name} - {self.quantity} em {self.taken_at:%d/%m/%Y %H:%M}"
 
 class CardPayment(models.Model):
     class PaymentMethod(models.TextChoices):
@@ -267,7 +551,7 @@ class CardPayment(models.Model):
         if not self.restaurant and self.card:
             self.restaurant = self.card.restaurant
         if self.card:
-            self.amount = self.card.total()
+            self.amount = Decimal(self.card.total()).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
         if self.payment_method == self.PaymentMethod.CASH:
             if self.paid_amount is not None:
                 self.change_amount = self.paid_amount - self.amount
@@ -279,6 +563,19 @@ class CardPayment(models.Model):
             self.change_amount = None
         super().save(*args, **kwargs)
 
+    def pix_payload(self):
+        """Payload BR Code do pagamento (None se não for Pix ou o restaurante não tiver chave)"""
+        if self.payment_method != self.PaymentMethod.PIX or not self.restaurant.chave_pix:
+            return None
+        return pix.gerar_payload_pix(
+            chave_pix=self.restaurant.chave_pix,
+            valor=self.amount,
+            #nome_recebedor=self.restaurant.name[:25],  # Máximo 25 caracteres
+            nome_recebedor="ENEAS BEZERRA TELES",
+            cidade=self.restaurant.city,
+            txid=f"CARD{self.card.number:04d}",  # Exemplo: cartão 23 vira "CARD0023"
+        )
+
     def is_paid_today(self):
         return self.payments.filter(paid_at__date=localdate()).exists()
 
@@ -289,10 +586,31 @@ class CardPayment(models.Model):
         verbose_name = _('Recebimento da Comanda')
         verbose_name_plural = _('Recebimento das Comandas')
         ordering = ['-paid_at']
+        indexes = [
+            models.Index(fields=['restaurant', 'paid_at']),
+        ]
 
     def __str__(self):
         return f"R$ {self.amount:.2f} no cartão {self.card.number} id:{self.card.id} via {self.get_payment_method_display()}"
 
+class DailySalesSummary(models.Model):
+    """Totais de recebimento por dia e forma de pagamento, mantidos pelos signals de CardPayment"""
+    restaurant = models.ForeignKey('Restaurant', on_delete=models.CASCADE, related_name='daily_sales')
+    date = models.DateField(_('Data'))
+    payment_method = models.CharField(_('Forma Pagamento'), max_length=2, choices=CardPayment.PaymentMethod.choices)
+    count = models.PositiveIntegerField(_('Quantidade'), default=0)
+    gross_amount = models.DecimalField(_('Valor recebido'), max_digits=12, decimal_places=2, default=0)
+    change_amount = models.DecimalField(_('Troco'), max_digits=12, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = _('Resumo Diário de Vendas')
+        verbose_name_plural = _('Resumos Diários de Vendas')
+        ordering = ['-date', 'payment_method']
+        unique_together = ('restaurant', 'date', 'payment_method')
+
+    def __str__(self):
+        return f"{self.date:%d/%m/%Y} {self.get_payment_method_display()}: R$ {self.gross_amount:.2f} ({self.count})"
+
 class StockEntry(models.Model):
     restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE, related_name='stock_entries')
     created_at = models.DateTimeField(_('Data de Entrada'), auto_now_add=True)
@@ -330,38 +648,178 @@ def gerar_codigo_ao_criar_restaurante(sender, instance, created, **kwargs):
 
 
 
+def publicar_alteracao_comanda(restaurant_id, card_id):
+    """Avisa os terminais conectados em /api/cards/events depois do commit"""
+    transaction.on_commit(lambda: events.publish(restaurant_id, 'card', {'card_id': card_id}))
+
+def marcar_comanda_alterada(restaurant_id, card_id):
+    """Dá à comanda uma versão nova (o /api/cards/sync a envia aos terminais) e publica o evento"""
+    with transaction.atomic():
+        Card.objects.filter(pk=card_id).update(version=CardVersion.bump(restaurant_id), updated_at=timezone.now())
+    publicar_alteracao_comanda(restaurant_id, card_id)
+
+def origem_da_exclusao(origin):
+    """Modelo de onde partiu a exclusão (`origin` do post_delete: instância ou QuerySet).
+
+    Os receivers que gravam algo sobre o restaurante só agem quando a exclusão parte do
+    próprio registro (ou de um pai que continua existindo): numa cascata vinda do Restaurant
+    (ou do User dono) as linhas novas apontariam para um restaurante que está sendo apagado.
+    """
+    if isinstance(origin, models.QuerySet):
+        return origin.model
+    return type(origin)
+
+@receiver(post_save, sender=MenuItem)
+@receiver(post_delete, sender=MenuItem)
+def atualizar_versao_do_cardapio(sender, instance, origin=None, **kwargs):
+    if origin is not None and origem_da_exclusao(origin) is not MenuItem:
+        return  # o restaurante está sendo apagado junto
+    MenuVersion.bump(instance.restaurant_id)  # depois do commit do item: quem vê a versão nova vê o item
+
 @receiver(post_save, sender=CardItem)
-def baixar_estoque_ao_adicionar_item_na_comanda(sender, instance, created, **kwargs):
+@receiver(post_delete, sender=CardItem)
+def atualizar_comanda_ao_alterar_item(sender, instance, origin=None, **kwargs):
+    if origin is not None and origem_da_exclusao(origin) is not CardItem:
+        return  # a comanda (ou o restaurante) está sendo apagada junto
+    marcar_comanda_alterada(instance.card.restaurant_id, instance.card_id)
+
+@receiver(post_delete, sender=Card)
+def registrar_comanda_apagada(sender, instance, origin=None, **kwargs):
+    if origem_da_exclusao(origin) is not Card:
+        return  # o restaurante está sendo apagado: não há terminais a avisar
+    with transaction.atomic():
+        DeletedCard.objects.create(
+            restaurant_id=instance.restaurant_id, card_id=instance.pk, version=CardVersion.bump(instance.restaurant_id)
+        )
+    publicar_alteracao_comanda(instance.restaurant_id, instance.pk)
+
+@receiver(post_save, sender=Card)
+def publicar_comanda_salva(sender, instance, **kwargs):
+    publicar_alteracao_comanda(instance.restaurant_id, instance.pk)
+
+@receiver(post_save, sender=CardPayment)
+def publicar_pagamento_comanda(sender, instance, **kwargs):
+    publicar_alteracao_comanda(instance.restaurant_id, instance.card_id)
+
+@receiver(post_save, sender=CardPayment)
+def agendar_cupom_pdf(sender, instance, created, **kwargs):
+    """O PDF do cupom fica pronto em segundo plano antes de alguém clicar no link"""
     if created:
-        menu_item = instance.menu_item
-        quantidade = instance.quantity
-        try:
-            stock = menu_item.stock
-            print(f"Baixando estoque (CardItem): menu_item={menu_item.name}, stock.quantity={stock.quantity}, quantidade={quantidade}, type={type(quantidade)}")
-            stock.quantity -= float(quantidade)  # Convert Decimal to float
-            stock.save()
-        except Stock.DoesNotExist:
-            print(f"Estoque não existe para {menu_item.name}, criando com quantidade negativa: -{quantidade}")
-            Stock.objects.create(
-                restaurant=menu_item.restaurant,
-                menu_item=menu_item,
-                quantity=-float(quantidade)
+        transaction.on_commit(lambda: cupons.agendar_cupom(instance.pk))
+
+def somar_no_resumo_diario(restaurant_id, dia, payment_method, count, amount, change):
+    """Soma (ou subtrai, com valores negativos) um pagamento no resumo do dia via UPDATE atômico"""
+    chave = {'restaurant_id': restaurant_id, 'date': dia, 'payment_method': payment_method}
+    DailySalesSummary.objects.get_or_create(**chave)
+    DailySalesSummary.objects.filter(**chave).update(
+        count=F('count') + count,
+        gross_amount=F('gross_amount') + (amount or 0),
+        change_amount=F('change_amount') + (change or 0),
+    )
+
+def reconstruir_resumo_diario(restaurant_ids=None, desde=None):
+    """Recalcula o DailySalesSummary a partir dos pagamentos (comando recalcular_resumo_vendas)"""
+    pagamentos = CardPayment.objects.all()
+    resumos = DailySalesSummary.objects.all()
+    if restaurant_ids:
+        pagamentos = pagamentos.filter(restaurant_id__in=restaurant_ids)
+        resumos = resumos.filter(restaurant_id__in=restaurant_ids)
+    if desde:
+        inicio = timezone.make_aware(datetime.combine(desde, time.min))
+        pagamentos = pagamentos.filter(paid_at__gte=inicio)
+        resumos = resumos.filter(date__gte=desde)
+    linhas = pagamentos.annotate(
+        dia=TruncDate('paid_at', tzinfo=timezone.get_current_timezone())
+    ).order_by().values('restaurant_id', 'dia', 'payment_method').annotate(
+        quantidade=Count('id'), total=Sum('amount'), troco=Sum('change_amount'),
+    )
+    with transaction.atomic():
+        resumos.delete()
+        return len(DailySalesSummary.objects.bulk_create([
+            DailySalesSummary(
+                restaurant_id=linha['restaurant_id'],
+                date=linha['dia'],
+                payment_method=linha['payment_method'],
+                count=linha['quantidade'],
+                gross_amount=linha['total'] or 0,
+                change_amount=linha['troco'] or 0,
             )
+            for linha in linhas
+        ]))
+
+@receiver(pre_save, sender=CardPayment)
+def guardar_pagamento_anterior(sender, instance, **kwargs):
+    """Na edição, guarda os valores já somados no resumo para estorná-los no post_save"""
+    instance._resumo_anterior = None
+    if instance.pk:
+        instance._resumo_anterior = CardPayment.objects.filter(pk=instance.pk).values(
+            'restaurant_id', 'paid_at', 'payment_method', 'amount', 'change_amount'
+        ).first()
+
+@receiver(post_save, sender=CardPayment)
+def atualizar_resumo_diario_ao_salvar_pagamento(sender, instance, **kwargs):
+    anterior = getattr(instance, '_resumo_anterior', None)
+    if anterior:
+        somar_no_resumo_diario(
+            anterior['restaurant_id'], timezone.localdate(anterior['paid_at']), anterior['payment_method'],
+            -1, -(anterior['amount'] or 0), -(anterior['change_amount'] or 0),
+        )
+    somar_no_resumo_diario(
+        instance.restaurant_id, timezone.localdate(instance.paid_at), instance.payment_method,
+        1, instance.amount, instance.change_amount,
+    )
+
+@receiver(post_delete, sender=CardPayment)
+def atualizar_resumo_diario_ao_excluir_pagamento(sender, instance, origin=None, **kwargs):
+    if origem_da_exclusao(origin) not in (CardPayment, Card):
+        return  # cascata do restaurante: o resumo dele também está sendo apagado
+    somar_no_resumo_diario(
+        instance.restaurant_id, timezone.localdate(instance.paid_at), instance.payment_method,
+        -1, -(instance.amount or 0), -(instance.change_amount or 0),
+    )
+
+def registrar_movimento_estoque(menu_item, quantity, reason, **origem):
+    """Acrescenta um movimento ao livro de estoque: um único INSERT, sem tocar na linha do Stock
+    (o compactar_estoque cria o Stock dos itens novos)"""
+    return StockMovement.objects.create(
+        restaurant_id=menu_item.restaurant_id,
+        menu_item=menu_item,
+        quantity=quantity,
+        reason=reason,
+        **origem
+    )
+
+def baixar_estoque_em_lote(card_items):
+    """Equivalente ao signal de venda para itens criados com bulk_create: 1 INSERT para o lote todo"""
+    StockMovement.objects.bulk_create([
+        StockMovement(
+            restaurant_id=item.menu_item.restaurant_id,
+            menu_item_id=item.menu_item_id,
+            quantity=-item.quantity,
+            reason=StockMovement.Reason.SALE,
+            card_item=item,
+        )
+        for item in card_items
+    ])
+
+@receiver(post_save, sender=CardItem)
+def baixar_estoque_ao_adicionar_item_na_comanda(sender, instance, created, **kwargs):
+    if created:
+        print(f"Baixando estoque (CardItem): menu_item_id={instance.menu_item_id}, quantidade={instance.quantity}")
+        registrar_movimento_estoque(instance.menu_item, -instance.quantity, StockMovement.Reason.SALE, card_item=instance)
+
+@receiver(post_delete, sender=CardItem)
+def estornar_estoque_ao_remover_item_da_comanda(sender, instance, origin=None, **kwargs):
+    if origem_da_exclusao(origin) not in (CardItem, Card):
+        return  # cascata do restaurante: item e cardápio também estão sendo apagados
+    print(f"Estornando estoque (CardItem): menu_item_id={instance.menu_item_id}, quantidade={instance.quantity}")
+    registrar_movimento_estoque(
+        instance.menu_item, instance.quantity, StockMovement.Reason.SALE_CANCEL,
+        notes=f"Item removido da comanda {instance.card_id}"
+    )
 
 @receiver(post_save, sender=StockEntryItem)
 def atualizar_estoque_entrada(sender, instance, created, **kwargs):
     if created:
-        menu_item = instance.menu_item
-        quantidade = instance.quantity
-        try:
-            stock = menu_item.stock
-            print(f"Atualizando estoque (StockEntryItem): menu_item={menu_item.name}, stock.quantity={stock.quantity}, quantidade={quantidade}")
-            stock.quantity += quantidade
-            stock.save()
-        except Stock.DoesNotExist:
-            print(f"Estoque não existe para {menu_item.name}, criando com quantidade: {quantidade}")
-            Stock.objects.create(
-                restaurant=menu_item.restaurant,
-                menu_item=menu_item,
-                quantity=quantidade
-            )
\ No newline at end of file
+        print(f"Atualizando estoque (StockEntryItem): menu_item_id={instance.menu_item_id}, quantidade={instance.quantity}")
+        registrar_movimento_estoque(instance.menu_item, instance.quantity, StockMovement.Reason.ENTRY, stock_entry_item=instance)
@@ -0,0 +1,107 @@
+# restaurants/pix.py
+"""Pix (BR Code) compartilhado pelo admin, pela view /pix/<id>.png e pelo caixa.py.
+
+Não depende do Django. Payload e PNG ficam num LRU em memória: o QR Code de um
+pagamento é gerado uma única vez por processo, não a cada abertura da página.
+"""
+import unicodedata
+from functools import lru_cache
+from io import BytesIO
+
+import qrcode
+
+GUI_PIX = "BR.GOV.BCB.PIX"
+TXID_PADRAO = "***"  # BR Code sem identificador de transação
+
+
+def _tabela_crc16(polinomio=0x1021):
+    tabela = []
+    for byte in range(256):
+        crc = byte << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ polinomio) if crc & 0x8000 else (crc << 1)
+        tabela.append(crc & 0xFFFF)
+    return tuple(tabela)
+
+
+_TABELA_CRC16 = _tabela_crc16()
+
+
+def calcular_crc16(payload):
+    """CRC16-CCITT (polinômio 0x1021, início 0xFFFF) do BR Code, por tabela: um passo por byte"""
+    crc = 0xFFFF
+    for byte in payload.encode('utf-8'):
+        crc = ((crc << 8) & 0xFFFF) ^ _TABELA_CRC16[(crc >> 8) ^ byte]
+    return f"{crc:04X}"
+
+
+def tlv(id_campo, valor):
+    """Campo EMV ID + tamanho (2 dígitos) + valor; ValueError se vazio, com mais de 99 caracteres ou não ASCII.
+
+    O tamanho conta caracteres e o CRC percorre os bytes UTF-8: só com ASCII os dois batem.
+    """
+    valor = str(valor)
+    if not valor.isascii():
+        raise ValueError(f"Campo {id_campo} do Pix com caracteres fora do ASCII: {valor!r}")
+    if not 0 < len(valor) <= 99:
+        raise ValueError(f"Campo {id_campo} do Pix com tamanho inválido ({len(valor)}): {valor!r}")
+    return f"{id_campo}{len(valor):02d}{valor}"
+
+
+def sem_acentos(texto):
+    """'São Paulo' -> 'Sao Paulo'; descarta o que não tiver equivalente ASCII"""
+    return unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+
+
+def _validar(nome, valor, maximo):
+    if not valor or len(valor) > maximo:
+        raise ValueError(f"{nome} do Pix deve ter de 1 a {maximo} caracteres: {valor!r}")
+
+
+@lru_cache(maxsize=1024)
+def _payload(chave_pix, valor_str, nome_recebedor, cidade, txid):
+    _validar("Chave", chave_pix, 77)
+    _validar("Valor", valor_str, 13)
+    _validar("Nome do recebedor", nome_recebedor, 25)
+    _validar("Cidade", cidade, 15)
+    if txid != TXID_PADRAO and not (txid.isascii() and txid.isalnum()):
+        raise ValueError(f"txid do Pix deve ser alfanumérico: {txid!r}")
+    payload_sem_crc = (
+        tlv("00", "01")
+        + tlv("26", tlv("00", GUI_PIX) + tlv("01", chave_pix))
+        + tlv("52", "0000")
+        + tlv("53", "986")
+        + tlv("54", valor_str)
+        + tlv("58", "BR")
+        + tlv("59", nome_recebedor)
+        + tlv("60", cidade)
+        + tlv("62", tlv("05", txid))
+        + "6304"
+    )
+    return payload_sem_crc + calcular_crc16(payload_sem_crc)
+
+
+def gerar_payload_pix(chave_pix: str, valor, nome_recebedor: str, cidade: str, txid: str = None) -> str:
+    """Payload "copia e cola"; valor em float ou Decimal, nome e cidade sem acentos e cortados no limite do padrão.
+
+    Levanta ValueError se algum campo ficar fora dos limites do BR Code.
+    """
+    return _payload(
+        chave_pix, f"{valor:.2f}", sem_acentos(nome_recebedor)[:25], sem_acentos(cidade)[:15],
+        (txid or TXID_PADRAO)[:25],
+    )
+
+
+@lru_cache(maxsize=256)
+def qrcode_png(payload: str) -> bytes:
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    buffer = BytesIO()
+    qr.make_image(fill_color="black", back_color="white").save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def gerar_qrcode_pix(chave_pix: str, valor, nome_recebedor: str, cidade: str, txid: str = None) -> bytes:
+    """PNG do QR Code Pix (mesmos parâmetros de gerar_payload_pix)"""
+    return qrcode_png(gerar_payload_pix(chave_pix, valor, nome_recebedor, cidade, txid))
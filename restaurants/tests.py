@@ -1,3 +1,492 @@
-from django.test import TestCase
+import asyncio
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.core.management import call_command
+from django.db import close_old_connections, connection
+from django.db.models import Count, Sum
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils.timezone import make_aware
+
+from restaurants import cupons, escpos, events, pix
+from restaurants.cupons import Cupom, ItemCupom
+from restaurants.models import (
+    Card, CardItem, CardPayment, DailySalesSummary, MenuItem, PhysicalCard, Restaurant, Stock, StockMovement,
+    estornar_estoque_ao_remover_item_da_comanda, registrar_movimento_estoque,
+)
+
+
+def criar_restaurante(slug='r'):
+    dono = get_user_model().objects.create_user(f'dono-{slug}', password='x')
+    return Restaurant.objects.create(owner=dono, name=slug.upper(), slug=slug, address='Rua A', phone='1', email='r@r.com')
+
+
+def saldo(menu_item):
+    return Stock(menu_item=menu_item).balance()
+
+
+def em_paralelo(funcao, threads):
+    """Roda `funcao` em várias threads, cada uma com sua conexão, e devolve as exceções"""
+    erros = []
+
+    def alvo():
+        try:
+            funcao()
+        except Exception as erro:
+            erros.append(erro)
+        finally:
+            close_old_connections()
+
+    trabalhadores = [threading.Thread(target=alvo) for _ in range(threads)]
+    for trabalhador in trabalhadores:
+        trabalhador.start()
+    for trabalhador in trabalhadores:
+        trabalhador.join()
+    return erros
+
+
+class EstoqueConcorrenteTests(TransactionTestCase):
+    def test_movimentos_simultaneos_no_mesmo_item_fecham_o_saldo(self):
+        restaurante = criar_restaurante()
+        prato = MenuItem.objects.create(restaurant=restaurante, name='Prato', price=Decimal('10'))
+        registrar_movimento_estoque(prato, Decimal('1000'), StockMovement.Reason.ENTRY)
+
+        def vender():
+            for _ in range(25):
+                registrar_movimento_estoque(prato, Decimal('-1.5'), StockMovement.Reason.SALE)
+
+        self.assertEqual(em_paralelo(vender, 8), [])
+        self.assertEqual(StockMovement.objects.filter(menu_item=prato).count(), 1 + 8 * 25)
+        self.assertEqual(saldo(prato), Decimal('1000') - 8 * 25 * Decimal('1.5'))
+
+
+class LivroDeEstoqueTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+        cls.prato = MenuItem.objects.create(restaurant=cls.restaurante, name='Prato', price=Decimal('10'))
+
+    def vender(self, quantidade=Decimal('2')):
+        card = Card.objects.create(restaurant=self.restaurante, number=Card.objects.count() + 1)
+        return CardItem.objects.create(card=card, menu_item=self.prato, price=self.prato.price, quantity=quantidade)
+
+    def test_movimento_e_so_um_insert_no_livro(self):
+        with self.assertNumQueries(1):
+            registrar_movimento_estoque(self.prato, Decimal('-1'), StockMovement.Reason.SALE)
+        self.assertFalse(Stock.objects.exists())
+        self.assertEqual(saldo(self.prato), Decimal('-1'))
+
+    def test_compactacao_cria_o_stock_e_mantem_o_saldo(self):
+        registrar_movimento_estoque(self.prato, Decimal('10'), StockMovement.Reason.ENTRY)
+        self.vender()
+        call_command('compactar_estoque', minutos=0, stdout=StringIO())
+        stock = Stock.objects.with_balance().get(menu_item=self.prato)
+        self.assertEqual(stock.restaurant, self.restaurante)
+        self.assertEqual(stock.balance(), Decimal('8'))
+        self.assertEqual(stock.quantity, 8)
+
+    def test_remover_item_ou_comanda_estorna(self):
+        self.vender().delete()
+        self.vender().card.delete()
+        self.assertEqual(saldo(self.prato), Decimal('0'))
+
+    def test_cascata_do_restaurante_nao_estorna(self):
+        """CardItem.menu_item é PROTECT, mas se a cascata chegar aos itens nada é gravado no livro"""
+        item = self.vender()
+        estornar_estoque_ao_remover_item_da_comanda(CardItem, item, origin=self.restaurante)
+        estornar_estoque_ao_remover_item_da_comanda(CardItem, item, origin=Restaurant.objects.all())
+        self.assertEqual(StockMovement.objects.count(), 1)
+
+
+class AberturaConcorrenteTests(TransactionTestCase):
+    def test_terminais_abrindo_ao_mesmo_tempo_recebem_numeros_distintos(self):
+        restaurante = criar_restaurante()
+        PhysicalCard.objects.bulk_create(PhysicalCard(restaurant=restaurante, number=n) for n in range(1, 51))
+        numeros = []
+
+        def abrir():
+            for _ in range(25):
+                numeros.append(Card.open(restaurante).number)
+
+        self.assertEqual(em_paralelo(abrir, 8), [])
+        self.assertEqual(sorted(numeros), list(range(1, 201)))  # 50 físicas e depois a sequência
+        self.assertEqual(Card.objects.filter(is_active=True).count(), 200)
+
+
+class AberturaDeComandaTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+        cls.dono = cls.restaurante.owner
+        cls.dono.is_staff = True
+        cls.dono.save()
+        cls.dono.user_permissions.set(Permission.objects.filter(content_type__model='card'))
+
+    def test_comanda_fisica_paga_volta_para_o_pool(self):
+        PhysicalCard.objects.bulk_create(PhysicalCard(restaurant=self.restaurante, number=n) for n in (7, 8))
+        primeira, segunda = Card.open(self.restaurante), Card.open(self.restaurante)
+        self.assertEqual((primeira.number, segunda.number), (7, 8))
+        self.assertEqual(Card.open(self.restaurante).number, 9)  # todas em uso: segue a sequência
+        primeira.is_active = False
+        primeira.save()
+        self.assertEqual(Card.open(self.restaurante).number, 7)
+
+    def formulario_do_admin(self, card=None, **dados):
+        request = RequestFactory().post('/admin/restaurants/card/')
+        request.user = self.dono
+        model_admin = admin.site._registry[Card]
+        form = model_admin.get_form(request, card, change=card is not None)(data=dados, instance=card)
+        return request, model_admin, form
+
+    def test_admin_numera_a_comanda_nova_pela_sequencia(self):
+        Card.open(self.restaurante)
+        request, model_admin, form = self.formulario_do_admin(is_active='on', number='1')
+        self.assertNotIn('number', form.fields)
+        self.assertTrue(form.is_valid(), form.errors)
+        card = form.save(commit=False)
+        model_admin.save_model(request, card, form, change=False)
+        self.assertEqual((card.restaurant, card.number), (self.restaurante, 2))
+
+    def test_admin_recusa_numero_de_outra_comanda_aberta(self):
+        aberta, outra = Card.open(self.restaurante), Card.open(self.restaurante)
+        _, _, form = self.formulario_do_admin(outra, is_active='on', number=str(aberta.number))
+        self.assertNotIn('restaurant', form.fields)
+        self.assertFalse(form.is_valid())
+        self.assertIn('already an open card', str(form.errors))
+
+
+class ResumoDiarioTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+
+    def pagar(self, numero):
+        card = Card.objects.create(restaurant=self.restaurante, number=numero)
+        return CardPayment.objects.create(
+            restaurant=self.restaurante, card=card, payment_method=CardPayment.PaymentMethod.CASH
+        )
+
+    def test_apagar_comanda_estorna_o_pagamento_do_resumo(self):
+        self.pagar(1)
+        self.pagar(2).card.delete()
+        self.assertEqual(DailySalesSummary.objects.get().count, 1)
+
+    def test_apagar_restaurante_nao_grava_no_resumo_em_cascata(self):
+        self.pagar(1)
+        Restaurant.objects.get(pk=self.restaurante.pk).delete()
+        connection.check_constraints()
+        self.assertFalse(DailySalesSummary.objects.exists())
+
+
+class EventosTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+        cls.prato = MenuItem.objects.create(restaurant=cls.restaurante, name='Prato', price=Decimal('10'))
+
+    def conectar(self, restaurant_id):
+        stream = events.stream_sync(restaurant_id)
+        self.addCleanup(stream.close)
+        self.assertEqual(next(stream), 'retry: 3000\n\n')  # já inscrito no broker
+        return stream
+
+    def test_publicacao_chega_a_todas_as_conexoes_do_restaurante(self):
+        primeira, segunda = self.conectar(1), self.conectar(1)
+        outro = self.conectar(2)
+        events.publish(1, 'card', {'card_id': 7})
+        mensagem = 'event: card\ndata: {"card_id": 7}\n\n'
+        self.assertEqual(next(primeira), mensagem)
+        self.assertEqual(next(segunda), mensagem)
+        with mock.patch.object(events, 'KEEPALIVE_SECONDS', 0.01):
+            self.assertEqual(next(outro), ': keepalive\n\n')
+            self.assertEqual(next(primeira), ': keepalive\n\n')
+
+    def test_conexao_encerrada_sai_do_broker(self):
+        self.conectar(1).close()
+        self.assertNotIn(1, events._subscribers)
+        events.publish(1, 'card', {'card_id': 7})  # sem assinantes: não falha
+
+    def test_stream_assincrono_recebe_publicacao_de_outra_thread(self):
+        async def ler():
+            stream = events.stream_async(1)
+            try:
+                self.assertEqual(await anext(stream), 'retry: 3000\n\n')
+                threading.Thread(target=events.publish, args=(1, 'card', {'card_id': 3})).start()
+                return await asyncio.wait_for(anext(stream), 5)
+            finally:
+                await stream.aclose()
+
+        self.assertEqual(asyncio.run(ler()), 'event: card\ndata: {"card_id": 3}\n\n')
+        self.assertNotIn(1, events._subscribers)
+
+    def test_item_da_comanda_publica_so_depois_do_commit(self):
+        card = Card.objects.create(restaurant=self.restaurante, number=1)
+        stream = self.conectar(self.restaurante.pk)
+        with mock.patch.object(events, 'publish', wraps=events.publish) as publish:
+            with self.captureOnCommitCallbacks(execute=True):
+                CardItem.objects.create(card=card, menu_item=self.prato, price=self.prato.price, quantity=Decimal('1'))
+                publish.assert_not_called()
+        publish.assert_called_once_with(self.restaurante.pk, 'card', {'card_id': card.pk})
+        self.assertEqual(next(stream), f'event: card\ndata: {{"card_id": {card.pk}}}\n\n')
+
+
+class RelatorioRecebimentosTests(TestCase):
+    """Totais do relatório (lidos do DailySalesSummary) contra a soma direta dos CardPayment"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+        cls.outro = criar_restaurante('outro')
+        cls.dia1, cls.dia2 = date(2026, 3, 9), date(2026, 3, 10)
+        metodo = CardPayment.PaymentMethod
+        cls.pagar(cls.restaurante, metodo.CASH, datetime(2026, 3, 9, 0, 0), '10.50')
+        cls.pagar(cls.restaurante, metodo.CASH, datetime(2026, 3, 9, 12, 15), '7.25')
+        cls.pagar(cls.restaurante, metodo.PIX, datetime(2026, 3, 9, 23, 59, 59), '30.00')
+        cls.pagar(cls.restaurante, metodo.CREDIT, datetime(2026, 3, 10, 0, 0), '99.90')
+        cls.pagar(cls.restaurante, metodo.PIX, datetime(2026, 3, 10, 20, 0), '4.10')
+        cls.pagar(cls.outro, metodo.CASH, datetime(2026, 3, 9, 12, 0), '1000.00')
+
+    @classmethod
+    def pagar(cls, restaurante, metodo, quando, valor):
+        prato = MenuItem.objects.create(restaurant=restaurante, name=f'Prato {valor}', price=Decimal(valor))
+        numero = Card.objects.filter(restaurant=restaurante).count() + 1
+        card = Card.objects.create(restaurant=restaurante, number=numero)
+        CardItem.objects.create(card=card, menu_item=prato, price=prato.price, quantity=Decimal('1'))
+        pagamento = CardPayment.objects.create(restaurant=restaurante, card=card, payment_method=metodo)
+        pagamento.paid_at = make_aware(quando)  # o resumo acompanha a mudança de dia (signals)
+        pagamento.save()
+
+    def setUp(self):
+        self.client.force_login(self.restaurante.owner)
+
+    def relatorio(self, **params):
+        response = self.client.get(reverse('restaurants:relatorio-recebimentos'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def pagamentos_do_dia(self, dia):
+        inicio = make_aware(datetime.combine(dia, datetime.min.time()))
+        return CardPayment.objects.filter(
+            restaurant=self.restaurante, paid_at__gte=inicio, paid_at__lt=inicio + timedelta(days=1)
+        )
+
+    def somas_diretas(self, pagamentos):
+        nomes = dict(CardPayment.PaymentMethod.choices)
+        linhas = pagamentos.order_by().values('payment_method').annotate(total=Sum('amount'), quantidade=Count('id'))
+        return (
+            {nomes[linha['payment_method']]: linha['total'] for linha in linhas},
+            {nomes[linha['payment_method']]: linha['quantidade'] for linha in linhas},
+        )
+
+    def test_totais_do_resumo_batem_com_os_pagamentos(self):
+        for dia in (self.dia1, self.dia2):
+            with self.subTest(dia=dia):
+                contexto = self.relatorio(data=dia.isoformat())
+                totais, quantidades = self.somas_diretas(self.pagamentos_do_dia(dia))
+                self.assertEqual(contexto['totais'], totais)
+                self.assertEqual(contexto['quantidades'], quantidades)
+                self.assertEqual(contexto['total_geral'], sum(totais.values()))
+        self.assertEqual(self.relatorio(data=self.dia1.isoformat())['totais'], {
+            'Dinheiro': Decimal('17.75'), 'Pix': Decimal('30.00'),
+        })
+
+    def test_data_invalida_mostra_todos_os_dias(self):
+        contexto = self.relatorio(data='ontem')
+        totais, quantidades = self.somas_diretas(CardPayment.objects.filter(restaurant=self.restaurante))
+        self.assertEqual(contexto['totais'], totais)
+        self.assertEqual(contexto['quantidades'], quantidades)
+        self.assertEqual(contexto['pagina'].paginator.count, 5)
+
+    def test_filtro_por_data_e_paginacao(self):
+        do_dia = self.pagamentos_do_dia(self.dia1).order_by('payment_method', '-paid_at')
+        esperados = list(do_dia.values_list('pk', flat=True))
+        self.assertEqual(len(esperados), 3)  # 00:00 e 23:59:59 entram; 00:00 do dia seguinte não
+        with mock.patch('restaurants.views.PAGAMENTOS_POR_PAGINA', 2):
+            primeira = self.relatorio(data=self.dia1.isoformat())['pagina']
+            segunda = self.relatorio(data=self.dia1.isoformat(), pagina=2)['pagina']
+            alem_do_fim = self.relatorio(data=self.dia1.isoformat(), pagina=9)['pagina']
+        self.assertEqual(primeira.paginator.num_pages, 2)
+        self.assertEqual([p.pk for p in primeira] + [p.pk for p in segunda], esperados)
+        self.assertEqual(alem_do_fim.number, 2)
+
+
+# Exemplo do Manual de Padrões para Iniciação do Pix (BCB): chave aleatória, sem valor
+BR_CODE_BCB = (
+    "00020126580014br.gov.bcb.pix0136123e4567-e12b-12d1-a456-426655440000"
+    "5204000053039865802BR5913Fulano de Tal6008BRASILIA62070503***63041D3D"
+)
+
+
+class PixTests(SimpleTestCase):
+    def test_crc16_vetores_conhecidos(self):
+        self.assertEqual(pix.calcular_crc16("123456789"), "29B1")  # CRC-16/CCITT-FALSE
+        self.assertEqual(pix.calcular_crc16(BR_CODE_BCB[:-4]), "1D3D")
+
+    def test_tlv_monta_o_exemplo_do_bcb(self):
+        payload = (
+            pix.tlv("00", "01")
+            + pix.tlv("26", pix.tlv("00", "br.gov.bcb.pix") + pix.tlv("01", "123e4567-e12b-12d1-a456-426655440000"))
+            + pix.tlv("52", "0000") + pix.tlv("53", "986") + pix.tlv("58", "BR")
+            + pix.tlv("59", "Fulano de Tal") + pix.tlv("60", "BRASILIA") + pix.tlv("62", pix.tlv("05", "***"))
+            + "6304"
+        )
+        self.assertEqual(payload + pix.calcular_crc16(payload), BR_CODE_BCB)
+
+    def test_tlv_limites(self):
+        self.assertEqual(pix.tlv("05", "x" * 99), "0599" + "x" * 99)
+        for invalido in ("", "x" * 100, "São Paulo"):
+            with self.assertRaises(ValueError):
+                pix.tlv("60", invalido)
+
+    def test_payload_sem_acentos_tem_tamanhos_certos(self):
+        payload = pix.gerar_payload_pix("chave@exemplo.com", 10, "José Açaí", "São Paulo", "CARD0001")
+        self.assertIn("5909Jose Acai", payload)
+        self.assertIn("6009Sao Paulo", payload)
+        self.assertIn("540510.00", payload)
+        self.assertEqual(pix.calcular_crc16(payload[:-4]), payload[-4:])
+
+    def test_campos_fora_do_padrao(self):
+        with self.assertRaises(ValueError):
+            pix.gerar_payload_pix("", 10, "Nome", "Cidade")
+        with self.assertRaises(ValueError):
+            pix.gerar_payload_pix("chave", 10, "Nome", "Cidade", "CARD-01")
+
+
+def cupom_de_exemplo(**extra):
+    dados = dict(
+        pagamento_id=42, restaurante='Açaí da Praça', comanda=7, pago_em=datetime(2026, 1, 2, 12, 30),
+        forma_pagamento='Dinheiro', valor=Decimal('21.00'), valor_recebido=Decimal('50.00'), troco=Decimal('29.00'),
+        itens=[ItemCupom('Prato', Decimal('2'), Decimal('10.50'), Decimal('21.00'))],
+    )
+    return Cupom(**{**dados, **extra})
+
+
+class CupomPdfTests(TestCase):
+    """Cache dos PDFs em disco com o WeasyPrint (_gravar_pdf) simulado e o pool em threads"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.restaurante = criar_restaurante()
+        prato = MenuItem.objects.create(restaurant=cls.restaurante, name='Prato', price=Decimal('10'))
+        card = Card.objects.create(restaurant=cls.restaurante, number=1)
+        CardItem.objects.create(card=card, menu_item=prato, price=prato.price, quantity=Decimal('2'))
+        cls.pagamento = CardPayment.objects.create(
+            restaurant=cls.restaurante, card=card, payment_method=CardPayment.PaymentMethod.CASH
+        )
+
+    def setUp(self):
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, ignore_errors=True)
+        self.enterContext(override_settings(CUPOM_PDF_DIR=pasta))
+        self.pasta = Path(pasta)
+        self.gravar = self.enterContext(mock.patch.object(cupons, '_gravar_pdf', side_effect=self.gravar_pdf))
+        self.pool = ThreadPoolExecutor(1)
+        self.addCleanup(self.pool.shutdown)
+        self.enterContext(mock.patch.object(cupons, '_get_pool', return_value=self.pool))
+        self.liberar = threading.Event()
+        self.liberar.set()
+
+    def gravar_pdf(self, html, caminho):
+        self.liberar.wait(5)
+        Path(caminho).parent.mkdir(parents=True, exist_ok=True)
+        Path(caminho).write_bytes(b'%PDF')
+        return str(caminho)
+
+    def cupom(self):
+        return cupons.carregar_cupom(pk=self.pagamento.pk)
+
+    def pdfs(self):
+        return sorted(caminho.name for caminho in self.pasta.rglob('*.pdf'))
+
+    def test_mesmo_cupom_e_renderizado_uma_vez(self):
+        caminho = cupons.obter_cupom_pdf(self.cupom())
+        self.assertEqual(cupons.obter_cupom_pdf(self.cupom()), caminho)
+        self.assertEqual(self.gravar.call_count, 1)
+        self.assertTrue(caminho.name.startswith(f'{self.pagamento.pk}-'))
+
+    def test_view_usa_o_pdf_agendado(self):
+        cupons.agendar_cupom(self.pagamento.pk)
+        self.pool.shutdown()
+        cupons.obter_cupom_pdf(self.cupom())
+        self.assertEqual(self.gravar.call_count, 1)
+
+    def test_view_espera_o_pdf_que_o_pool_esta_gerando(self):
+        self.liberar.clear()
+        cupons.agendar_cupom(self.pagamento.pk)
+        threading.Timer(0.2, self.liberar.set).start()
+        caminho = cupons.obter_cupom_pdf(self.cupom())
+        self.assertTrue(caminho.exists())
+        self.assertEqual(self.gravar.call_count, 1)
+
+    def test_nfce_assinada_reagenda_e_apaga_a_versao_anterior(self):
+        from fiscal.models import NotaFiscal
+
+        cupons.agendar_cupom(self.pagamento.pk)
+        sem_nfce = cupons.obter_cupom_pdf(self.cupom())
+        with self.captureOnCommitCallbacks(execute=True):
+            NotaFiscal.objects.create(
+                restaurant=self.restaurante, card_payment=self.pagamento, numero=1, chave='2' * 44,
+                qrcode_url='https://nfceh.sefaz.ce.gov.br/pages/ShowNFCe.html?p=2|2|2|1|ABC',
+                status=NotaFiscal.Status.ASSINADA,
+            )
+        self.pool.shutdown()
+        self.assertEqual(self.gravar.call_count, 2)
+        com_nfce = cupons.obter_cupom_pdf(self.cupom())
+        self.assertNotEqual(com_nfce, sem_nfce)
+        self.assertEqual(self.gravar.call_count, 2)  # o clique depois da assinatura já acha o PDF pronto
+        self.assertEqual(self.pdfs(), [com_nfce.name])
+
+
+class EscposTests(SimpleTestCase):
+    def test_sequencias_de_controle(self):
+        url = 'https://nfceh.sefaz.ce.gov.br/pages/consultaNota.jsf?p=2326|2|2|1|ABC'
+        dados = escpos.gerar_cupom_escpos(cupom_de_exemplo(nfce_chave='2' * 44, nfce_qrcode=url))
+        self.assertTrue(dados.startswith(b'\x1b@' + b'\x1bt\x03'))  # inicializa e seleciona a PC860
+        self.assertTrue(dados.endswith(b'\x1dVB\x03'))  # avança e corta
+        tamanho = len(url) + 3
+        self.assertIn(b'\x1d(k' + bytes([tamanho % 256, tamanho // 256]) + b'1P0' + url.encode(), dados)
+        self.assertIn(b'\x1d(k\x03\x001Q0', dados)  # imprime o QR armazenado
+        self.assertIn('Açaí da Praça'.encode('cp860'), dados)
+        self.assertIn(b'TOTAL', dados)
+
+    def test_sem_nfce_nao_tem_qrcode(self):
+        dados = escpos.gerar_cupom_escpos(cupom_de_exemplo())
+        self.assertNotIn(b'\x1d(k', dados)
+        texto = escpos.gerar_cupom_texto(cupom_de_exemplo())
+        self.assertIn('Troco', texto)
+        self.assertTrue(all(len(linha) <= escpos.LARGURA_PADRAO for linha in texto.splitlines()))
+
+    def test_spooler_grava_os_trabalhos_em_ordem_no_arquivo(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            impressora = os.path.join(pasta, 'impressora.bin')
+            spooler = escpos.Spooler(impressora)
+            primeiro = escpos.gerar_cupom_escpos(cupom_de_exemplo())
+            segundo = escpos.gerar_cupom_escpos(cupom_de_exemplo(pagamento_id=43))
+            spooler.imprimir(primeiro)
+            spooler.imprimir(segundo)
+            spooler.aguardar()
+            with open(impressora, 'rb') as arquivo:
+                self.assertEqual(arquivo.read(), primeiro + segundo)
+
+    def test_falha_na_impressora_e_registrada_e_a_fila_continua(self):
+        with tempfile.TemporaryDirectory() as pasta:
+            spooler = escpos.Spooler(pasta)  # um diretório não pode ser aberto para escrita
+            with self.assertLogs('restaurants.escpos', 'ERROR') as logs:
+                spooler.imprimir(b'x')
+                spooler.aguardar()
+            self.assertIn(pasta, logs.output[0])
+            spooler.imprimir(b'y')
+            with self.assertLogs('restaurants.escpos', 'ERROR'):
+                spooler.aguardar()
@@ -3,7 +3,7 @@ from django.contrib.auth.mixins import LoginRequiredMixin
 from django.urls import reverse_lazy
 from django.shortcuts import get_object_or_404
 from django.contrib import messages
-from .models import Restaurant, Category, MenuItem, CardPayment
+from .models import Restaurant, Category, MenuItem, CardPayment, DailySalesSummary
 from .forms import RestaurantForm, MenuItemForm, CustomerForm
 from django.contrib.auth import views as auth_views
 
@@ -74,43 +74,55 @@ class MenuItemCreateView(LoginRequiredMixin, CreateView):
 
  # ajuste o import conforme seu app
 
-from collections import defaultdict
+from django.core.paginator import Paginator
+from django.db.models import Sum
+from django.utils.timezone import localdate, make_aware
+from datetime import datetime, time, timedelta
 
-from django.utils.timezone import localdate
-from datetime import datetime
+PAGAMENTOS_POR_PAGINA = 50
 
 def relatorio_recebimentos(request):
     data_filtro = request.GET.get('data')  # pega a data da URL se existir
 
     # Busca apenas pagamentos do dono logado
-    pagamentos = CardPayment.objects.select_related('restaurant', 'card').filter(
-        restaurant__owner=request.user
-    ).order_by('payment_method', '-paid_at')
-
+    pagamentos = CardPayment.objects.filter(restaurant__owner=request.user)
 
     if data_filtro:
         try:
             data = datetime.strptime(data_filtro, '%Y-%m-%d').date()
-            pagamentos = pagamentos.filter(paid_at__date=data)
         except ValueError:
             data = None
     else:
         data = localdate()
-        pagamentos = pagamentos.filter(paid_at__date=data)
-
-    agrupado = defaultdict(list)
-    totais = defaultdict(float)
-    total_geral = 0
 
-    for pagamento in pagamentos:
-        agrupado[pagamento.get_payment_method_display()].append(pagamento)
-        totais[pagamento.get_payment_method_display()] += float(pagamento.amount)
-        total_geral += float(pagamento.amount)
+    if data:
+        # Intervalo [00:00, 00:00 do dia seguinte) para usar o índice (restaurant, paid_at)
+        inicio = make_aware(datetime.combine(data, time.min))
+        pagamentos = pagamentos.filter(paid_at__gte=inicio, paid_at__lt=inicio + timedelta(days=1))
+
+    # Totais lidos do resumo diário (poucas linhas), uma por forma de pagamento
+    resumo = DailySalesSummary.objects.filter(restaurant__owner=request.user)
+    if data:
+        resumo = resumo.filter(date=data)
+    nomes = dict(CardPayment.PaymentMethod.choices)
+    resumo = resumo.order_by('payment_method').values('payment_method').annotate(
+        total=Sum('gross_amount'), quantidade=Sum('count')
+    ).filter(quantidade__gt=0)
+    totais = {nomes.get(linha['payment_method'], linha['payment_method']): linha['total'] for linha in resumo}
+    quantidades = {nomes.get(linha['payment_method'], linha['payment_method']): linha['quantidade'] for linha in resumo}
+    total_geral = sum(totais.values())
+
+    # Detalhes carregados sob demanda, uma página por vez
+    detalhes = pagamentos.select_related('card').only(
+        'id', 'payment_method', 'amount', 'paid_at', 'card__number'
+    ).order_by('payment_method', '-paid_at')
+    pagina = Paginator(detalhes, PAGAMENTOS_POR_PAGINA).get_page(request.GET.get('pagina'))
 
     context = {
-        'agrupado': dict(agrupado),
-        'totais': dict(totais),
+        'totais': totais,
+        'quantidades': quantidades,
         'total_geral': total_geral,
+        'pagina': pagina,
         'data_filtro': data_filtro,  # passa a data atual no contexto
     }
     return render(request, 'relatorio_recebimentos.html', context)
@@ -118,25 +130,31 @@ def relatorio_recebimentos(request):
 def home(request):
     return render(request, 'restaurants/home.html')
 
-from django.http import HttpResponse
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.contrib.auth.decorators import login_required
+from django.http import FileResponse, HttpResponse, Http404
+from . import cupons, pix
 
 
 def gerar_cupom_pdf(request, payment_id):
-    pagamento = CardPayment.objects.select_related('card', 'restaurant').get(id=payment_id)
-    itens = pagamento.card.card_items.all()
-
-    html_string = render_to_string('cupom.html', {
-        'pagamento': pagamento,
-        'itens': itens,
-        'restaurant_name': pagamento.restaurant.name,
-    })
-
-    pdf_file = HTML(string=html_string).write_pdf()
-
-    response = HttpResponse(pdf_file, content_type='application/pdf')
-    response['Content-Disposition'] = f'inline; filename="cupom_{payment_id}.pdf"'
+    cupom = cupons.carregar_cupom(id=payment_id)
+    # Normalmente o PDF já foi gerado pelo pool ao criar o pagamento
+    caminho = cupons.obter_cupom_pdf(cupom)
+    return FileResponse(open(caminho, 'rb'), content_type='application/pdf', filename=f"cupom_{payment_id}.pdf")
+
+
+@login_required
+def pix_qrcode(request, payment_id):
+    """PNG do QR Code Pix do pagamento, com cache longo no navegador (a URL muda com o payload)"""
+    pagamentos = CardPayment.objects.select_related('card', 'restaurant')
+    if not request.user.is_superuser:
+        pagamentos = pagamentos.filter(restaurant__owner=request.user)
+    pagamento = get_object_or_404(pagamentos, id=payment_id)
+    try:
+        payload = pagamento.pix_payload()
+    except ValueError:
+        payload = None  # chave/cidade fora do padrão: o admin mostra o motivo
+    if not payload:
+        raise Http404("Pagamento sem Pix")
+    response = HttpResponse(pix.qrcode_png(payload), content_type='image/png')
+    response['Cache-Control'] = 'private, max-age=31536000, immutable'
     return response
-
-
@@ -4,9 +4,9 @@ import requests
 from requests.exceptions import RequestException
 import base64
 import threading
-import qrcode
-from io import BytesIO
 from PIL import Image
+from restaurants import pix
+from cliente_comandas import ClienteComandas
 
 # Global variables (minimized)
 API_BASE_URL = "http://103.199.187.28:8001/api/"
@@ -18,6 +18,7 @@ API_BASE_URL = "http://localhost:8000/api/"
 HEADERS = {}
 RESTAURANT_ID = None
 comandas = []
+cliente = ClienteComandas(API_BASE_URL, HEADERS, comandas)
 page = None
 
 def main(page_param: ft.Page):
@@ -137,6 +138,15 @@ def fetch_comandas():
             show_login_screen(error_message="Sessão expirada. Faça login novamente.")
         return []
 
+def renovar_sessao():
+    access_token = cliente.renovar_token(page.client_storage.get("refresh_token"))
+    if access_token:
+        page.client_storage.set("access_token", access_token)
+    return bool(access_token)
+
+def sessao_expirada():
+    show_login_screen(error_message="Sessão expirada. Faça login novamente.")
+
 def create_comanda():
     restaurant_id = page.client_storage.get("restaurant_id")
     print(f"Criando nova comanda... restaurant_id={restaurant_id}")
@@ -206,17 +216,11 @@ def fetch_restaurant_pix_key():
 
 def generate_pix_qr_code(pix_key, amount, restaurant_name):
     print(f"Gerando QR code para Pix: chave={pix_key}, valor={amount}, restaurante={restaurant_name}")
-    pix_payload = f"00020126360014BR.GOV.BCB.PIX0114{pix_key}5204000053039865406{amount:.2f}5802BR5913{restaurant_name[:25]}6008BRASILIA62070503***6304"
-    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_L, box_size=10, border=4)
-    qr.add_data(pix_payload)
-    qr.make(fit=True)
-    qr_image = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    qr_image.save(buffer, format="PNG")
-    return buffer.getvalue()
+    return pix.gerar_qrcode_pix(pix_key, amount, restaurant_name, "BRASILIA")
 
 def show_login_screen(error_message=None):
     print("Exibindo tela de login")
+    cliente.parar_eventos()
     username_field = ft.TextField(
         label="Usuário",
         prefix_icon=ft.Icons.PERSON,
@@ -907,9 +911,9 @@ def show_main_interface():
             page.snack_bar.open = True
             page.update()
 
-    def atualizar_comandas_periodicamente():
+    def atualizar_comandas():
         restaurant_id = page.client_storage.get("restaurant_id")
-        print(f"Atualizando comandas periodicamente... restaurant_id={restaurant_id}")
+        print(f"Atualizando comandas (evento do servidor)... restaurant_id={restaurant_id}")
         if restaurant_id is None:
             print("Erro: restaurant_id não definido. Retornando à tela de login.")
             show_login_screen(error_message="Sessão inválida. Faça login novamente.")
@@ -919,7 +923,6 @@ def show_main_interface():
             if hasattr(page, 'comanda_dropdown') and page.comanda_dropdown:
                 page.comanda_dropdown.options = [ft.dropdown.Option(f"Comanda {c['number']} (ID: {c['id']})") for c in comandas if c["is_active"]]
             page.update()
-            threading.Timer(10.0, atualizar_comandas_periodicamente).start()
         except Exception as e:
             print(f"Erro ao atualizar comandas: {str(e)}")
             if "Faça login novamente" in str(e) or "Autenticação necessária" in str(e):
@@ -928,9 +931,9 @@ def show_main_interface():
                 page.snack_bar = ft.SnackBar(ft.Text(f"Erro ao atualizar comandas: {str(e)}"))
                 page.snack_bar.open = True
                 page.update()
-                threading.Timer(10.0, atualizar_comandas_periodicamente).start()
 
-    threading.Timer(10.0, atualizar_comandas_periodicamente).start()
+    # Atualizações chegam por push (SSE) em vez de polling
+    cliente.iniciar_eventos(atualizar_comandas, renovar_sessao, sessao_expirada)
 
     main_layout = ft.Column(
         [